@@ -3,6 +3,14 @@ import aiohttp
 import pandas as pd
 import json
 import logging
+import os,sys
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_session import use_session
+from rate_limiter import get_rate_limiter, request_with_retry
+
+MM_API_URL = "https://api.megamarket.tech"
 
 logging.basicConfig(
     filename="update_prices_mm.log",
@@ -11,9 +19,9 @@ logging.basicConfig(
     datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-async def update_prices_mm(df, token, offer_id_col, price_col, is_deleted_col, debug=False):
-    async with aiohttp.ClientSession() as session:
-        url = "https://api.megamarket.tech/api/merchantIntegration/v1/offerService/manualPrice/save"
+async def update_prices_mm(df, token, offer_id_col, price_col, is_deleted_col, debug=False, session=None, rate_limit=None):
+    async with use_session(session) as session:
+        url = f"{MM_API_URL}/api/merchantIntegration/v1/offerService/manualPrice/save"
 
         prices = []
         for _, row in df.iterrows():
@@ -41,22 +49,21 @@ async def update_prices_mm(df, token, offer_id_col, price_col, is_deleted_col, d
             logging.info("Отправляемые данные:")
             logging.info(json.dumps(data, indent=2))
         else:
-            async with session.post(url, headers={"Content-Type": "application/json"}, data=json.dumps(data)) as response:
-                if response.status == 200:
-                    try:
-                        response_data = await response.json()
-                        logging.info(f"Цены для товара с артикулом {offer_id} успешно обновлены!")
-                        logging.info(f"Ответ сервера: {response_data}")
-                    except aiohttp.client_exceptions.ContentTypeError:
-                        response_text = await response.text()
-                        logging.error(f"Ошибка при обновлении цен для товара с артикулом {offer_id}: {response_text}")
-                        logging.info(f"Статус ответа: {response.status}")
-                        logging.info(f"Заголовки ответа: {response.headers}")
-                else:
-                    response_text = await response.text()
-                    logging.error(f"Ошибка при отправке в МегаМаркет цен для товара с артикулом {offer_id}: {response_text}")
+            response = await request_with_retry(session, "POST", url, get_rate_limiter("mm", token, rate_limit),
+                                                headers={"Content-Type": "application/json"}, data=json.dumps(data))
+            if response.status == 200:
+                try:
+                    response_data = response.json()
+                    logging.info(f"Цены для товара с артикулом {offer_id} успешно обновлены!")
+                    logging.info(f"Ответ сервера: {response_data}")
+                except json.JSONDecodeError:
+                    logging.error(f"Ошибка при обновлении цен для товара с артикулом {offer_id}: {response.text}")
                     logging.info(f"Статус ответа: {response.status}")
                     logging.info(f"Заголовки ответа: {response.headers}")
+            else:
+                logging.error(f"Ошибка при отправке в МегаМаркет цен для товара с артикулом {offer_id}: {response.text}")
+                logging.info(f"Статус ответа: {response.status}")
+                logging.info(f"Заголовки ответа: {response.headers}")
 
 # Пример использования
 df = pd.DataFrame({
@@ -8,6 +8,11 @@ import os,sys
 # Добавляем корневую директорию проекта в sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import logger  # Импортируем настроенный логгер
+from config import OZON_PRICE_BATCH_SIZE, OZON_MAX_CONCURRENT_CHUNKS
+from http_session import use_session
+from rate_limiter import get_rate_limiter, request_with_retry
+
+OZON_API_URL = "https://api-seller.ozon.ru"
 
 def prepare_dataframe_for_json(df):
     # Подготовка DataFrame путем преобразования числовых столбцов в строки (кроме product_id)
@@ -17,82 +22,132 @@ def prepare_dataframe_for_json(df):
     return df
 
 
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _parse_import_result(chunk, response_data):
+    """Разбирает ответ /v1/product/import/prices и возвращает результат по каждому product_id чанка"""
+    results = {}
+    for item in response_data.get("result") or []:
+        product_id = item.get("product_id")
+        errors = [error.get("message") or error.get("code") for error in item.get("errors") or []]
+        results[product_id] = {"offer_id": item.get("offer_id"), "updated": bool(item.get("updated")), "errors": errors}
+    # Товары, которых нет в ответе, считаем необновленными
+    for price in chunk:
+        if price["product_id"] not in results:
+            results[price["product_id"]] = {"offer_id": price["offer_id"], "updated": False,
+                                            "errors": ["Товар отсутствует в ответе Ozon"]}
+    return results
+
+
+async def _send_chunk(session, semaphore, limiter, chunk, headers, chunk_number):
+    async with semaphore:
+        logger.info(f"Отправка пакета цен в Ozon", chunk=chunk_number, items=len(chunk))
+        try:
+            response = await request_with_retry(session, "POST", f"{OZON_API_URL}/v1/product/import/prices",
+                                                limiter, json={"prices": chunk}, headers=headers)
+            response_text = response.text  # Получаем текст ответа
+            logger.info(f"Статус ответа: {response.status}", chunk=chunk_number)  # Логируем статус ответа
+            if response.status != 200:
+                logger.error(f"Ошибка при отправке в OZON пакета цен: {response_text}", chunk=chunk_number)
+                return {price["product_id"]: {"offer_id": price["offer_id"], "updated": False, "errors": [response_text]}
+                        for price in chunk}
+            try:
+                response_data = json.loads(response_text)  # Разбираем JSON-ответ
+            except json.JSONDecodeError:
+                logger.error(f"Ошибка при декодировании JSON ответа для пакета цен", chunk=chunk_number)
+                return {price["product_id"]: {"offer_id": price["offer_id"], "updated": False,
+                                              "errors": ["Некорректный JSON в ответе"]}
+                        for price in chunk}
+            return _parse_import_result(chunk, response_data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Ошибка соединения при отправке пакета цен в OZON", chunk=chunk_number, error=str(e))
+            return {price["product_id"]: {"offer_id": price["offer_id"], "updated": False, "errors": [str(e) or type(e).__name__]}
+                    for price in chunk}
+
+
 async def update_prices_ozon(df: pd.DataFrame, new_price_col: str, base_old_price_col: str, old_price_col: str,
                              product_id_col: str, offer_id_col: str, min_price_col: str,
-                             client_id: str, api_key: str, debug: bool = False):
+                             client_id: str, api_key: str, debug: bool = False,
+                             batch_size: int = OZON_PRICE_BATCH_SIZE, max_concurrent_chunks: int = OZON_MAX_CONCURRENT_CHUNKS,
+                             session: aiohttp.ClientSession = None, rate_limit: dict = None):
+    """Отправляет цены в Ozon пакетами до batch_size товаров (не больше 1000 по ограничению метода),
+    выполняя одновременно не более max_concurrent_chunks запросов через общую сессию session (если передана).
+    Частота запросов ограничивается лимитами кабинета (rate_limit или RATE_LIMITS), ответы 429 и 5xx повторяются.
+    Возвращает словарь {product_id: {"offer_id", "updated", "errors"}} с результатом по каждому товару"""
     df = prepare_dataframe_for_json(df)  # Подготовка данных для JSON
 
-    async with aiohttp.ClientSession() as session:  # Создаем асинхронную сессию для HTTP-запросов
-        for _, row in df.iterrows():
-            product_id = int(row[product_id_col])  # Получаем ID продукта
-            offer_id = str(row[offer_id_col])  # Получаем ID предложения
+    prices = []
+    for _, row in df.iterrows():
+        product_id = int(row[product_id_col])  # Получаем ID продукта
+        offer_id = str(row[offer_id_col])  # Получаем ID предложения
 
-            new_price = int(round(float(row[new_price_col])))  # Получаем новую цену
-            try:
-                min_price = int(round(float(row[min_price_col])))
+        new_price = int(round(float(row[new_price_col])))  # Получаем новую цену
+        try:
+            min_price = int(round(float(row[min_price_col])))
 
-            except ValueError:
-                min_price = 0
+        except ValueError:
+            min_price = 0
 
-            # Пытаемся преобразовать base_old_price в целое число
+        # Пытаемся преобразовать base_old_price в целое число
+        try:
+            old_price = int(round(float(row[old_price_col])))  # Получаем старую цену
+        except ValueError:
+            logger.debug("invalid_discount_base", message="Недопустимое значение базы скидки",
+                         offer_id=offer_id, discount_base=row[old_price_col])
             try:
-                old_price = int(round(float(row[old_price_col])))  # Получаем старую цену
-            except ValueError:
-                logger.warning(
-                    f"Недопустимое значение базы скидки для offer_id: {offer_id}, discount_base: {row[old_price_col]}")
-                try:
-
-                    old_price = int(round(float(row[base_old_price_col])))
-                except :
-                    old_price = 0  # Значение по умолчанию, если преобразование не удалось
-                    logger.warning(f"Установлено значение по умолчанию для старой цены : {0}")
-
-                # Подготовка полезной нагрузки для запроса
-            payload = {
-                "prices": [
-                    {
-                        "auto_action_enabled": "UNKNOWN",
-                        "currency_code": "RUB",
-                        "min_price": str(min_price),
-                        "offer_id": str(offer_id),
-                        "old_price": str(old_price),
-                        "price": str(new_price),
-                        "price_strategy_enabled": "UNKNOWN",
-                        "product_id": product_id
-                    }
-                ]
-            }
-
-            headers = {
-                "Client-Id": client_id,
-                "Api-Key": api_key,
-                "Content-Type": "application/json"
-            }
-
-            logger.info(f"Отправляемые данные: {json.dumps(payload, ensure_ascii=False)}")  # Логируем полезную нагрузку
-
-            if debug:
-                logger.info(f"Режим отладки: Запрос не отправлен. Данные: {json.dumps(payload, ensure_ascii=False)}")
-            else:
-                async with session.post("https://api-seller.ozon.ru/v1/product/import/prices", json=payload,
-                                        headers=headers) as response:
-                    response_text = await response.text()  # Получаем текст ответа
-                    logger.info(f"Статус ответа: {response.status}")  # Логируем статус ответа
-                    logger.info(f"Текст ответа: {response_text}")  # Логируем текст ответа
-                    logger.info(f"Заголовки ответа: {response.headers}")  # Логируем заголовки ответа
-
-                    if response.status == 200:
-                        try:
-                            response_data = json.loads(response_text)  # Разбираем JSON-ответ
-                            if response_data.get("result"):
-                                logger.info(f"Цена товара с product_id {product_id} успешно обновлена.")
-                            else:
-                                error_message = response_data.get("error", {}).get("message", "Неизвестная ошибка")
-                                logger.error(f"Ошибка при обновлении цены товара с product_id {product_id}: {error_message}")
-                        except json.JSONDecodeError:
-                            logger.error(f"Ошибка при декодировании JSON ответа для товара с product_id {product_id}")
-                    else:
-                        logger.error(f"Ошибка при отправке в OZON цены товара с product_id {product_id}: {response_text}")
+
+                old_price = int(round(float(row[base_old_price_col])))
+            except :
+                old_price = 0  # Значение по умолчанию, если преобразование не удалось
+                logger.debug("old_price_default_used", message="Установлено значение по умолчанию для старой цены",
+                             offer_id=offer_id, old_price=old_price)
+
+        prices.append({
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "min_price": str(min_price),
+            "offer_id": str(offer_id),
+            "old_price": str(old_price),
+            "price": str(new_price),
+            "price_strategy_enabled": "UNKNOWN",
+            "product_id": product_id
+        })
+
+    headers = {
+        "Client-Id": client_id,
+        "Api-Key": api_key,
+        "Content-Type": "application/json"
+    }
+
+    batch_size = max(1, min(batch_size, 1000))
+    chunks = list(_chunks(prices, batch_size))
+    logger.info(f"Подготовлено товаров для обновления цен в Ozon: {len(prices)}", chunks=len(chunks))
+
+    if debug:
+        for chunk in chunks:
+            logger.info(f"Режим отладки: Запрос не отправлен. Данные: {json.dumps({'prices': chunk}, ensure_ascii=False)}")
+        return {}
+
+    semaphore = asyncio.Semaphore(max_concurrent_chunks)
+    limiter = get_rate_limiter("ozon", client_id, rate_limit)  # Лимиты Ozon считаются на кабинет продавца
+    results = {}
+    async with use_session(session) as session:  # Общая сессия или временная для HTTP-запросов
+        for chunk_results in await asyncio.gather(*(_send_chunk(session, semaphore, limiter, chunk, headers, number)
+                                                    for number, chunk in enumerate(chunks, start=1))):
+            results.update(chunk_results)
+
+    for product_id, result in results.items():
+        if result["updated"]:
+            logger.debug("item_price_updated", message="Цена товара успешно обновлена", product_id=product_id)
+        else:
+            logger.debug("item_price_update_failed", message="Ошибка при обновлении цены товара", product_id=product_id,
+                         errors="; ".join(result["errors"]) or "Неизвестная ошибка")
+    updated = sum(1 for result in results.values() if result["updated"])
+    logger.info("Обновление цен в Ozon завершено", updated=updated, failed=len(results) - updated)
+    return results
 
 # Пример использования
 df = pd.DataFrame({
@@ -1,4 +1,6 @@
 import asyncio
+import json
+import random
 import aiohttp
 import pandas as pd
 import sys
@@ -8,10 +10,160 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from logger import logger
+from config import (WB_PRICE_BATCH_SIZE, WB_MAX_CONCURRENT_CHUNKS, WB_TASK_POLL_TIMEOUT,
+                    WB_TASK_POLL_INITIAL_DELAY, WB_TASK_POLL_MAX_DELAY)
+from http_session import use_session
+from rate_limiter import get_rate_limiter, request_with_retry
 
 
-async def update_prices_wb(df, nmID_col, price_col, discount_col, disc_old_col, api_key: str, debug: bool = False):
-    url = f"https://discounts-prices-api.wildberries.ru/api/v2/upload/task"
+WB_API_URL = "https://discounts-prices-api.wildberries.ru"
+
+# Статусы загрузки из /api/v2/history/tasks
+WB_TASK_FINAL_STATUSES = {3, 4, 5, 6}  # 3 - обработана, 4 - отменена, 5 - обработана с ошибками, 6 - все товары с ошибками
+WB_ALREADY_EXISTS_STATUS = 208  # такая же загрузка уже создана раньше
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _chunk_outcome(chunk, status, error):
+    return {good["nmID"]: {"status": status, "error": error} for good in chunk}
+
+
+async def _get_json(session, limiter, url, headers, params):
+    response = await request_with_retry(session, "GET", url, limiter, headers=headers, params=params)
+    if response.status != 200:
+        return None
+    try:
+        return response.json()
+    except json.JSONDecodeError:
+        return None
+
+
+async def _upload_chunk(session, limiter, headers, chunk, chunk_number):
+    """Создает задачу загрузки для пакета товаров, возвращает (uploadID, текст ошибки, загрузка уже существует).
+    Создание задачи не идемпотентно, поэтому повторяются только ответы 429 и ошибки установки соединения"""
+    logger.info("Подготовка к отправке запроса API в Wildberries",
+                url=f"{WB_API_URL}/api/v2/upload/task", payload_size=len(chunk), chunk=chunk_number)
+    response = await request_with_retry(session, "POST", f"{WB_API_URL}/api/v2/upload/task", limiter,
+                                        idempotent=False, headers=headers, json={"data": chunk})
+    if response.status == WB_ALREADY_EXISTS_STATUS:
+        logger.info("Такая загрузка цен и скидок уже существует, повторная отправка не нужна", chunk=chunk_number)
+        return None, None, True
+    if response.status == 200:
+        try:
+            response_data = response.json()
+        except json.JSONDecodeError:
+            logger.warning("Ошибка при разборе ответа от API",
+                           status=response.status,
+                           headers=dict(response.headers),
+                           response_text=response.text)
+            return None, response.text, False
+        if response_data.get("error", False):
+            error_text = response_data.get("errorText", "Неизвестная ошибка")
+            logger.warning("Ошибка при обновлении цен и скидок",
+                           error=error_text,
+                           response=response_data)
+            return None, error_text, False
+        data = response_data.get("data") or {}
+        if data.get("alreadyExists"):
+            logger.info("Такая загрузка цен и скидок уже существует, повторная отправка не нужна",
+                        upload_id=data.get("id"), chunk=chunk_number)
+            return data.get("id"), None, True
+        logger.info("Задача загрузки цен и скидок создана", upload_id=data.get("id"), chunk=chunk_number)
+        return data.get("id"), None, False
+    logger.warning("Ошибка при отправке запроса в Wildberries",
+                   status=response.status,
+                   headers=dict(response.headers),
+                   response_text=response.text)
+    return None, response.text, False
+
+
+async def _wait_for_task(session, limiter, headers, upload_id, timeout, initial_delay, max_delay):
+    """Опрашивает задачу с экспоненциальной задержкой, возвращает итоговый статус или None по таймауту.
+    Пока задача обрабатывается, она находится в буфере (/api/v2/buffer/tasks); итоговый статус
+    читается из истории (/api/v2/history/tasks) только после того, как задача покинула буфер"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = initial_delay
+    params = {"uploadID": upload_id}
+    while True:
+        buffer = await _get_json(session, limiter, f"{WB_API_URL}/api/v2/buffer/tasks", headers, params)
+        if ((buffer or {}).get("data") or {}).get("status") is None:
+            history = await _get_json(session, limiter, f"{WB_API_URL}/api/v2/history/tasks", headers, params)
+            status = ((history or {}).get("data") or {}).get("status")
+            if status in WB_TASK_FINAL_STATUSES:
+                return status
+        if loop.time() + delay > deadline:
+            return None
+        await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+        delay = min(delay * 2, max_delay)
+
+
+async def _task_goods_errors(session, limiter, headers, upload_id):
+    """Возвращает {nmID: текст ошибки} для товаров обработанной задачи"""
+    errors = {}
+    offset = 0
+    limit = 1000
+    while True:
+        result = await _get_json(session, limiter, f"{WB_API_URL}/api/v2/history/goods/task", headers,
+                                 {"uploadID": upload_id, "limit": limit, "offset": offset})
+        goods = ((result or {}).get("data") or {}).get("historyGoods") or []
+        for good in goods:
+            errors[good.get("nmID")] = good.get("errorText") or ""
+        if len(goods) < limit:
+            return errors
+        offset += limit
+
+
+async def _process_chunk(session, semaphore, limiter, headers, chunk, chunk_number, poll_timeout, poll_initial_delay, poll_max_delay):
+    async with semaphore:
+        try:
+            upload_id, error_text, already_exists = await _upload_chunk(session, limiter, headers, chunk, chunk_number)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Ошибка соединения при отправке запроса в Wildberries", chunk=chunk_number,
+                           error=str(e) or type(e).__name__)
+            return _chunk_outcome(chunk, "rejected", str(e) or type(e).__name__)
+    if already_exists:
+        return _chunk_outcome(chunk, "applied", "")
+    if upload_id is None:
+        return _chunk_outcome(chunk, "rejected", error_text)
+
+    try:
+        status = await _wait_for_task(session, limiter, headers, upload_id, poll_timeout, poll_initial_delay, poll_max_delay)
+        if status is None:
+            logger.warning("Задача загрузки не завершилась за отведенное время", upload_id=upload_id, chunk=chunk_number)
+            return _chunk_outcome(chunk, "pending", "Задача еще обрабатывается")
+        if status == 3:
+            return _chunk_outcome(chunk, "applied", "")
+        if status == 4:
+            return _chunk_outcome(chunk, "error", "Задача отменена")
+        goods_errors = await _task_goods_errors(session, limiter, headers, upload_id)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Ошибка соединения при опросе статуса задачи", upload_id=upload_id,
+                       error=str(e) or type(e).__name__)
+        return _chunk_outcome(chunk, "pending", str(e) or type(e).__name__)
+
+    outcome = {}
+    for good in chunk:
+        error = goods_errors.get(good["nmID"], "")
+        if status == 6 and not error:
+            error = "Товар не обработан"
+        outcome[good["nmID"]] = {"status": "error" if error else "applied", "error": error}
+    return outcome
+
+
+async def update_prices_wb(df, nmID_col, price_col, discount_col, disc_old_col, api_key: str, debug: bool = False,
+                           batch_size: int = WB_PRICE_BATCH_SIZE, max_concurrent_chunks: int = WB_MAX_CONCURRENT_CHUNKS,
+                           poll_timeout: float = WB_TASK_POLL_TIMEOUT, poll_initial_delay: float = WB_TASK_POLL_INITIAL_DELAY,
+                           poll_max_delay: float = WB_TASK_POLL_MAX_DELAY, session: aiohttp.ClientSession = None,
+                           rate_limit: dict = None):
+    """Отправляет цены и скидки в Wildberries задачами загрузки до batch_size товаров (лимит API - 1000),
+    одновременно обрабатывая не более max_concurrent_chunks задач, и дожидается их обработки.
+    Запросы идут через общую сессию session, если она передана, с учетом лимитов API (rate_limit или RATE_LIMITS) и повтором ответов 429 и 5xx.
+    Возвращает словарь {nmID: {"status": "applied" | "error" | "pending" | "rejected", "error": текст}}"""
     headers = {
         "Authorization": api_key,
         "Content-Type": "application/json"
@@ -19,73 +171,65 @@ async def update_prices_wb(df, nmID_col, price_col, discount_col, disc_old_col,
     goods = []
     logger.info("Начало обработки данных для обновления цен и скидок")
     for index, row in df.iterrows():
-        logger.info(f"Обработка строки {index + 1}/{len(df)}")
+        # Построчные события ограничиваются LOG_ROW_EVENTS_PER_SECOND по имени события
+        logger.debug("row_processing", message="Обработка строки", row=index + 1, rows=len(df))
         try:
             nmID = int(row[nmID_col])
             price = int(row[price_col])
-            logger.info(f"Успешно получены nmID: {nmID} и цена: {price}")
+            logger.debug("row_parsed", message="Получены nmID и цена", nmID=nmID, price=price)
         except (ValueError, TypeError):
-            logger.error(f"Ошибка при преобразовании nmID или цены в строке {index + 1}. Пропуск строки.")
+            logger.error("row_skipped", message="Ошибка при преобразовании nmID или цены, строка пропущена",
+                         row=index + 1)
             continue
 
         try:
             discount = int(row[discount_col])
-            logger.info(f"Успешно получена скидка из основной колонки: {discount}")
+            logger.debug("discount_from_main_column", message="Получена скидка из основной колонки",
+                         nmID=nmID, discount=discount)
         except (ValueError, TypeError):
-            logger.warning(f"Не удалось получить скидку из основной колонки '{discount_col}'. Попытка использовать резервную колонку '{disc_old_col}'.")
+            logger.debug("discount_main_column_invalid", message="Не удалось получить скидку из основной колонки",
+                         nmID=nmID, column=discount_col, fallback_column=disc_old_col)
             try:
                 discount = int(row[disc_old_col])
-                logger.info(f"Успешно получена скидка из резервной колонки: {discount}")
+                logger.debug("discount_from_backup_column", message="Получена скидка из резервной колонки",
+                             nmID=nmID, discount=discount)
             except (ValueError, TypeError):
                 discount = 0
-                logger.warning(f"Не удалось получить корректное значение скидки. Установлено значение по умолчанию: {discount}")
+                logger.debug("discount_default_used", message="Не удалось получить корректное значение скидки",
+                             nmID=nmID, discount=discount)
 
         goods.append({
             "nmID": nmID,
             "price": price,
             "discount": discount
         })
-        logger.info(f"Добавлен товар: nmID={nmID}, price={price}, discount={discount}")
+        logger.debug("item_added", message="Добавлен товар", nmID=nmID, price=price, discount=discount)
 
-    payload = {
-        "data": goods
-    }
+    chunks = list(_chunks(goods, max(1, min(batch_size, 1000))))
 
     if debug:
         logger.warning("Включен режим отладки для WB. Запрос к API не будет отправлен.",
-                       payload=payload)
-        return {"error": False, "errorText": ""}
-    else:
-        logger.info("Подготовка к отправке запроса API в Wildberries",
-                    url=url, payload_size=len(goods))
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    try:
-                        response_data = await response.json()
-                        if response_data.get("error", False):
-                            error_text = response_data.get("errorText", "Неизвестная ошибка")
-                            logger.warning("Ошибка при обновлении цен и скидок",
-                                           error=error_text,
-                                           response=response_data)
-                        else:
-                            logger.info("Цены и скидки успешно обновлены",
-                                        response=response_data)
-                        return response_data
-                    except aiohttp.client_exceptions.ContentTypeError:
-                        response_text = await response.text()
-                        logger.warning("Ошибка при разборе ответа от API",
-                                       status=response.status,
-                                       headers=dict(response.headers),
-                                       response_text=response_text)
-                        return {"error": True, "errorText": response_text}
-                else:
-                    response_text = await response.text()
-                    logger.warning("Ошибка при отправке запроса в Wildberries",
-                                   status=response.status,
-                                   headers=dict(response.headers),
-                                   response_text=response_text)
-                    return {"error": True, "errorText": response_text}
+                       payload={"data": goods}, chunks=len(chunks))
+        return {}
+
+    semaphore = asyncio.Semaphore(max_concurrent_chunks)
+    limiter = get_rate_limiter("wb", api_key, rate_limit)
+    outcomes = {}
+    async with use_session(session) as session:
+        for chunk_outcome in await asyncio.gather(*(_process_chunk(session, semaphore, limiter, headers, chunk, number,
+                                                                   poll_timeout, poll_initial_delay, poll_max_delay)
+                                                    for number, chunk in enumerate(chunks, start=1))):
+            outcomes.update(chunk_outcome)
+
+    summary = {}
+    for nmID, outcome in outcomes.items():
+        summary[outcome["status"]] = summary.get(outcome["status"], 0) + 1
+        if outcome["status"] != "applied":
+            logger.debug("item_price_not_applied", message="Цена товара не применена Wildberries",
+                         nmID=nmID, status=outcome["status"], error=outcome["error"])
+    log = logger.info if set(summary) <= {"applied"} else logger.warning
+    log("Обновление цен и скидок в Wildberries завершено", tasks=len(chunks), **summary)
+    return outcomes
 
 if __name__ == "__main__":
     # Пример DataFrame
@@ -2,86 +2,143 @@ import asyncio
 import aiohttp
 import pandas as pd
 import json
+import re
 import os,sys
 
 
 # Добавляем корневую директорию проекта в sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from logger import logger  # Импортируем настроенный логгер
+from config import YM_PRICE_BATCH_SIZE, YM_MAX_CONCURRENT_CHUNKS
+from http_session import use_session
+from rate_limiter import get_rate_limiter, request_with_retry
 
+YM_API_URL = "https://api.partner.market.yandex.ru"
 
-async def update_price_ym(df, access_token, campaign_id, offer_id_col, disc_old_col, new_price_col, discount_base_col, debug=False):
-    async with aiohttp.ClientSession() as session:  # Создаем асинхронную сессию для HTTP-запросов
-        tasks = []  # Список для хранения задач
-        for _, row in df.iterrows():
-            offer_id = row[offer_id_col]  # Получаем идентификатор предложения
-            new_price = row[new_price_col]  # Получаем новую цену
-            discount_base = row[discount_base_col]  # Получаем базу скидки
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
-            currency_id = "RUR"  # Устанавливаем валюту
 
-            # Пытаемся преобразовать discount_base в целое число
+def _map_errors(chunk, errors):
+    """Сопоставляет ошибки ответа с offerId: ошибка с offerId (в самом объекте или в тексте)
+    относится к этому предложению, остальные - ко всем предложениям пакета"""
+    offer_ids = [str(offer["offerId"]) for offer in chunk]
+    results = {offer_id: {"updated": True, "errors": []} for offer_id in offer_ids}
+    for error in errors:
+        message = error.get("message") or error.get("code") or "Неизвестная ошибка"
+        offer_id = error.get("offerId")
+        if offer_id is not None and str(offer_id) in results:
+            targets = [str(offer_id)]
+        else:
+            targets = [o for o in offer_ids
+                       if re.search(rf"(?<![\w-]){re.escape(o)}(?![\w-])", message)] or offer_ids
+        for target in targets:
+            results[target]["updated"] = False
+            results[target]["errors"].append(message)
+    return results
+
+
+async def _send_chunk(session, semaphore, limiter, url, headers, chunk, chunk_number):
+    async with semaphore:
+        logger.info("Отправка пакета цен в Яндекс.Маркет", chunk=chunk_number, offers=len(chunk))
+        try:
+            response = await request_with_retry(session, "POST", url, limiter, headers=headers,
+                                                data=json.dumps({"offers": chunk}, ensure_ascii=False).encode())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения при отправке пакета цен в Яндекс.Маркет", chunk=chunk_number,
+                         error=str(e) or type(e).__name__)
+            return _map_errors(chunk, [{"message": str(e) or type(e).__name__}])
+        response_text = response.text  # Получаем текст ответа
+        try:
+            response_data = json.loads(response_text)  # Разбираем JSON-ответ
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка при разборе JSON ответа для пакета цен: {str(e)}", chunk=chunk_number,
+                         status=response.status)
+            return _map_errors(chunk, [{"message": response_text or str(e)}])
+
+    errors = response_data.get("errors") or []
+    if response.status == 200 and response_data.get("status") != "ERROR" and response_data.get('success') != 0 and not errors:
+        return _map_errors(chunk, [])
+    if not errors:
+        errors = [response_data.get('error') or {"message": f"Статус ответа: {response.status}"}]
+    logger.error("Ошибка при отправке в Яндекс.Маркет пакета цен", chunk=chunk_number, status=response.status,
+                 errors=errors)
+    return _map_errors(chunk, errors)
+
+
+async def update_price_ym(df, access_token, campaign_id, offer_id_col, disc_old_col, new_price_col, discount_base_col, debug=False,
+                          batch_size=YM_PRICE_BATCH_SIZE, max_concurrent_chunks=YM_MAX_CONCURRENT_CHUNKS, session=None,
+                          rate_limit=None):
+    """Отправляет цены в Яндекс.Маркет пакетами до batch_size предложений, выполняя одновременно
+    не более max_concurrent_chunks запросов через общую сессию session (если передана) с учетом лимитов API
+    (rate_limit или RATE_LIMITS).
+    Возвращает словарь {offer_id: {"updated", "errors"}}"""
+    offers = []
+    for _, row in df.iterrows():
+        offer_id = row[offer_id_col]  # Получаем идентификатор предложения
+        new_price = row[new_price_col]  # Получаем новую цену
+        discount_base = row[discount_base_col]  # Получаем базу скидки
+
+        currency_id = "RUR"  # Устанавливаем валюту
+
+        # Пытаемся преобразовать discount_base в целое число
+        try:
+            discount_base = int(discount_base)
+        except ValueError:
+            logger.debug("invalid_discount_base", message="Недопустимое значение базы скидки",
+                         offer_id=offer_id, discount_base=discount_base)
             try:
-                discount_base = int(discount_base)
-            except ValueError:
-                logger.warning("Недопустимое значение базы скидки", offer_id=offer_id, discount_base=discount_base)
-                try:
-                    discount = int(row[disc_old_col])
-                    logger.info(f"Успешно получена скидка из резервной колонки: {discount}")
-                except (ValueError, TypeError):
-                    discount = 0  # Значение по умолчанию, если преобразование не удалось
-                    logger.warning(f"Не удалось получить корректное значение скидки. Установлено значение по умолчанию: {discount}")
-
-            # Подготовка данных для запроса
-            data = {
-                "offers": [
-                    {
-                        "offerId": offer_id,
-                        "price": {
-                            "value": new_price,
-                            "currencyId": currency_id,
-                            "discountBase": discount_base
-                        }
-                    }
-                ]
-            }
+                discount_base = int(row[disc_old_col])
+                logger.debug("discount_from_backup_column", message="Получена скидка из резервной колонки",
+                             offer_id=offer_id, discount_base=discount_base)
+            except (ValueError, TypeError):
+                discount_base = 0  # Значение по умолчанию, если преобразование не удалось
+                logger.debug("discount_default_used", message="Не удалось получить корректное значение скидки",
+                             offer_id=offer_id, discount_base=discount_base)
 
-            url = f"https://api.partner.market.yandex.ru/businesses/{campaign_id}/offer-prices/updates"  # URL для обновления цен
-            headers = {
-                "Content-Type": "application/json",
-                "Api-Key": access_token  # Заголовок с токеном доступа
+        offers.append({
+            "offerId": offer_id,
+            "price": {
+                "value": new_price,
+                "currencyId": currency_id,
+                "discountBase": discount_base
             }
+        })
+
+    url = f"{YM_API_URL}/businesses/{campaign_id}/offer-prices/updates"  # URL для обновления цен
+    headers = {
+        "Content-Type": "application/json",
+        "Api-Key": access_token  # Заголовок с токеном доступа
+    }
+
+    chunks = list(_chunks(offers, max(1, min(batch_size, 500))))
+    logger.info(f"Подготовлено предложений для обновления цен в Яндекс.Маркете: {len(offers)}", chunks=len(chunks))
+
+    if debug:
+        logger.info("Режим отладки включен. Запрос не будет отправлен.")
+        for chunk in chunks:
+            logger.info("Отправляемые данные:")
+            logger.info(json.dumps({"offers": chunk}, ensure_ascii=False, indent=2))  # Предотвращаем экранирование Unicode в логах
+        return {}
+
+    semaphore = asyncio.Semaphore(max_concurrent_chunks)
+    limiter = get_rate_limiter("ym", access_token, rate_limit)
+    results = {}
+    async with use_session(session) as session:  # Общая сессия или временная для HTTP-запросов
+        for chunk_results in await asyncio.gather(*(_send_chunk(session, semaphore, limiter, url, headers, chunk, number)
+                                                    for number, chunk in enumerate(chunks, start=1))):
+            results.update(chunk_results)
 
-            if debug:
-                logger.info("Режим отладки включен. Запрос не будет отправлен.")
-                logger.info("Отправляемые данные:")
-                logger.info(json.dumps(data, ensure_ascii=False, indent=2))  # Предотвращаем экранирование Unicode в логах
-            else:
-                task = asyncio.create_task(session.post(url, headers=headers, data=json.dumps(data, ensure_ascii=False)))  # Отправляем POST-запрос
-                tasks.append((offer_id, task))  # Добавляем задачу в список
-
-        if not debug:
-            for offer_id, task in tasks:
-                response = await task  # Ждем завершения задачи
-                response_text = await response.text()  # Получаем текст ответа
-
-                logger.info(f"Полный ответ сервера для товара с ID {offer_id}:")
-                logger.info(response_text)
-
-                if response.status == 200:
-                    try:
-                        response_data = json.loads(response_text)  # Разбираем JSON-ответ
-                        if response_data.get('success') == 0:
-                            error_message = response_data.get('error', {}).get('message', 'Неизвестная ошибка')
-                            logger.error(f"Ошибка при обновлении цены для товара с ID {offer_id}: {error_message}")
-                        else:
-                            logger.info(f"Цена для товара с ID {offer_id} успешно обновлена!")
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Ошибка при разборе JSON для товара с ID {offer_id}: {str(e)}")
-                else:
-                    logger.error(f"Ошибка при отправке в Яндекс.Маркет цены для товара с ID {offer_id}")
-                    logger.info(f"Статус ответа: {response.status}")
-                    logger.info(f"Заголовки ответа: {response.headers}")
+    for offer_id, result in results.items():
+        if result["updated"]:
+            logger.debug("item_price_updated", message="Цена товара успешно обновлена", offer_id=offer_id)
+        else:
+            logger.debug("item_price_update_failed", message="Ошибка при обновлении цены товара",
+                         offer_id=offer_id, errors="; ".join(result["errors"]))
+    updated = sum(1 for result in results.values() if result["updated"])
+    logger.info("Обновление цен в Яндекс.Маркете завершено", updated=updated, failed=len(results) - updated)
+    return results
 
 # Основная функция
 async def main():
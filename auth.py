@@ -1,47 +1,144 @@
-
+import asyncio
 import os.path
+import threading
+from datetime import datetime, timedelta, timezone
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build
+from config import TOKEN_REFRESH_AHEAD_SECONDS
 from logger import logger  # Импорт логгера
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-async def get_credentials():
-    logger.info("Запуск функции get_credentials")
+# Общие для всего процесса учетные данные и клиент Sheets API
+_creds = None
+_service = None
+_refresh_lock = asyncio.Lock()
+_refresh_task = None
+_thread_local = threading.local()
+
+
+def _save_credentials(creds):
+    logger.debug("Сохранение новых учетных данных в token.json")
+    try:
+        with open("token.json", "w") as token:
+            token.write(creds.to_json())
+        logger.info("Новые учетные данные сохранены в token.json")
+    except Exception as e:
+        logger.error("Не удалось сохранить учетные данные в token.json", error=str(e))
+
+
+def _load_credentials():
+    """Загружает учетные данные из token.json, при их отсутствии запускает процесс аутентификации"""
     creds = None
     if os.path.exists("token.json"):
         logger.debug("Найден существующий файл token.json")
         creds = Credentials.from_authorized_user_file("token.json", SCOPES)
         logger.info("Загружены учетные данные из token.json")
 
-    if not creds or not creds.valid:
-        logger.info("Учетные данные отсутствуют или недействительны")
-        if creds and creds.expired and creds.refresh_token:
-            logger.info("Обновление просроченных учетных данных")
-            try:
-                creds.refresh(Request())
-                logger.info("Учетные данные успешно обновлены")
-            except Exception as e:
-                logger.error("Не удалось обновить учетные данные", error=str(e))
-        else:
-            logger.info("Инициация нового процесса аутентификации")
-            try:
-                flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-                creds = flow.run_local_server(port=0)
-                logger.info("Получены новые учетные данные через локальный сервер")
-            except Exception as e:
-                logger.error("Не удалось получить новые учетные данные", error=str(e))
-                raise
-
-        logger.debug("Сохранение новых учетных данных в token.json")
+    if not creds or (not creds.valid and not (creds.expired and creds.refresh_token)):
+        logger.info("Инициация нового процесса аутентификации")
         try:
-            with open("token.json", "w") as token:
-                token.write(creds.to_json())
-            logger.info("Новые учетные данные сохранены в token.json")
+            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+            creds = flow.run_local_server(port=0)
+            logger.info("Получены новые учетные данные через локальный сервер")
         except Exception as e:
-            logger.error("Не удалось сохранить учетные данные в token.json", error=str(e))
-
-    logger.info("Учетные данные успешно получены")
+            logger.error("Не удалось получить новые учетные данные", error=str(e))
+            raise
+        _save_credentials(creds)
     return creds
 
+
+def _refresh_credentials(creds):
+    logger.info("Обновление учетных данных")
+    try:
+        creds.refresh(Request())
+        logger.info("Учетные данные успешно обновлены", expiry=str(creds.expiry))
+    except Exception as e:
+        logger.error("Не удалось обновить учетные данные", error=str(e))
+        return
+    _save_credentials(creds)
+
+
+def _seconds_until_expiry(creds):
+    if creds.expiry is None:
+        return None
+    # google-auth хранит expiry как naive datetime в UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (creds.expiry - now).total_seconds()
+
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    remaining = _seconds_until_expiry(creds)
+    return remaining is not None and remaining < TOKEN_REFRESH_AHEAD_SECONDS
+
+
+async def get_credentials():
+    """Возвращает общие учетные данные процесса, при необходимости загружая или обновляя их.
+    Одновременные вызовы ожидают одно и то же обновление токена"""
+    global _creds
+    if _creds is not None and not _needs_refresh(_creds):
+        return _creds
+
+    async with _refresh_lock:
+        if _creds is None:
+            logger.info("Загрузка учетных данных")
+            _creds = await asyncio.to_thread(_load_credentials)
+        if _needs_refresh(_creds) and _creds.refresh_token:
+            await asyncio.to_thread(_refresh_credentials, _creds)
+    return _creds
+
+
+async def get_sheets_service():
+    """Возвращает клиент Sheets API, созданный один раз на процесс"""
+    global _service
+    creds = await get_credentials()
+    if _service is None:
+        _service = build('sheets', 'v4', credentials=creds, cache_discovery=False)
+        logger.info("Создан клиент Google Sheets API")
+    return _service
+
+
+def authorized_http():
+    """Возвращает авторизованный HTTP-клиент текущего потока (httplib2 не потокобезопасен)"""
+    http = getattr(_thread_local, 'http', None)
+    if http is None or http.credentials is not _creds:
+        http = AuthorizedHttp(_creds, http=httplib2.Http())
+        _thread_local.http = http
+    return http
+
+
+def execute_request(request):
+    """Синхронно выполняет запрос Sheets API через HTTP-клиент текущего потока"""
+    return request.execute(http=authorized_http())
+
+
+async def _refresh_ahead_loop():
+    while True:
+        try:
+            creds = await get_credentials()
+            remaining = _seconds_until_expiry(creds)
+            if remaining is None:
+                return
+            await asyncio.sleep(max(remaining - TOKEN_REFRESH_AHEAD_SECONDS, 30))
+            async with _refresh_lock:
+                if _needs_refresh(_creds):
+                    await asyncio.to_thread(_refresh_credentials, _creds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка фонового обновления учетных данных", error=str(e))
+            await asyncio.sleep(60)
+
+
+def start_token_refresher():
+    """Запускает фоновую задачу, обновляющую токен заранее, до истечения срока действия"""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_ahead_loop())
+    return _refresh_task
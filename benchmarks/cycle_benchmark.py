@@ -0,0 +1,220 @@
+"""Сквозной бенчмарк цикла обновления цен на локальных заменителях Google Sheets и API маркетплейсов.
+
+Для каждого размера листа выполняются циклы run_shop_wave по всем магазинам:
+full - первый цикл с пустой базой, writeback - обработка записанных им в лист результатов,
+delta - после изменения доли цен, delta_writeback - обработка результатов цикла delta, unchanged - без изменений.
+Записанный обратно диапазон отличается от снимка и обрабатывается еще раз, поэтому лист успокаивается
+только на цикл позже; в цикле unchanged диапазоны уже пропускаются по отпечаткам.
+Для каждого цикла выводится время этапов (по метрикам stage_seconds), общее время, пиковая память
+(tracemalloc) и число запросов к каждому сервису. После всех циклов выводится размер базы SQLite и хранилища снимков.
+
+Пример: python benchmarks/cycle_benchmark.py --rows 1000,10000,200000 --marketplaces ozon,wb --ym latency=0.2,throttle=0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build
+import auth
+import main
+import Ozon.update_ozon
+import WB.update_wb
+import YM.update_ym
+import MM.update_mm
+from config import MARKETPLACES, SAMPLE_SPREADSHEET_ID, SQLITE_DB_NAME, SNAPSHOT_STORE_DIR
+from db import close_databases
+from fingerprints import FingerprintStore
+from http_session import HttpSessionManager
+from metrics import metrics
+from registry import load_registry
+from sheets_api import execute
+from snapshot_cache import SnapshotCache
+from snapshot_store import SNAPSHOT_FORMATS, open_snapshot_store
+from datasets import make_sheet, change_prices
+from stand_ins import StandInServer, add_profile_arguments, profiles_from_args
+
+STAGES = ("sheets_fetch", "db_sync", "update_price", "sheets_write", "marketplace_push")
+CREDENTIALS = {
+    'ozon': lambda name: {'client_id': name, 'api_key': name},
+    'wb': lambda name: {'api_key': name},
+    'ym': lambda name: {'access_token': name, 'campaign_id': name},
+    'mm': lambda name: {'token': name},
+}
+UNLIMITED_RATE = {'rate': 1e9, 'burst': 1e9}
+
+
+def use_stand_ins(url):
+    """Направляет клиенты Google Sheets и маркетплейсов на сервер заменителей"""
+    auth._creds = AnonymousCredentials()
+    auth._service = build('sheets', 'v4', credentials=auth._creds, client_options={'api_endpoint': url},
+                          cache_discovery=False, static_discovery=True)
+    Ozon.update_ozon.OZON_API_URL = url
+    WB.update_wb.WB_API_URL = url
+    YM.update_ym.YM_API_URL = url
+    MM.update_mm.MM_API_URL = url
+
+
+def bench_shops(marketplace_keys, shops_per_marketplace, real_limits):
+    """Реестр магазинов бенчмарка: shops_per_marketplace магазинов на каждом маркетплейсе, по листу на магазин.
+    Без real_limits лимиты частоты запросов и задержки опроса задач WB не ограничивают цикл"""
+    marketplaces = {key: dict(MARKETPLACES[key], enabled=True) for key in marketplace_keys}
+    shops = []
+    for key in marketplace_keys:
+        for i in range(1, shops_per_marketplace + 1):
+            name = f"Bench{i}"
+            spec = {'marketplace': key, 'shop': name, 'range': f"Bench_{key}_{i}!A1:Z",
+                    'credentials': CREDENTIALS[key](f"bench-{key}-{i}")}
+            if not real_limits:
+                spec['rate_limit'] = UNLIMITED_RATE
+                if key == 'wb':
+                    spec['client_options'] = dict(MARKETPLACES['wb']['client_options'], poll_initial_delay=0.01,
+                                                  poll_max_delay=0.1)
+            shops.append(spec)
+    return load_registry(marketplaces, shops)
+
+
+async def upload_sheet(range_name, values):
+    service = auth._service
+    await execute(service.spreadsheets().values().update(spreadsheetId=SAMPLE_SPREADSHEET_ID, range=range_name,
+                                                         valueInputOption='RAW', body={"values": values}))
+
+
+async def download_sheet(range_name):
+    service = auth._service
+    result = await execute(service.spreadsheets().values().get(spreadsheetId=SAMPLE_SPREADSHEET_ID, range=range_name))
+    return result.get('values', [])
+
+
+def _stage_seconds(before, after):
+    stages = dict.fromkeys(STAGES, 0.0)
+    for (name, labels), value in after.items():
+        if name == "stage_seconds_sum":
+            stage = dict(labels).get("stage")
+            stages[stage] = stages.get(stage, 0.0) + value - before.get((name, labels), 0)
+    return stages
+
+
+async def run_cycle(label, rows, jobs, fingerprints, snapshots, http, server, trace_memory):
+    """Один цикл run_shop_wave с замерами"""
+    server.reset()
+    before = metrics.totals()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    await main.run_shop_wave(jobs, fingerprints, snapshots, http)
+    elapsed = time.perf_counter() - started
+    result = {
+        "rows": rows,
+        "cycle": label,
+        "shops": len(jobs),
+        "total_seconds": round(elapsed, 3),
+        "stages": {stage: round(seconds, 3) for stage, seconds in _stage_seconds(before, metrics.totals()).items()},
+        "peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if trace_memory else None,
+    }
+    result.update(server.stats())
+    return result
+
+
+def disk_usage(path):
+    """Размер файла или каталога в байтах (0, если его нет)"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+async def run_size(rows, shops, server, args):
+    """Циклы full, writeback, delta, delta_writeback и unchanged для листов по rows строк в отдельной временной базе"""
+    for number, shop in enumerate(shops):
+        await upload_sheet(shop.sheet_range, make_sheet(shop.marketplace, rows, args.change_share, seed=number))
+    results = []
+    fingerprints = FingerprintStore()
+    snapshot_store = open_snapshot_store(args.snapshot_store)
+    snapshots = SnapshotCache(store=snapshot_store)
+    async with HttpSessionManager() as http:
+        jobs = main.shop_jobs(http.session, fingerprints, snapshots, shops=shops, snapshot_store=snapshot_store)
+        cycle = partial(run_cycle, rows=rows, jobs=jobs, fingerprints=fingerprints, snapshots=snapshots, http=http,
+                        server=server, trace_memory=args.tracemalloc)
+        results.append(await cycle("full"))
+        results.append(await cycle("writeback"))
+        for number, shop in enumerate(shops):
+            values = await download_sheet(shop.sheet_range)
+            change_prices(values, args.change_share, seed=rows + number)
+            await upload_sheet(shop.sheet_range, values)
+        results.append(await cycle("delta"))
+        results.append(await cycle("delta_writeback"))
+        results.append(await cycle("unchanged"))
+    close_databases()
+    # Соединения пула чтения остаются открытыми, поэтому часть данных может оставаться в файле -wal
+    disk = {"sqlite_mb": round((disk_usage(SQLITE_DB_NAME) + disk_usage(SQLITE_DB_NAME + "-wal")) / 2 ** 20, 2),
+            "snapshots_mb": round(disk_usage(SNAPSHOT_STORE_DIR) / 2 ** 20, 2)}
+    for result in results:
+        result["disk"] = disk
+    return results
+
+
+def print_result(result):
+    requests = {service: sum(statuses.values()) for service, statuses in result["requests"].items()}
+    throttled = sum(statuses.get("429", 0) for statuses in result["requests"].values())
+    stages = " ".join(f"{stage}={seconds:.3f}" for stage, seconds in result["stages"].items())
+    peak = f"{result['peak_mb']:.1f} МБ" if result["peak_mb"] is not None else "-"
+    print(f"{result['rows']:>7} {result['cycle']:15} {result['total_seconds']:8.3f} с  пик {peak:>9}  {stages}  "
+          f"запросы {json.dumps(requests)} 429: {throttled}")
+
+
+async def run(args):
+    logging.getLogger().setLevel(args.log_level)
+    main.DEBUG = False
+    shops = bench_shops(args.marketplaces.split(","), args.shops, args.real_limits)
+    results = []
+    with StandInServer(profiles_from_args(args), seed=args.seed) as server:
+        use_stand_ins(server.url)
+        workdir = os.getcwd()
+        for rows in (int(value) for value in args.rows.split(",")):
+            # База SQLite (config.SQLITE_DB_NAME) создается в текущем каталоге, поэтому каждый размер - в своем
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                try:
+                    size_results = await run_size(rows, shops, server, args)
+                    for result in size_results:
+                        print_result(result)
+                        results.append(result)
+                    disk = size_results[-1]["disk"]
+                    print(f"{rows:>7} диск: база {disk['sqlite_mb']:.2f} МБ, хранилище снимков {disk['snapshots_mb']:.2f} МБ")
+                finally:
+                    os.chdir(workdir)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="1000,10000", help="размеры листов через запятую (например 1000,10000,200000)")
+    parser.add_argument("--marketplaces", default="ozon,wb,ym,mm", help="ключи MARKETPLACES через запятую")
+    parser.add_argument("--shops", type=int, default=1, help="магазинов на каждом маркетплейсе")
+    parser.add_argument("--change-share", type=float, default=0.1, help="доля строк с изменением цены")
+    parser.add_argument("--real-limits", action="store_true",
+                        help="использовать лимиты частоты запросов из config и задержки опроса задач WB")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="не измерять пиковую память (tracemalloc замедляет выполнение)")
+    parser.add_argument("--log-level", default="WARNING", help="уровень логирования во время замеров")
+    parser.add_argument("--snapshot-store", choices=SNAPSHOT_FORMATS,
+                        help="хранить состояние листов в хранилище снимков этого формата вместо таблиц product_data_*")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл для сравнения между версиями")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.tracemalloc:
+        tracemalloc.start()
+    asyncio.run(run(args))
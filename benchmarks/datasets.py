@@ -0,0 +1,68 @@
+"""Генерация листов Google Sheets для бенчмарков в формате, который ожидают конвейеры маркетплейсов"""
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data_updater import ID_COL, PRICE_COL, OLD_PRICE_COL, PRIM_COL
+
+# Столбцы скидок, которые не входят в price_columns маркетплейса
+DISCOUNT_COLUMNS = {'disc_old', 'discount'}
+
+
+def sheet_columns(marketplace):
+    """Столбцы листа маркетплейса: служебные столбцы update_price, ключ и столбцы из price_columns и push_columns"""
+    columns = [ID_COL, marketplace.key_col, OLD_PRICE_COL, PRICE_COL]
+    columns += list(marketplace.price_columns.values()) + list(marketplace.push_columns.values()) + [PRIM_COL]
+    return list(dict.fromkeys(columns))
+
+
+def _key(marketplace, i):
+    # Ozon и Wildberries требуют числовые идентификаторы товаров
+    if marketplace.key_col in ('product_id', 'nmID'):
+        return str(100000000 + i)
+    return f"SKU-{i:07d}"
+
+
+def make_sheet(marketplace, rows, change_share=0.1, seed=0):
+    """Значения листа (список строк): строка названий столбцов, строка подписей и rows строк товаров.
+    В доле change_share строк новая цена отличается от текущей не более чем на 20%"""
+    rng = random.Random(seed)
+    columns = sheet_columns(marketplace)
+    values = [columns, columns]
+    for i in range(rows):
+        price = rng.randint(500, 20000)
+        # Скидка в базе и введенная вручную совпадают, изменения вносит только change_share
+        discount = str(rng.choice((0, 5, 10, 15)))
+        row = {column: discount if column in DISCOUNT_COLUMNS or column in marketplace.price_columns.values() else ""
+               for column in columns}
+        row.update({ID_COL: str(i), marketplace.key_col: _key(marketplace, i), OLD_PRICE_COL: str(price),
+                    PRICE_COL: str(price), PRIM_COL: ""})
+        if rng.random() < change_share:
+            row[PRICE_COL] = str(round(price * rng.uniform(0.8, 1.2)))
+        for column in marketplace.push_columns.values():
+            if column == 'offer_id' and column != marketplace.key_col:
+                row[column] = f"SKU-{i:07d}"
+            elif column == 'min_price':
+                row[column] = str(price // 2)
+        values.append([row[column] for column in columns])
+    return values
+
+
+def change_prices(values, change_share, seed=0):
+    """Меняет новую цену в доле change_share строк товаров (значения листа изменяются на месте).
+    Возвращает число измененных строк"""
+    rng = random.Random(seed)
+    header = values[0]
+    price_index, old_price_index = header.index(PRICE_COL), header.index(OLD_PRICE_COL)
+    rows = values[2:]
+    changed = rng.sample(range(len(rows)), int(len(rows) * change_share))
+    for position in changed:
+        row = rows[position]
+        row.extend([""] * (len(header) - len(row)))
+        try:
+            price = float(row[old_price_index])
+        except ValueError:
+            price = 1000
+        row[price_index] = str(max(1, round(price * rng.uniform(0.8, 1.2))))
+    return len(changed)
@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import connect
+
+CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS price_change_log
+                  (timestamp TEXT, id TEXT, product_id TEXT, old_price REAL, new_price REAL, old_discount REAL, new_discount REAL, prim TEXT, change_applied INTEGER)'''
+INSERT = "INSERT INTO price_change_log (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def make_rows(count):
+    return [(str(i), str(1000000 + i), 100.0 + i, 200.0 + i, None, None,
+             f"Изменение цены с {100.0 + i} на {200.0 + i} превышает 50%, цена не изменена", 0)
+            for i in range(count)]
+
+
+def per_row_insert(db_name, rows):
+    """Прежний способ: отдельный execute и strftime на каждую строку, журнал по умолчанию"""
+    conn = sqlite3.connect(db_name)
+    c = conn.cursor()
+    c.execute(CREATE_TABLE)
+    for row in rows:
+        c.execute(INSERT, (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),) + row)
+    conn.commit()
+    conn.close()
+
+
+def bulk_insert(db_name, rows):
+    """Новый способ: одна метка времени, executemany в одной транзакции, WAL"""
+    conn = connect(db_name)
+    c = conn.cursor()
+    c.execute(CREATE_TABLE)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        c.executemany(INSERT, [(timestamp,) + row for row in rows])
+    conn.close()
+
+
+def run(rows_count=20000, cycles=5):
+    rows = make_rows(rows_count)
+    results = {}
+    for name, insert in (("per_row", per_row_insert), ("bulk", bulk_insert)):
+        with tempfile.TemporaryDirectory() as directory:
+            db_name = os.path.join(directory, 'bench.db')
+            started = time.perf_counter()
+            for _ in range(cycles):
+                insert(db_name, rows)
+            elapsed = time.perf_counter() - started
+        results[name] = rows_count * cycles / elapsed
+        print(f"{name:8} {rows_count * cycles} строк за {elapsed:.3f} с, {results[name]:,.0f} строк/с")
+    print(f"Ускорение: {results['bulk'] / results['per_row']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,349 @@
+"""Локальные заменители Google Sheets values API и API маркетплейсов для бенчмарков.
+
+Сервер запускается в отдельном процессе (чтобы не делить GIL и цикл событий с измеряемым кодом)
+и отвечает на те же пути, что и настоящие API:
+
+- Google Sheets: values.get, values.batchGet, values.update, values.batchUpdate (данные хранятся в памяти);
+- Ozon: /v1/product/import/prices;
+- Wildberries: /api/v2/upload/task, /api/v2/buffer/tasks, /api/v2/history/tasks, /api/v2/history/goods/task;
+- Яндекс.Маркет: /businesses/{id}/offer-prices/updates;
+- Мегамаркет: /api/merchantIntegration/v1/offerService/manualPrice/save.
+
+Для каждого сервиса задаются задержка ответа, доля ответов 429 и лимит товаров в запросе.
+Счетчики запросов доступны на /_stats и сбрасываются запросом POST /_reset.
+
+Запуск вручную: python benchmarks/stand_ins.py --port 8085
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import random
+import re
+import urllib.request
+from collections import namedtuple
+from aiohttp import web
+
+# latency - задержка ответа, с; throttle_rate - доля ответов 429; max_items - лимит товаров в запросе (None - без лимита);
+# retry_after - значение заголовка Retry-After в ответах 429 (None - заголовок не отправляется)
+ServiceProfile = namedtuple("ServiceProfile", ["latency", "throttle_rate", "max_items", "retry_after"])
+
+DEFAULT_PROFILES = {
+    "sheets": ServiceProfile(0.05, 0.0, None, None),
+    "ozon": ServiceProfile(0.05, 0.0, 1000, None),
+    "wb": ServiceProfile(0.05, 0.0, 1000, None),
+    "ym": ServiceProfile(0.05, 0.0, 500, None),
+    "mm": ServiceProfile(0.05, 0.0, None, None),
+}
+
+_A1_RE = re.compile(r"^(?:'?(?P<sheet>.+?)'?!)?(?P<col1>[A-Z]+)(?P<row1>\d*)(?::(?P<col2>[A-Z]+)(?P<row2>\d*))?$")
+
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def parse_a1(range_name):
+    """Разбирает диапазон вида Лист!A1:K в (лист, первая строка, первый столбец, последний столбец или None)"""
+    match = _A1_RE.match(range_name)
+    if match is None:
+        raise ValueError(f"Некорректный диапазон {range_name}")
+    last_col = _column_index(match["col2"]) if match["col2"] else None
+    return match["sheet"] or "Sheet1", int(match["row1"] or 1) - 1, _column_index(match["col1"]), last_col
+
+
+def _cell(value):
+    """Значение ячейки так, как его вернул бы Sheets API (FORMATTED_VALUE)"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeSpreadsheet:
+    """Листы таблицы в памяти: {лист: список строк}"""
+
+    def __init__(self):
+        self.sheets = {}
+
+    def read(self, range_name):
+        sheet, first_row, first_col, last_col = parse_a1(range_name)
+        values = []
+        for row in self.sheets.get(sheet, [])[first_row:]:
+            row = row[first_col:None if last_col is None else last_col + 1]
+            # Как и настоящий API, не возвращаем пустые ячейки в конце строк и пустые строки в конце диапазона
+            while row and row[-1] == "":
+                row = row[:-1]
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        result = {"range": range_name, "majorDimension": "ROWS"}
+        if values:
+            result["values"] = values
+        return result
+
+    def write(self, range_name, values):
+        sheet, first_row, first_col, _ = parse_a1(range_name)
+        rows = self.sheets.setdefault(sheet, [])
+        for offset, row in enumerate(values):
+            index = first_row + offset
+            while len(rows) <= index:
+                rows.append([])
+            target = rows[index]
+            if len(target) < first_col + len(row):
+                target.extend([""] * (first_col + len(row) - len(target)))
+            target[first_col:first_col + len(row)] = [_cell(value) for value in row]
+        return {"updatedRange": range_name, "updatedRows": len(values),
+                "updatedCells": sum(len(row) for row in values)}
+
+
+class StandInApp:
+    """aiohttp-приложение со всеми заменителями и счетчиками запросов"""
+
+    def __init__(self, profiles=None, seed=0):
+        self.profiles = dict(DEFAULT_PROFILES, **(profiles or {}))
+        self.random = random.Random(seed)
+        self.spreadsheet = FakeSpreadsheet()
+        self.task_ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        self.requests = {}
+        self.items = {}
+
+    def _count(self, service, status, items=0):
+        statuses = self.requests.setdefault(service, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        self.items[service] = self.items.get(service, 0) + items
+
+    async def _gate(self, service, items=0):
+        """Задержка, случайный ответ 429 и проверка лимита товаров. Возвращает ответ с ошибкой или None"""
+        profile = self.profiles[service]
+        if profile.latency:
+            await asyncio.sleep(profile.latency)
+        if profile.throttle_rate and self.random.random() < profile.throttle_rate:
+            self._count(service, 429)
+            headers = {} if profile.retry_after is None else {"Retry-After": str(profile.retry_after)}
+            return web.json_response({"code": 429, "message": "Too Many Requests"}, status=429, headers=headers)
+        if profile.max_items is not None and items > profile.max_items:
+            self._count(service, 400, items)
+            return web.json_response({"code": 400, "message": f"Превышен лимит {profile.max_items} товаров в запросе"},
+                                     status=400)
+        self._count(service, 200, items)
+        return None
+
+    # Google Sheets
+
+    async def values_get(self, request):
+        error = await self._gate("sheets")
+        if error is not None:
+            return error
+        return web.json_response(self.spreadsheet.read(request.match_info["range"]))
+
+    async def values_batch_get(self, request):
+        error = await self._gate("sheets")
+        if error is not None:
+            return error
+        return web.json_response({
+            "spreadsheetId": request.match_info["spreadsheet_id"],
+            "valueRanges": [self.spreadsheet.read(range_name) for range_name in request.query.getall("ranges", [])]})
+
+    async def values_update(self, request):
+        body = await request.json()
+        error = await self._gate("sheets")
+        if error is not None:
+            return error
+        return web.json_response(self.spreadsheet.write(request.match_info["range"], body.get("values", [])))
+
+    async def values_batch_update(self, request):
+        body = await request.json()
+        error = await self._gate("sheets")
+        if error is not None:
+            return error
+        responses = [self.spreadsheet.write(value_range["range"], value_range.get("values", []))
+                     for value_range in body.get("data", [])]
+        return web.json_response({"spreadsheetId": request.match_info["spreadsheet_id"], "responses": responses,
+                                  "totalUpdatedCells": sum(response["updatedCells"] for response in responses)})
+
+    # Маркетплейсы
+
+    async def ozon_prices(self, request):
+        prices = (await request.json()).get("prices", [])
+        error = await self._gate("ozon", len(prices))
+        if error is not None:
+            return error
+        return web.json_response({"result": [
+            {"product_id": price.get("product_id"), "offer_id": price.get("offer_id"), "updated": True, "errors": []}
+            for price in prices]})
+
+    async def wb_upload(self, request):
+        goods = (await request.json()).get("data", [])
+        error = await self._gate("wb", len(goods))
+        if error is not None:
+            return error
+        return web.json_response({"data": {"id": next(self.task_ids), "alreadyExists": False}, "error": False,
+                                  "errorText": ""})
+
+    async def wb_buffer_task(self, request):
+        error = await self._gate("wb")
+        if error is not None:
+            return error
+        # Задачи заменителя обрабатываются сразу, поэтому в буфере их нет
+        return web.json_response({"data": None, "error": False, "errorText": ""})
+
+    async def wb_task(self, request):
+        error = await self._gate("wb")
+        if error is not None:
+            return error
+        return web.json_response({"data": {"uploadID": int(request.query.get("uploadID", 0)), "status": 3}})
+
+    async def wb_task_goods(self, request):
+        error = await self._gate("wb")
+        if error is not None:
+            return error
+        return web.json_response({"data": {"historyGoods": []}})
+
+    async def ym_prices(self, request):
+        offers = (await request.json()).get("offers", [])
+        error = await self._gate("ym", len(offers))
+        if error is not None:
+            return error
+        return web.json_response({"status": "OK"})
+
+    async def mm_prices(self, request):
+        prices = ((await request.json()).get("data") or {}).get("prices", [])
+        error = await self._gate("mm", len(prices))
+        if error is not None:
+            return error
+        return web.json_response({"success": 1, "meta": {}, "data": {}})
+
+    # Управление
+
+    async def stats(self, request):
+        return web.json_response({"requests": self.requests, "items": self.items})
+
+    async def reset_stats(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def build(self):
+        # Тело batchUpdate с большим диапазоном может занимать десятки мегабайт
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_get("/v4/spreadsheets/{spreadsheet_id}/values:batchGet", self.values_batch_get)
+        app.router.add_post("/v4/spreadsheets/{spreadsheet_id}/values:batchUpdate", self.values_batch_update)
+        app.router.add_get("/v4/spreadsheets/{spreadsheet_id}/values/{range}", self.values_get)
+        app.router.add_put("/v4/spreadsheets/{spreadsheet_id}/values/{range}", self.values_update)
+        app.router.add_post("/v1/product/import/prices", self.ozon_prices)
+        app.router.add_post("/api/v2/upload/task", self.wb_upload)
+        app.router.add_get("/api/v2/buffer/tasks", self.wb_buffer_task)
+        app.router.add_get("/api/v2/history/tasks", self.wb_task)
+        app.router.add_get("/api/v2/history/goods/task", self.wb_task_goods)
+        app.router.add_post("/businesses/{business_id}/offer-prices/updates", self.ym_prices)
+        app.router.add_post("/api/merchantIntegration/v1/offerService/manualPrice/save", self.mm_prices)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset_stats)
+        return app
+
+
+def _serve(host, port, profiles, seed, ready):
+    async def run():
+        runner = web.AppRunner(StandInApp(profiles, seed).build(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        ready.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+class StandInServer:
+    """Сервер заменителей в дочернем процессе: with StandInServer(profiles) as server: server.url ..."""
+
+    def __init__(self, profiles=None, host="127.0.0.1", port=0, seed=0):
+        self.profiles = profiles
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.process = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=_serve, args=(self.host, self.port, self.profiles, self.seed, sender),
+                                       daemon=True)
+        self.process.start()
+        if not receiver.poll(30):
+            self.stop()
+            raise RuntimeError("Сервер заменителей не запустился")
+        self.port = receiver.recv()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _call(self, method, path):
+        request = urllib.request.Request(self.url + path, method=method, data=b"" if method == "POST" else None)
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._call("GET", "/_stats")
+
+    def reset(self):
+        self._call("POST", "/_reset")
+
+
+def parse_profile(text, default):
+    """Разбирает профиль сервиса из строки вида latency=0.1,throttle=0.02,max_items=500,retry_after=1"""
+    names = {"latency": "latency", "throttle": "throttle_rate", "max_items": "max_items", "retry_after": "retry_after"}
+    values = {}
+    for part in filter(None, text.split(",")):
+        name, _, value = part.partition("=")
+        if name not in names:
+            raise ValueError(f"Неизвестный параметр профиля {name}")
+        values[names[name]] = None if value.lower() == "none" else float(value)
+    if values.get("max_items") is not None:
+        values["max_items"] = int(values["max_items"])
+    return default._replace(**values)
+
+
+def add_profile_arguments(parser):
+    for service in DEFAULT_PROFILES:
+        parser.add_argument(f"--{service}", default="", metavar="PROFILE",
+                            help=f"профиль {service}: latency=0.05,throttle=0.0,max_items=N,retry_after=S")
+
+
+def profiles_from_args(args):
+    return {service: parse_profile(getattr(args, service), default) for service, default in DEFAULT_PROFILES.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--seed", type=int, default=0)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    app = StandInApp(profiles_from_args(args), args.seed).build()
+    web.run_app(app, host=args.host, port=args.port, access_log=None)
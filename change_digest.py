@@ -0,0 +1,102 @@
+import json
+import math
+import numpy as np
+from config import CHANGE_DIGEST_TOP_N
+from db import get_database
+
+CHANGE_DIGEST_TABLE = 'change_digests'
+
+
+def _number(value):
+    """Число для JSON: целое без дробной части, бесконечность и NaN - None"""
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def _change_size(change):
+    # Изменения с нечисловой разницей (например, старая цена inf) считаются крупнейшими
+    return math.inf if change["change"] is None else abs(change["change"])
+
+
+def _push_failed(result):
+    """Результат отправки товара из словаря клиента API: Ozon и Яндекс.Маркет - {"updated", "errors"},
+    Wildberries - {"status", "error"}. Возвращает текст ошибки или None, если цена применена"""
+    if "status" in result:
+        return None if result["status"] == "applied" else result.get("error") or result["status"]
+    return None if result.get("updated") else "; ".join(result.get("errors") or []) or "Неизвестная ошибка"
+
+
+class ChangeDigest:
+    """Сводка изменений одного магазина за цикл: число решений каждого вида, top_n самых больших
+    изменений цены и товары, цену которых не удалось отправить в маркетплейс.
+    Заменяет построчные события: пишется одним событием лога и одной строкой таблицы change_digests"""
+
+    def __init__(self, marketplace, shop, cycle_timestamp=None, top_n=CHANGE_DIGEST_TOP_N):
+        self.marketplace = marketplace
+        self.shop = shop
+        self.cycle_timestamp = cycle_timestamp
+        self.top_n = top_n
+        self.rows = 0
+        self.decisions = {}
+        self.top_changes = []
+        self.pushed = 0
+        self.failed = {}
+
+    def add_decisions(self, rows, counts):
+        """Учитывает rows обработанных строк и число решений каждого вида {решение: количество}"""
+        self.rows += rows
+        for decision, count in counts.items():
+            if count:
+                self.decisions[decision] = self.decisions.get(decision, 0) + int(count)
+
+    def add_price_changes(self, ids, product_ids, old_prices, new_prices):
+        """Добавляет примененные изменения цены (массивы одинаковой длины) и оставляет top_n самых больших по модулю"""
+        old_prices = np.asarray(old_prices, dtype=float)
+        new_prices = np.asarray(new_prices, dtype=float)
+        with np.errstate(invalid='ignore'):
+            delta = np.abs(new_prices - old_prices)
+        delta[~np.isfinite(delta)] = np.inf
+        positions = np.arange(len(delta))
+        if len(delta) > self.top_n:
+            positions = np.argpartition(-delta, self.top_n - 1)[:self.top_n]
+        for position in positions.tolist():
+            self.top_changes.append({"id": ids[position], "product_id": product_ids[position],
+                                     "old_price": _number(old_prices[position]),
+                                     "new_price": _number(new_prices[position]),
+                                     "change": _number(new_prices[position] - old_prices[position])})
+        self.top_changes.sort(key=_change_size, reverse=True)
+        del self.top_changes[self.top_n:]
+
+    def add_push_results(self, results):
+        """Учитывает результат клиента API {идентификатор товара: результат}"""
+        for item_id, result in (results or {}).items():
+            self.pushed += 1
+            error = _push_failed(result)
+            if error is not None:
+                self.failed[str(item_id)] = error
+
+    def as_event(self):
+        """Поля структурированного события лога (идентификаторы неотправленных товаров - не больше top_n)"""
+        return {"rows": self.rows, "decisions": self.decisions, "top_changes": self.top_changes,
+                "pushed": self.pushed, "push_failed": len(self.failed),
+                "failed_ids": list(self.failed)[:self.top_n] or None}
+
+    def log(self, shop_logger):
+        log = shop_logger.warning if self.failed else shop_logger.info
+        log("Сводка изменений магазина за цикл", **self.as_event())
+
+    async def save(self, db_name):
+        """Записывает сводку в таблицу change_digests (все идентификаторы неотправленных товаров - с ошибками)"""
+        row = (self.cycle_timestamp, self.marketplace, self.shop, self.rows,
+               json.dumps(self.decisions, ensure_ascii=False), json.dumps(self.top_changes, ensure_ascii=False),
+               self.pushed, len(self.failed), json.dumps(self.failed, ensure_ascii=False))
+
+        def job(conn):
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {CHANGE_DIGEST_TABLE} (
+                timestamp TEXT, marketplace TEXT, shop TEXT, rows INTEGER, decisions TEXT, top_changes TEXT,
+                pushed INTEGER, push_failed INTEGER, failed_items TEXT)""")
+            conn.execute(f"INSERT INTO {CHANGE_DIGEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+        await get_database(db_name).write(job)
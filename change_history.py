@@ -0,0 +1,101 @@
+"""Запросы к журналу изменений цен price_change_log и его месячным архивам.
+
+Запросы читают основную таблицу и только те архивы, в которых могут быть строки из запрошенного периода,
+и опираются на индексы (product_id, timestamp) и (timestamp), которые есть и у основной таблицы, и у архивов,
+поэтому не просматривают журнал целиком.
+Пример: python change_history.py --product 123456789 или python change_history.py --hours 24
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+import pandas as pd
+from config import SQLITE_DB_NAME
+from change_log import PRICE_CHANGE_LOG_TABLE, LOG_COLUMNS, TIMESTAMP_FORMAT, archive_tables, table_exists
+from db import get_database, close_databases
+
+
+def _source_tables(conn, table, since):
+    """Основная таблица и архивы за месяцы не раньше since (все архивы, если since не задан)"""
+    tables = [table] if table_exists(conn, table) else []
+    since_month = since[:7] if since else None
+    tables += [name for month, name in archive_tables(conn, table) if since_month is None or month >= since_month]
+    return tables
+
+
+def _select(conn, table, where, params, since, limit):
+    tables = _source_tables(conn, table, since)
+    if not tables:
+        return pd.DataFrame(columns=list(LOG_COLUMNS))
+    columns = ", ".join(LOG_COLUMNS)
+    union = " UNION ALL ".join(f"SELECT {columns} FROM '{name}' WHERE {where}" for name in tables)
+    query = f"SELECT * FROM ({union}) ORDER BY timestamp DESC"
+    params = list(params) * len(tables)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def _period(since, until):
+    conditions, params = [], []
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    return conditions, params
+
+
+def _timestamp(value):
+    return value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+
+
+async def product_history(product_id, since=None, until=None, limit=None, applied_only=False,
+                          table=PRICE_CHANGE_LOG_TABLE, db_name=SQLITE_DB_NAME):
+    """История изменений товара product_id (новые записи первыми) за период [since, until).
+    since и until - datetime или строка 'YYYY-MM-DD HH:MM:SS'. Возвращает DataFrame со столбцами LOG_COLUMNS"""
+    since, until = _timestamp(since), _timestamp(until)
+    conditions, params = _period(since, until)
+    conditions.insert(0, "product_id = ?")
+    params.insert(0, str(product_id))
+    if applied_only:
+        conditions.append("change_applied = 1")
+    where = " AND ".join(conditions)
+    return await get_database(db_name).read(lambda conn: _select(conn, table, where, params, since, limit))
+
+
+async def recent_changes(hours, applied_only=True, limit=None, table=PRICE_CHANGE_LOG_TABLE,
+                         db_name=SQLITE_DB_NAME, now=None):
+    """Записи журнала за последние hours часов (по умолчанию только примененные изменения), новые первыми"""
+    since = ((now or datetime.now()) - timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT)
+    conditions, params = _period(since, None)
+    if applied_only:
+        conditions.append("change_applied = 1")
+    where = " AND ".join(conditions)
+    return await get_database(db_name).read(lambda conn: _select(conn, table, where, params, since, limit))
+
+
+async def _main(args):
+    try:
+        if args.product is not None:
+            history = await product_history(args.product, since=args.since, limit=args.limit,
+                                            applied_only=args.applied_only, db_name=args.db)
+        else:
+            history = await recent_changes(args.hours, applied_only=not args.all, limit=args.limit, db_name=args.db)
+    finally:
+        close_databases()
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(history.to_string(index=False) if len(history) else "Записей не найдено")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=SQLITE_DB_NAME)
+    parser.add_argument("--product", help="product_id товара: вывести его историю")
+    parser.add_argument("--since", help="начало периода истории товара, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--applied-only", action="store_true", help="в истории товара только примененные изменения")
+    parser.add_argument("--hours", type=float, default=24, help="изменения за последние N часов")
+    parser.add_argument("--all", action="store_true", help="за последние N часов - и непримененные изменения")
+    parser.add_argument("--limit", type=int)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,145 @@
+import asyncio
+import re
+from datetime import datetime, timedelta
+from functools import partial
+from config import (SQLITE_DB_NAME, PRICE_CHANGE_LOG_RETENTION_DAYS, PRICE_CHANGE_LOG_ARCHIVE_MONTHS,
+                    PRICE_CHANGE_LOG_ARCHIVE_BATCH_ROWS, PRICE_CHANGE_LOG_RETENTION_INTERVAL_MINUTES)
+from db import get_database
+from logger import logger
+from metrics import metrics
+
+PRICE_CHANGE_LOG_TABLE = 'price_change_log'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_COLUMNS = ('timestamp', 'id', 'product_id', 'old_price', 'new_price', 'old_discount', 'new_discount', 'prim',
+               'change_applied')
+_COLUMNS = ", ".join(LOG_COLUMNS)
+_SCHEMA = ('(timestamp TEXT, id TEXT, product_id TEXT, old_price REAL, new_price REAL, old_discount REAL, '
+           'new_discount REAL, prim TEXT, change_applied INTEGER)')
+
+_retention_task = None
+
+
+def archive_table_name(table, month):
+    """Имя месячного архива журнала: price_change_log_2024_05 для месяца '2024-05'"""
+    return f"{table}_{month.replace('-', '_')}"
+
+
+def _create_table(conn, table):
+    # (product_id, timestamp) - история товара, (timestamp) - последние изменения и перенос в архив.
+    # Архивы получают те же индексы: change_history отбирает строки архивов и по товару, и по времени
+    conn.execute(f"CREATE TABLE IF NOT EXISTS '{table}' {_SCHEMA}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS '{table}_product_ts' ON '{table}' (product_id, timestamp)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS '{table}_ts' ON '{table}' (timestamp)")
+
+
+def create_change_log(conn, table=PRICE_CHANGE_LOG_TABLE):
+    """Создает таблицу журнала и ее индексы, если их еще нет.
+    Индексы для уже существующей большой таблицы строятся один раз, при первой записи после обновления"""
+    _create_table(conn, table)
+
+
+def write_change_log(conn, table, log_rows):
+    """Добавляет строки журнала (кортежи в порядке LOG_COLUMNS)"""
+    create_change_log(conn, table)
+    conn.executemany(f"INSERT INTO '{table}' ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", log_rows)
+
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def archive_tables(conn, table=PRICE_CHANGE_LOG_TABLE):
+    """Месячные архивы журнала: список (месяц 'YYYY-MM', имя таблицы) по возрастанию месяца"""
+    pattern = re.compile(rf"{re.escape(table)}_(\d{{4}})_(\d{{2}})")
+    names = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+                         (f"{table}\\_%",)).fetchall()
+    archives = []
+    for (name,) in names:
+        match = pattern.fullmatch(name)
+        if match:
+            archives.append((f"{match.group(1)}-{match.group(2)}", name))
+    return sorted(archives)
+
+
+def _archive_batch(conn, table, cutoff, batch_rows):
+    """Переносит в месячные архивы не больше batch_rows самых старых строк с меткой времени раньше cutoff
+    (строки одного цикла с общей меткой переносятся вместе, поэтому строк может быть немного больше).
+    Возвращает число перенесенных строк"""
+    if not table_exists(conn, table):
+        return 0
+    bound = conn.execute(f"SELECT timestamp FROM '{table}' WHERE timestamp < ? ORDER BY timestamp LIMIT 1 OFFSET ?",
+                         (cutoff, batch_rows - 1)).fetchone()
+    condition, params = "timestamp < ?", (cutoff,)
+    if bound is not None:
+        condition, params = "timestamp <= ?", bound
+    months = [month for (month,) in conn.execute(
+        f"SELECT DISTINCT substr(timestamp, 1, 7) FROM '{table}' WHERE {condition}", params)]
+    for month in months:
+        archive = archive_table_name(table, month)
+        _create_table(conn, archive)
+        conn.execute(f"INSERT INTO '{archive}' ({_COLUMNS}) SELECT {_COLUMNS} FROM '{table}' "
+                     f"WHERE {condition} AND substr(timestamp, 1, 7) = ?", params + (month,))
+    return conn.execute(f"DELETE FROM '{table}' WHERE {condition}", params).rowcount
+
+
+def _drop_archives(conn, table, before_month):
+    """Удаляет месячные архивы за месяцы раньше before_month. Возвращает имена удаленных таблиц"""
+    dropped = []
+    for month, name in archive_tables(conn, table):
+        if month < before_month:
+            conn.execute(f"DROP TABLE '{name}'")
+            dropped.append(name)
+    return dropped
+
+
+def _months_ago(now, months):
+    month_index = now.year * 12 + now.month - 1 - months
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+
+async def archive_change_log(db_name=SQLITE_DB_NAME, table=PRICE_CHANGE_LOG_TABLE,
+                             retention_days=PRICE_CHANGE_LOG_RETENTION_DAYS,
+                             archive_months=PRICE_CHANGE_LOG_ARCHIVE_MONTHS,
+                             batch_rows=PRICE_CHANGE_LOG_ARCHIVE_BATCH_ROWS, now=None):
+    """Переносит строки журнала старше retention_days дней в месячные архивы и удаляет архивы старше
+    archive_months месяцев (None - архивы хранятся бессрочно). Перенос идет частями по batch_rows строк,
+    каждая часть - отдельное задание потока записи, чтобы не задерживать запись журнала магазинами.
+    Возвращает число перенесенных строк"""
+    now = now or datetime.now()
+    database = get_database(db_name)
+    moved = 0
+    if retention_days is not None:
+        cutoff = (now - timedelta(days=retention_days)).strftime(TIMESTAMP_FORMAT)
+        while True:
+            count = await database.write(partial(_archive_batch, table=table, cutoff=cutoff, batch_rows=batch_rows))
+            moved += count
+            if count < batch_rows:
+                break
+    dropped = []
+    if archive_months is not None:
+        dropped = await database.write(partial(_drop_archives, table=table,
+                                               before_month=_months_ago(now, archive_months)))
+    metrics.inc("change_log_archived_rows_total", moved, table=table)
+    if moved or dropped:
+        logger.info("Журнал изменений цен перенесен в архив", table=table, archived_rows=moved,
+                    dropped_archives=dropped or None)
+    return moved
+
+
+async def _retention_loop(db_name, interval_minutes):
+    while True:
+        try:
+            await archive_change_log(db_name)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка переноса журнала изменений цен в архив", error=str(e))
+        await asyncio.sleep(interval_minutes * 60)
+
+
+def start_change_log_retention(db_name=SQLITE_DB_NAME, interval_minutes=PRICE_CHANGE_LOG_RETENTION_INTERVAL_MINUTES):
+    """Запускает фоновую задачу, которая раз в interval_minutes минут переносит старые строки журнала в архив"""
+    global _retention_task
+    if _retention_task is None or _retention_task.done():
+        _retention_task = asyncio.create_task(_retention_loop(db_name, interval_minutes))
+    return _retention_task
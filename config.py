@@ -3,14 +3,79 @@ from dotenv import load_dotenv
 
 
 SAMPLE_SPREADSHEET_ID = '1k_1W6IL1AN9hJ8ZOsrZux1yDxuB0ugew20UdtNzWneM' #id таблицы на гугл драйв
+SHEET_HEADER_ROWS = 2  # строк заголовков в начале диапазона магазина: результаты пишутся со следующей строки
 SQLITE_DB_NAME = 'data.db'
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_SYNCHRONOUS = 'NORMAL'
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_WRITER_MAX_BATCH = 32  # сколько накопившихся заданий записи объединять в одну транзакцию
+SQLITE_READ_POOL_SIZE = 2  # число соединений только для чтения
+HTTP_POOL_LIMIT = 50  # всего соединений в общей aiohttp-сессии
+HTTP_POOL_LIMIT_PER_HOST = 8  # соединений к одному API маркетплейса
+HTTP_KEEPALIVE_TIMEOUT = 60  # сколько секунд держать простаивающее соединение
+HTTP_DNS_CACHE_TTL = 600
+HTTP_TOTAL_TIMEOUT = 120  # таймаут запроса целиком, с
+HTTP_CONNECT_TIMEOUT = 15
+HTTP_MAX_RETRIES = 4  # повторов при 429, 5xx и ошибках соединения
+HTTP_BACKOFF_BASE = 1  # базовая задержка повтора, с (удваивается с каждой попыткой)
+HTTP_BACKOFF_MAX = 60
+
+# Лимиты запросов к API маркетплейсов на один ключ: rate - запросов в секунду, burst - допустимый всплеск
+RATE_LIMITS = {
+    'ozon': {'rate': 5, 'burst': 5},
+    'wb': {'rate': 10 / 6, 'burst': 5},  # 10 запросов за 6 секунд
+    'ym': {'rate': 10000 / 500 / 60, 'burst': 2},  # 10 000 предложений в минуту по 500 в запросе
+    'mm': {'rate': 1, 'burst': 2},
+}
+RATE_LIMIT_DECREASE_FACTOR = 0.5  # во сколько раз снижать скорость после ответа 429
+RATE_LIMIT_RECOVERY_STEP = 0.05  # на какую долю исходной скорости восстанавливаться после успешного ответа
+RATE_LIMIT_MIN_SHARE = 0.1  # ниже какой доли исходной скорости не опускаться
 # LOG_FILE_NAME = 'app.log'
 UPDATE_INTERVAL_MINUTES = 5
+SHOP_MAX_CONCURRENCY = 3  # сколько магазинов одного маркетплейса обрабатывается одновременно
+SCHEDULER_JITTER_SECONDS = 10  # наибольшая случайная задержка запуска каждого задания, с
+FINGERPRINT_FULL_RUN_MINUTES = 60  # как часто обрабатывать диапазон полностью, даже если его содержимое не изменилось
+DELTA_FULL_RUN_MINUTES = 60  # как часто пересчитывать все строки диапазона, а не только изменившиеся
+METRICS_PORT = None  # порт локального HTTP-сервера метрик (/metrics), None - сервер не запускается
+METRICS_HOST = '127.0.0.1'
+METRICS_PREFIX = 'integration_'
+METRICS_HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # границы гистограмм, с
+CHANGE_DIGEST_TOP_N = 10  # сколько крупнейших изменений цены и неотправленных товаров показывать в сводке магазина
+PRICE_CHANGE_LOG_RETENTION_DAYS = 30  # сколько дней строки price_change_log хранятся в основной таблице (None - всегда)
+PRICE_CHANGE_LOG_ARCHIVE_MONTHS = None  # сколько месяцев хранить месячные архивы журнала (None - бессрочно)
+PRICE_CHANGE_LOG_ARCHIVE_BATCH_ROWS = 50000  # сколько строк переносить в архив одной транзакцией
+PRICE_CHANGE_LOG_RETENTION_INTERVAL_MINUTES = 60  # как часто переносить старые строки журнала в архив
+# Хранилище снимков листов вместо таблиц product_data_*: 'parquet' или 'arrow' (нужен pyarrow), 'sqlite' (без
+# зависимостей) или None - состояние листов пишется построчно в таблицы SQLite, как раньше
+SNAPSHOT_STORE_FORMAT = None
+SNAPSHOT_STORE_DIR = 'snapshots'
+SNAPSHOT_STORE_COMPRESSION = 'zstd'  # сжатие Parquet и Arrow IPC (для arrow None - чтение через mmap без копирования)
+SNAPSHOT_STORE_FULL_RUN_MINUTES = 60  # как часто сохранять полный снимок листа, между ними - только изменения
+SNAPSHOT_STORE_RETENTION_DAYS = 7  # сколько дней хранить снимки для восстановления на момент времени (None - всегда)
+LOG_ROW_EVENTS_PER_SECOND = 20  # сколько однотипных построчных событий в секунду попадает в лог (0 - без ограничения)
+# Имена построчных событий structlog (первый аргумент вызова логгера, по одному событию на товар),
+# которые ограничиваются LOG_ROW_EVENTS_PER_SECOND
+LOG_ROW_EVENTS = (
+    # data_updater.update_price
+    'price_updated', 'discount_updated', 'price_updated_from_zero', 'price_and_discount_updated', 'missing_price',
+    'new_price_zero', 'price_change_exceeds_limit', 'invalid_price_or_discount',
+    # Клиенты API маркетплейсов
+    'row_processing', 'row_parsed', 'row_skipped', 'discount_from_main_column', 'discount_main_column_invalid',
+    'discount_from_backup_column', 'discount_default_used', 'item_added', 'invalid_discount_base',
+    'old_price_default_used', 'item_price_updated', 'item_price_update_failed', 'item_price_not_applied',
+)
+TOKEN_REFRESH_AHEAD_SECONDS = 300  # за сколько секунд до истечения токена Google обновлять его в фоне
+SHEETS_MAX_WORKERS = 4  # размер пула потоков для запросов к Google Sheets API
+SHEETS_BATCH_MAX_BYTES = 2 * 1024 * 1024  # максимальный размер одного запроса batchUpdate к Google Sheets
+SHEETS_WRITE_MODE = 'diff'  # 'full' - перезапись всего диапазона, 'diff' - только изменившиеся ячейки
+SHEETS_DIFF_MAX_CHANGED_SHARE = 0.5  # доля измененных ячеек, выше которой диапазон записывается целиком
 
   # Загрузка переменных из .env файла
 load_dotenv()
 
 # Озон
+OZON_PRICE_BATCH_SIZE = 1000  # товаров в одном запросе /v1/product/import/prices (не больше 1000)
+OZON_MAX_CONCURRENT_CHUNKS = 2  # одновременных запросов с пакетами цен
 Tech_PC_Components_OZON = os.getenv('Tech_PC_Components_OZON')
 Client_Id_Tech_PC_Components_OZON = "1336645"
 
@@ -21,6 +86,8 @@ ByMarket_OZON = os.getenv('ByMarket_OZON')
 Client_Id_ByMarket_OZON = "1515458"
 
 # Яндекс маркет
+YM_PRICE_BATCH_SIZE = 500  # предложений в одном запросе offer-prices/updates (не больше 500)
+YM_MAX_CONCURRENT_CHUNKS = 2  # одновременных запросов с пакетами цен
 Tech_PC_Components_YM = os.getenv('Tech_PC_Components_YM')
 B_id_Tech_PC_Components_YM = "76443469"
 
@@ -31,6 +98,105 @@ ByMarket_YM = os.getenv('ByMarket_YM')
 B_id_ByMarket_YM = "95137059"
 
 # Вайлдберриз
+WB_PRICE_BATCH_SIZE = 1000  # товаров в одной задаче /api/v2/upload/task (не больше 1000)
+WB_MAX_CONCURRENT_CHUNKS = 2  # одновременно отправляемых задач
+WB_TASK_POLL_TIMEOUT = 120  # сколько секунд ждать обработки задачи
+WB_TASK_POLL_INITIAL_DELAY = 2  # первая задержка между опросами статуса, далее удваивается
+WB_TASK_POLL_MAX_DELAY = 20
 Tech_PC_Components_WB = os.getenv('Tech_PC_Components_WB')
 ByMarket_WB = os.getenv('ByMarket_WB')
-Smart_shop_WB = os.getenv('Smart_shop_WB')
\ No newline at end of file
+Smart_shop_WB = os.getenv('Smart_shop_WB')
+
+# Мегамаркет
+MM_TOKEN = os.getenv('MM_TOKEN', 'token')
+
+# Реестр маркетплейсов. adapter - клиент API из registry.ADAPTERS, key_col - первичный ключ строк,
+# price_columns - столбцы скидок для update_price, push_columns - столбцы для клиента API,
+# client_options - параметры клиента (размер пакета, параллельность), shop_concurrency - сколько магазинов
+# обрабатывать одновременно, rate_limit - лимит запросов на один ключ API.
+# interval_minutes, priority, offset_seconds, client_options и rate_limit можно переопределить у магазина в SHOPS
+MARKETPLACES = {
+    'ozon': {
+        'name': 'Ozon',
+        'adapter': 'ozon',
+        'table_prefix': 'product_data_ozon',
+        'key_col': 'product_id',
+        'price_columns': {'old_disc_in_base_col': 'price_old', 'old_disc_manual_col': 'old_price'},
+        'push_columns': {'new_price_col': 't_price', 'base_old_price_col': 'price_old', 'old_price_col': 'old_price',
+                         'product_id_col': 'product_id', 'offer_id_col': 'offer_id', 'min_price_col': 'min_price'},
+        'save_updated': True,
+        'client_options': {'batch_size': OZON_PRICE_BATCH_SIZE, 'max_concurrent_chunks': OZON_MAX_CONCURRENT_CHUNKS},
+        'shop_concurrency': SHOP_MAX_CONCURRENCY,
+        'rate_limit': RATE_LIMITS['ozon'],
+        'interval_minutes': UPDATE_INTERVAL_MINUTES,
+    },
+    'wb': {
+        'name': 'Wildberries',
+        'adapter': 'wb',
+        'table_prefix': 'product_data_wb',
+        'key_col': 'nmID',
+        'price_columns': {'old_disc_in_base_col': 'disc_old', 'old_disc_manual_col': 'discount'},
+        'push_columns': {'nmID_col': 'nmID', 'price_col': 't_price', 'discount_col': 'discount',
+                         'disc_old_col': 'disc_old'},
+        'client_options': {'batch_size': WB_PRICE_BATCH_SIZE, 'max_concurrent_chunks': WB_MAX_CONCURRENT_CHUNKS,
+                           'poll_timeout': WB_TASK_POLL_TIMEOUT, 'poll_initial_delay': WB_TASK_POLL_INITIAL_DELAY,
+                           'poll_max_delay': WB_TASK_POLL_MAX_DELAY},
+        'shop_concurrency': SHOP_MAX_CONCURRENCY,
+        'rate_limit': RATE_LIMITS['wb'],
+        'interval_minutes': UPDATE_INTERVAL_MINUTES,
+    },
+    'ym': {
+        'name': 'Yandex Market',
+        'adapter': 'ym',
+        'table_prefix': 'product_data_ym',
+        'key_col': 'offer_id',
+        'price_columns': {'old_disc_in_base_col': 'price_old', 'old_disc_manual_col': 'discount_base'},
+        'push_columns': {'offer_id_col': 'offer_id', 'disc_old_col': 'price_old', 'new_price_col': 't_price',
+                         'discount_base_col': 'discount_base'},
+        'client_options': {'batch_size': YM_PRICE_BATCH_SIZE, 'max_concurrent_chunks': YM_MAX_CONCURRENT_CHUNKS},
+        'shop_concurrency': SHOP_MAX_CONCURRENCY,
+        'rate_limit': RATE_LIMITS['ym'],
+        'interval_minutes': UPDATE_INTERVAL_MINUTES,
+    },
+    'mm': {
+        'name': 'Megamarket',
+        'adapter': 'mm',
+        'enabled': False,  # Включите для обновления данных Megamarket
+        'table_prefix': 'product_data_mm',
+        'key_col': 'offerId',
+        'price_columns': {},
+        'push_columns': {'offer_id_col': 'offerId', 'price_col': 't_price', 'is_deleted_col': 'isDeleted'},
+        'client_options': {},
+        'shop_concurrency': SHOP_MAX_CONCURRENCY,
+        'rate_limit': RATE_LIMITS['mm'],
+        'interval_minutes': UPDATE_INTERVAL_MINUTES,
+    },
+}
+
+# Магазины: marketplace - ключ MARKETPLACES, shop - название (часть имени таблицы в SQLite),
+# range - диапазон в Google Sheets, credentials - параметры авторизации клиента API.
+# Необязательный write_range - диапазон записи результатов; по умолчанию это range, начальная строка которого
+# сдвинута на SHEET_HEADER_ROWS ('OzonByMarket!A1:K' -> 'OzonByMarket!A3:K')
+SHOPS = [
+    {'marketplace': 'ozon', 'shop': 'ByMarket', 'range': 'OzonByMarket!A1:K',
+     'credentials': {'client_id': Client_Id_ByMarket_OZON, 'api_key': ByMarket_OZON}},
+    {'marketplace': 'ozon', 'shop': 'Smart Shop', 'range': 'OzonSmartShop!A1:K',
+     'credentials': {'client_id': Client_Id_Smart_Shop_OZON, 'api_key': Smart_Shop_OZON}},
+    {'marketplace': 'ozon', 'shop': 'Tech PC Components', 'range': 'OzonTechPCComponents!A1:K',
+     'credentials': {'client_id': Client_Id_Tech_PC_Components_OZON, 'api_key': Tech_PC_Components_OZON}},
+    {'marketplace': 'wb', 'shop': 'Tech PC Components', 'range': 'WB_TechPCComponents!A1:I',
+     'credentials': {'api_key': Tech_PC_Components_WB}},
+    {'marketplace': 'wb', 'shop': 'ByMarket', 'range': 'WB_ByMarket!A1:I',
+     'credentials': {'api_key': ByMarket_WB}},
+    {'marketplace': 'wb', 'shop': 'Smart Shop', 'range': 'WB_SmartShop!A1:I',
+     'credentials': {'api_key': Smart_shop_WB}},
+    {'marketplace': 'ym', 'shop': 'Tech PC Components', 'range': 'YM_TechPCComponents!A1:I',
+     'credentials': {'access_token': Tech_PC_Components_YM, 'campaign_id': B_id_Tech_PC_Components_YM}},
+    {'marketplace': 'ym', 'shop': 'ByMarket', 'range': 'YM_ByMarket!A1:I',
+     'credentials': {'access_token': ByMarket_YM, 'campaign_id': B_id_ByMarket_YM}},
+    {'marketplace': 'ym', 'shop': 'Smart Shop', 'range': 'YM_SmartShop!A1:I',
+     'credentials': {'access_token': SSmart_shop_YM, 'campaign_id': B_id_SSmart_shop_YM}},
+    {'marketplace': 'mm', 'shop': 'MM1', 'range': 'MM!A1:H', 'credentials': {'token': MM_TOKEN}},
+    {'marketplace': 'mm', 'shop': 'MM2', 'range': 'MM!K1:R', 'credentials': {'token': MM_TOKEN}},
+    {'marketplace': 'mm', 'shop': 'MM3', 'range': 'MM!U1:AB', 'credentials': {'token': MM_TOKEN}},
+]
@@ -1,81 +1,182 @@
+import asyncio
 import pandas as pd
-from auth import get_credentials
-from googleapiclient.discovery import build
+from auth import get_sheets_service
+from sheets_api import execute
 import sqlite3
 import traceback
+from db import get_database
 from logger import logger  # Импорт логгера
 
+def _values_to_dataframe(values):
+    """Преобразует ответ Sheets API (список строк) в DataFrame, первая строка - заголовки"""
+    return pd.DataFrame(values[1:], columns=values[0])
+
 async def get_sheet_data(spreadsheet_id, range_name):
     """Получает данные из Google Sheets и возвращает их в виде pandas DataFrame"""
-    creds = await get_credentials()
-    service = build('sheets', 'v4', credentials=creds)
+    service = await get_sheets_service()
 
     try:
-        result = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
-                                                    range=range_name).execute()
+        result = await execute(service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
+                                                                   range=range_name))
         values = result.get('values', [])
     except Exception as e:
         logger.error("google_sheets_error", error=str(e))
         return None
 
-    df = pd.DataFrame(values[1:], columns=values[0])
+    df = _values_to_dataframe(values)
     return df
 
-async def save_to_database(df, db_name, product_data_table='product_data_ozon1', primary_key_cols=None):
-    """Записывает данные из DataFrame в таблицу базы данных, обновляя и удаляя существующие записи"""
-    conn = None
-    try:
-        logger.info("database_update_start", table=product_data_table, dataframe_size=len(df))
+async def get_sheets_data_batch(spreadsheet_id, range_names):
+    """Получает все диапазоны одним запросом batchGet и возвращает словарь {диапазон: DataFrame}.
+    Диапазоны, которые не удалось получить пакетно, запрашиваются по отдельности через get_sheet_data"""
+    range_names = list(dict.fromkeys(range_names))
+    frames = {}
+    if not range_names:
+        return frames
 
-        conn = sqlite3.connect(db_name)
-        c = conn.cursor()
+    service = await get_sheets_service()
 
-        logger.info("creating_table_if_not_exists")
-        columns = ", ".join([f'"{col}"' for col in df.columns])
-        c.execute(f"CREATE TABLE IF NOT EXISTS '{product_data_table}' ({columns})")
+    try:
+        result = await execute(service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id,
+                                                                        ranges=range_names))
+        value_ranges = result.get('valueRanges', [])
+        logger.info("google_sheets_batch_fetched", ranges=len(value_ranges))
+    except Exception as e:
+        # batchGet падает целиком, если хотя бы один диапазон некорректен
+        logger.warning("google_sheets_batch_error", error=str(e), ranges=len(range_names))
+        value_ranges = []
+
+    # Ответ batchGet возвращает диапазоны в том же порядке, что и в запросе
+    for range_name, value_range in zip(range_names, value_ranges):
+        try:
+            frames[range_name] = _values_to_dataframe(value_range.get('values', []))
+        except Exception as e:
+            logger.warning("google_sheets_batch_range_error", range=range_name, error=str(e))
+
+    missing = [range_name for range_name in range_names if range_name not in frames]
+    if missing:
+        logger.warning("google_sheets_batch_fallback", ranges=missing)
+        results = await asyncio.gather(*(get_sheet_data(spreadsheet_id, range_name) for range_name in missing),
+                                       return_exceptions=True)
+        for range_name, result in zip(missing, results):
+            if isinstance(result, Exception):
+                logger.error("google_sheets_error", range=range_name, error=str(result))
+                result = None
+            frames[range_name] = result
+
+    return frames
+
+def _quote(name):
+    """Экранирует имя таблицы или столбца для SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _key_condition(left, right, key_cols):
+    return " AND ".join(f"{left}.{_quote(col)} = {right}.{_quote(col)}" for col in key_cols)
+
+def _ensure_columns(c, table, columns):
+    """Добавляет в существующую таблицу столбцы, появившиеся в DataFrame"""
+    c.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in c.fetchall()}
+    for col in columns:
+        if col not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {_quote(col)}")
+            logger.info("column_added", column=col)
+
+def _ensure_key_index(c, product_data_table, key_cols):
+    """Создает уникальный индекс по первичному ключу. Таблицы, созданные раньше без ключа,
+    мигрируются на месте: дубликаты ключей удаляются (остается последняя запись), затем строится индекс"""
+    table = _quote(product_data_table)
+    c.execute(f"PRAGMA index_list({table})")
+    for index in c.fetchall():
+        index_name, unique = index[1], index[2]
+        if unique:
+            c.execute(f"PRAGMA index_info({_quote(index_name)})")
+            if {row[2] for row in c.fetchall()} == set(key_cols):
+                return
+
+    logger.info("primary_key_migration_start", table=product_data_table, keys=key_cols)
+    keys = ", ".join(_quote(col) for col in key_cols)
+    c.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table} GROUP BY {keys})")
+    duplicates_removed = c.rowcount
+    c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {_quote(product_data_table + '_pk')} ON {table} ({keys})")
+    logger.info("primary_key_migration_complete", table=product_data_table, duplicates_removed=duplicates_removed)
+
+def _sync_table(conn, df, product_data_table, primary_key_cols, removed_keys=None):
+    """Синхронизирует таблицу с DataFrame на соединении conn (внутри транзакции потока записи).
+    Если передан removed_keys, df содержит только новые и измененные строки: удаляются лишь строки
+    с ключами из removed_keys, а не все отсутствующие в df. Возвращает (inserted, updated, unchanged, deleted)"""
+    c = conn.cursor()
+
+    columns = [str(col) for col in df.columns]
+    value_cols = [col for col in columns if col not in primary_key_cols]
+
+    table = _quote(product_data_table)
+    column_list = ", ".join(_quote(col) for col in columns)
+    keys = ", ".join(_quote(col) for col in primary_key_cols)
+
+    c.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_list})")
+    _ensure_columns(c, table, columns)
+    _ensure_key_index(c, product_data_table, primary_key_cols)
+
+    # Временная таблица с тем же набором столбцов; при повторе ключа в DataFrame остается последняя строка
+    c.execute("DROP TABLE IF EXISTS temp.sync_stage")
+    c.execute(f"CREATE TEMP TABLE sync_stage ({column_list})")
+    c.execute(f"CREATE UNIQUE INDEX temp.sync_stage_pk ON sync_stage ({keys})")
+    rows = df.astype(str).to_numpy().tolist()
+    c.executemany(f"INSERT OR REPLACE INTO sync_stage ({column_list}) VALUES ({', '.join(['?'] * len(columns))})",
+                  rows)
+    c.execute("SELECT COUNT(*) FROM sync_stage")
+    staged = c.fetchone()[0]
+
+    match = _key_condition("t", "s", primary_key_cols)
+    c.execute(f"SELECT COUNT(*) FROM sync_stage s WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})")
+    inserts = c.fetchone()[0]
+
+    if value_cols:
+        differs = " OR ".join(f"t.{_quote(col)} IS NOT s.{_quote(col)}" for col in value_cols)
+        c.execute(f"SELECT COUNT(*) FROM sync_stage s JOIN {table} t ON {match} WHERE {differs}")
+        updates = c.fetchone()[0]
+        assignments = ", ".join(f"{_quote(col)} = excluded.{_quote(col)}" for col in value_cols)
+        changed = " OR ".join(f"{table}.{_quote(col)} IS NOT excluded.{_quote(col)}" for col in value_cols)
+        on_conflict = f"DO UPDATE SET {assignments} WHERE {changed}"
+    else:
+        updates = 0
+        on_conflict = "DO NOTHING"
+    unchanged = staged - inserts - updates
+
+    c.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM sync_stage WHERE true "
+              f"ON CONFLICT ({keys}) {on_conflict}")
+    if removed_keys is None:
+        c.execute(f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM sync_stage s WHERE {_key_condition(table, 's', primary_key_cols)})")
+        deleted = c.rowcount
+    else:
+        key_match = " AND ".join(f"{_quote(col)} = ?" for col in primary_key_cols)
+        deleted = 0
+        for key in removed_keys:
+            c.execute(f"DELETE FROM {table} WHERE {key_match}", tuple(key))
+            deleted += c.rowcount
+
+    c.execute("DROP TABLE temp.sync_stage")
+    return inserts, updates, unchanged, deleted
+
+async def save_to_database(df, db_name, product_data_table='product_data_ozon1', primary_key_cols=None,
+                           removed_keys=None):
+    """Записывает данные из DataFrame в таблицу базы данных, обновляя и удаляя существующие записи.
+    Для дельты (только новые и измененные строки) передается removed_keys - список кортежей ключей удаленных строк.
+
+    Синхронизация выполняется над множествами: DataFrame загружается во временную таблицу через executemany,
+    затем вставки и обновления применяются одним INSERT ... ON CONFLICT по уникальному индексу ключа,
+    а удаления - одним DELETE с анти-соединением. Запись выполняет поток записи db.Database"""
+    try:
+        logger.info("database_update_start", table=product_data_table, dataframe_size=len(df),
+                    delta=removed_keys is not None)
 
         if primary_key_cols is None:
-            primary_key_cols = [df.columns[0]]
+            primary_key_cols = [str(df.columns[0])]
         logger.info("primary_keys", keys=primary_key_cols)
 
-        logger.info("fetching_existing_records")
-        c.execute(f"SELECT * FROM '{product_data_table}'")
-        existing_data = {tuple(row[:len(primary_key_cols)]): row for row in c.fetchall()}
-        logger.info("existing_records_count", count=len(existing_data))
-
-        updates = inserts = unchanged = deleted = 0
-
-        logger.info("processing_records_start")
-        for index, row in df.iterrows():
-            key_values = tuple(str(row[col]) for col in primary_key_cols)
-            values = tuple(str(v) for v in row.tolist())
-
-            if key_values in existing_data:
-                if values != existing_data[key_values]:
-                    placeholders = ", ".join([f'"{col}"=?' for col in df.columns])
-                    c.execute(
-                        f"UPDATE '{product_data_table}' SET {placeholders} WHERE {' AND '.join([f'"{col}"=?' for col in primary_key_cols])}",
-                        values + key_values)
-                    updates += 1
-                else:
-                    unchanged += 1
-                del existing_data[key_values]
-            else:
-                placeholders = ", ".join(["?"] * len(values))
-                c.execute(f"INSERT INTO '{product_data_table}' VALUES ({placeholders})", values)
-                inserts += 1
-
-            if index % 1000 == 0:
-                logger.info("processing_progress", records_processed=index + 1)
-
-        logger.info("deleting_missing_records")
-        for key in existing_data.keys():
-            c.execute(
-                f"DELETE FROM '{product_data_table}' WHERE {' AND '.join([f'"{col}"=?' for col in primary_key_cols])}",
-                key)
-            deleted += 1
-
-        conn.commit()
+        inserts, updates, unchanged, deleted = await get_database(db_name).write(
+            lambda conn: _sync_table(conn, df, product_data_table, primary_key_cols, removed_keys))
         logger.info("database_changes_committed")
 
         total_records = max(len(df) + deleted, 1)
@@ -93,9 +194,3 @@ async def save_to_database(df, db_name, product_data_table='product_data_ozon1',
         logger.error("database_update_error",
                      error=str(e),
                      traceback=traceback.format_exc())
-    finally:
-        if conn:
-            conn.close()
-            logger.info("database_connection_closed")
-
-
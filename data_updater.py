@@ -5,6 +5,8 @@ import structlog
 from pathlib import Path
 import sqlite3
 from config import  SQLITE_DB_NAME
+from db import get_database
+from change_log import write_change_log
 from datetime import datetime
 import numpy as np
 from logger import logger
@@ -14,138 +16,197 @@ PRODUCT_ID_COL = 'product_id'
 PRICE_COL = 't_price'
 OLD_PRICE_COL = 'price'
 PRIM_COL = 'prim'
+NO_VALUE = 'Нет Значения'
+
+
+def fill_missing_values(df):
+    """Заменяет пустые и отсутствующие значения на 'Нет Значения', как это делает update_price"""
+    return df.replace('', np.nan).fillna(value=NO_VALUE)
+
+
+def _parse_float_column(column):
+    """Разбирает столбец в массив float так же, как float() для каждой ячейки.
+    Возвращает (значения, маска 'Нет Значения', маска некорректного формата).
+    Каждое уникальное значение разбирается один раз"""
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+    parsed = np.full(len(uniques), np.nan)
+    missing = np.zeros(len(uniques), dtype=bool)
+    invalid = np.zeros(len(uniques), dtype=bool)
+    for i, value in enumerate(uniques):
+        if value == NO_VALUE:
+            missing[i] = True
+            continue
+        try:
+            parsed[i] = float(value)
+        except ValueError:
+            invalid[i] = True
+    return parsed[codes], missing[codes], invalid[codes]
+
+
+def _assign(df, labels, col, values):
+    """Записывает значения в столбец df для строк с метками labels"""
+    if len(labels):
+        df.loc[labels, col] = np.array(values, dtype=object)
 
 
 async def update_price(df, id_col=ID_COL, product_id_col=PRODUCT_ID_COL, price_col=PRICE_COL,
                        old_price_col=OLD_PRICE_COL, prim_col=PRIM_COL, sqlite_db_name=SQLITE_DB_NAME,
-                       price_change_log_table='price_change_log', old_disc_in_base_col=None, old_disc_manual_col=None):
-    """Определяет необходимость обновления цен и скидок, записывает информацию об изменениях в таблицу price_change_log и обновляет цены в DataFrame"""
+                       price_change_log_table='price_change_log', old_disc_in_base_col=None, old_disc_manual_col=None,
+                       cycle_timestamp=None, digest=None):
+    """Определяет необходимость обновления цен и скидок, записывает информацию об изменениях в таблицу price_change_log и обновляет цены в DataFrame.
+
+    Решения принимаются для всех строк сразу операциями над массивами:
+    отсутствие цены, обновление с нуля, новая цена 0, изменение более 50%, обычное изменение цены и изменение скидки.
+    Все записи журнала получают одну метку времени cycle_timestamp (по умолчанию - время вызова).
+    Решения по отдельным строкам пишутся в лог на уровне DEBUG, итоги учитываются в сводке digest (ChangeDigest)"""
 
-    df = df.replace('', np.nan).fillna(value='Нет Значения')
+    df = fill_missing_values(df)
     df = df.iloc[1:]  # Пропускаем первую строку (заголовки)
-    changes = []
     updated_df = df.copy()
 
+    # Разбор цен и скидок один раз для всего столбца
+    old_price, old_missing, invalid = _parse_float_column(df[old_price_col])
+    new_price, new_missing, new_invalid = _parse_float_column(df[price_col])
+    invalid = invalid | new_invalid
+
+    has_discount = bool(old_disc_in_base_col and old_disc_manual_col)
+    if has_discount:
+        disc_base, disc_base_missing, disc_base_invalid = _parse_float_column(df[old_disc_in_base_col])
+        disc_manual, disc_manual_missing, disc_manual_invalid = _parse_float_column(df[old_disc_manual_col])
+        disc_base[disc_base_missing] = 0
+        disc_manual[disc_manual_missing] = 0
+        invalid = invalid | disc_base_invalid | disc_manual_invalid
+        discount_changed = ~invalid & (disc_base != disc_manual)
+        # Отсутствующая скидка считается целым 0, как и раньше в примечаниях и журнале
+        disc_base_values = np.array(disc_base.tolist(), dtype=object)
+        disc_base_values[disc_base_missing] = 0
+        disc_manual_values = np.array(disc_manual.tolist(), dtype=object)
+        disc_manual_values[disc_manual_missing] = 0
+    else:
+        discount_changed = np.zeros(len(df), dtype=bool)
+
+    valid = ~invalid
+    missing_price = valid & (old_missing | new_missing)
+    priced = valid & ~missing_price
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_ratio = np.abs(new_price - old_price) / old_price
+    from_zero = priced & (old_price == 0) & (new_price != 0)
+    nonzero = priced & (old_price != 0)
+    to_zero = nonzero & (new_price == 0)
+    exceeds_limit = nonzero & (new_price != 0) & (change_ratio > 0.5)
+    normal_change = nonzero & (new_price != 0) & ~(change_ratio > 0.5) & (new_price != old_price)
+    price_changed = from_zero | normal_change
+    both_changed = price_changed & discount_changed
+    price_decision = missing_price | from_zero | to_zero | exceeds_limit | normal_change
+
+    def fmt(values, mask):
+        return [str(v) for v in values[mask].tolist()]
+
+    # Примечания для каждой строки, в которой принято решение
+    prim = np.empty(len(df), dtype=object)
+    if has_discount:
+        discount_prim = np.empty(len(df), dtype=object)
+        discount_prim[discount_changed] = [f"Обновлена скидка с {b} на {m}" for b, m in
+                                           zip(fmt(disc_base_values, discount_changed), fmt(disc_manual_values, discount_changed))]
+        prim[discount_changed] = discount_prim[discount_changed]
+    prim[missing_price] = "Отсутствует старая или новая цена"
+    prim[from_zero] = [f"Старая цена была 0, обновлено на {n}" for n in fmt(new_price, from_zero)]
+    prim[to_zero] = "Новая цена стала 0, требуется проверка"
+    prim[exceeds_limit] = [f"Изменение цены с {o} на {n} превышает 50%, цена не изменена" for o, n in
+                           zip(fmt(old_price, exceeds_limit), fmt(new_price, exceeds_limit))]
+    prim[normal_change] = [f"Изменена цена с {o} на {n}" for o, n in
+                           zip(fmt(old_price, normal_change), fmt(new_price, normal_change))]
+    price_prim = prim.copy()
+    prim[both_changed] = [f"Изменена цена с {o} на {n} и скидка с {b} на {m}" for o, n, b, m in
+                          zip(fmt(old_price, both_changed), fmt(new_price, both_changed),
+                              fmt(disc_base_values, both_changed) if has_discount else [],
+                              fmt(disc_manual_values, both_changed) if has_discount else [])]
+
+    # Обновление DataFrame пакетно по маскам
+    labels = df.index
+    if has_discount:
+        _assign(updated_df, labels[discount_changed], old_disc_in_base_col, disc_manual_values[discount_changed].tolist())
+    _assign(updated_df, labels[price_changed], old_price_col, new_price[price_changed].tolist())
+    _assign(updated_df, labels[price_decision | discount_changed], prim_col, prim[price_decision | discount_changed])
+
+    if digest is not None:
+        digest.add_decisions(len(df), {
+            "invalid_price_or_discount": invalid.sum(), "missing_price": missing_price.sum(),
+            "price_updated_from_zero": from_zero.sum(), "new_price_zero": to_zero.sum(),
+            "price_change_exceeds_limit": exceeds_limit.sum(), "price_updated": normal_change.sum(),
+            "discount_updated": discount_changed.sum(), "price_and_discount_updated": both_changed.sum()})
+        changed_prices = np.flatnonzero(price_changed)
+        digest.add_price_changes(df[id_col].to_numpy()[changed_prices].tolist(),
+                                 df[product_id_col].to_numpy()[changed_prices].tolist(),
+                                 old_price[changed_prices], new_price[changed_prices])
+
+    # Строки для price_changed_df
+    changed = price_changed | discount_changed
+    changed_positions = np.flatnonzero(changed)
+    changes = df.iloc[changed_positions].to_dict('records')
+    for position, change_info in zip(changed_positions.tolist(), changes):
+        if price_changed[position]:
+            if from_zero[position]:
+                change_info[old_price_col] = float(new_price[position])
+            else:
+                change_info[price_col] = float(new_price[position])
+            change_info[prim_col] = prim[position]
+        else:
+            change_info[old_disc_in_base_col] = disc_manual_values[position]
+            change_info['old_discount'] = disc_base_values[position]
+            change_info['new_discount'] = disc_manual_values[position]
+            change_info['prim'] = discount_prim[position]
+        change_info['change_applied'] = True
+
+    # Строки журнала price_change_log в порядке строк DataFrame:
+    # сначала скидка, затем решение по цене, затем совместное изменение
+    timestamp = cycle_timestamp or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ids = df[id_col].tolist()
+    product_ids = df[product_id_col].tolist()
+    raw_old_prices = df[old_price_col].tolist()
+    old_values = [None if m else v for m, v in zip(old_missing.tolist(), old_price.tolist())]
+    new_values = [None if m else v for m, v in zip(new_missing.tolist(), new_price.tolist())]
+    log_rows = []
+    for position in np.flatnonzero(invalid | price_decision | discount_changed).tolist():
+        row_id = ids[position]
+        product_id = product_ids[position]
+        if invalid[position]:
+            logger.debug("invalid_price_or_discount", message="Некорректный формат цены или скидки", importance="high", id=row_id, product_id=product_id)
+            log_rows.append((timestamp, row_id, product_id, None, None, None, None, "Ошибка формата данных", 0))
+            continue
+        old, new = old_values[position], new_values[position]
+        if discount_changed[position]:
+            base, manual = disc_base_values[position], disc_manual_values[position]
+            logger.debug("discount_updated", message=f"Обновлена скидка для товара", id=row_id, product_id=product_id, old_discount=base, new_discount=manual)
+            log_rows.append((timestamp, row_id, product_id, raw_old_prices[position], raw_old_prices[position],
+                             base, manual, discount_prim[position], 1))
+        if missing_price[position]:
+            logger.debug("missing_price", message="Отсутствует старая или новая цена", importance="high", id=row_id, product_id=product_id)
+            log_rows.append((timestamp, row_id, product_id, old, new, None, None, price_prim[position], 0))
+        elif from_zero[position]:
+            logger.debug("price_updated_from_zero", message="Цена обновлена с нуля", id=row_id, product_id=product_id, new_price=new)
+            log_rows.append((timestamp, row_id, product_id, old, new, None, None, price_prim[position], 1))
+        elif to_zero[position]:
+            logger.debug("new_price_zero", message="Новая цена стала нулевой, требуется проверка", importance="high", id=row_id, product_id=product_id)
+            log_rows.append((timestamp, row_id, product_id, old, new, None, None, price_prim[position], 0))
+        elif exceeds_limit[position]:
+            logger.debug("price_change_exceeds_limit", message="Изменение цены превышает допустимый предел", importance="high", id=row_id, product_id=product_id, old_price=old, new_price=new)
+            log_rows.append((timestamp, row_id, product_id, old, new, None, None, price_prim[position], 0))
+        elif normal_change[position]:
+            logger.debug("price_updated", message="Цена обновлена", id=row_id, product_id=product_id, old_price=old, new_price=new)
+            log_rows.append((timestamp, row_id, product_id, old, new, None, None, price_prim[position], 1))
+        if both_changed[position]:
+            logger.debug("price_and_discount_updated", message="Обновлены цена и скидка", id=row_id, product_id=product_id, old_price=old, new_price=new, old_discount=base, new_discount=manual)
+            log_rows.append((timestamp, row_id, product_id, old, new, base, manual, prim[position], 1))
+
     try:
-        conn = sqlite3.connect(sqlite_db_name)
-        c = conn.cursor()
-
-        c.execute(f'''CREATE TABLE IF NOT EXISTS '{price_change_log_table}'  
-                     (timestamp TEXT, id TEXT, product_id TEXT, old_price REAL, new_price REAL, old_discount REAL, new_discount REAL, prim TEXT, change_applied INTEGER)''')
-
-        for _, row in df.iterrows():
-            change_info = None
-            price_changed = False
-            discount_changed = False
-
-            try:
-                old_price = float(row[old_price_col]) if row[old_price_col] != 'Нет Значения' else None
-                new_price = float(row[price_col]) if row[price_col] != 'Нет Значения' else None
-
-                # Обработка скидок, если соответствующие колонки переданы
-                if old_disc_in_base_col and old_disc_manual_col:
-                    old_disc_in_base = float(row[old_disc_in_base_col]) if row[old_disc_in_base_col] != 'Нет Значения' else 0
-                    old_disc_manual = float(row[old_disc_manual_col]) if row[old_disc_manual_col] != 'Нет Значения' else 0
-
-                    if old_disc_in_base != old_disc_manual:
-                        updated_df.at[_, old_disc_in_base_col] = old_disc_manual
-                        discount_changed = True
-                        change_info = row.to_dict()
-                        change_info[old_disc_in_base_col] = old_disc_manual
-                        change_info['old_discount'] = old_disc_in_base
-                        change_info['new_discount'] = old_disc_manual
-                        discount_prim = f"Обновлена скидка с {old_disc_in_base} на {old_disc_manual}"
-                        updated_df.at[_, prim_col] = discount_prim
-                        change_info['prim'] = discount_prim
-                        logger.info("discount_updated", message=f"Обновлена скидка для товара", id=row[id_col], product_id=row[product_id_col], old_discount=old_disc_in_base, new_discount=old_disc_manual)
-
-                        c.execute(
-                            f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col],
-                             row[old_price_col], row[old_price_col], old_disc_in_base, old_disc_manual, discount_prim, 1))
-
-            except ValueError:
-                logger.warning("invalid_price_or_discount", message="Некорректный формат цены или скидки", importance="high", id=row[id_col], product_id=row[product_id_col])
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], None, None, None,
-                     None, "Ошибка формата данных", 0))
-                continue
-
-            if old_price is None or new_price is None:
-                updated_df.at[_, prim_col] = "Отсутствует старая или новая цена"
-                logger.info("missing_price", message="Отсутствует старая или новая цена", importance="high", id=row[id_col], product_id=row[product_id_col])
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                     new_price, None, None, "Отсутствует старая или новая цена", 0))
-            elif old_price == 0:
-                if new_price != 0:
-                    updated_df.at[_, old_price_col] = new_price
-                    updated_df.at[_, prim_col] = f"Старая цена была 0, обновлено на {new_price}"
-                    price_changed = True
-                    change_info = row.to_dict()
-                    change_info[old_price_col] = new_price
-                    change_info[prim_col] = f"Старая цена была 0, обновлено на {new_price}"
-                    logger.info("price_updated_from_zero", message="Цена обновлена с нуля", id=row[id_col], product_id=row[product_id_col], new_price=new_price)
-                    c.execute(
-                        f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                        (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                         new_price, None, None, f"Старая цена была 0, обновлено на {new_price}", 1))
-            elif new_price == 0:
-                updated_df.at[_, prim_col] = "Новая цена стала 0, требуется проверка"
-                logger.warning("new_price_zero", message="Новая цена стала нулевой, требуется проверка", importance="high", id=row[id_col], product_id=row[product_id_col])
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                     new_price, None, None, "Новая цена стала 0, требуется проверка", 0))
-            elif abs(new_price - old_price) / old_price > 0.5:
-                updated_df.at[_, prim_col] = f"Изменение цены с {old_price} на {new_price} превышает 50%, цена не изменена"
-                logger.warning("price_change_exceeds_limit", message="Изменение цены превышает допустимый предел", importance="high", id=row[id_col], product_id=row[product_id_col], old_price=old_price, new_price=new_price)
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                     new_price, None, None, f"Изменение цены с {old_price} на {new_price} превышает 50%, цена не изменена", 0))
-            elif new_price != old_price:
-                updated_df.at[_, old_price_col] = new_price  # Обновляем цену в DataFrame
-                updated_df.at[_, prim_col] = f"Изменена цена с {old_price} на {new_price}"
-                price_changed = True
-                change_info = row.to_dict()
-                change_info[price_col] = new_price
-                change_info[prim_col] = f"Изменена цена с {old_price} на {new_price}"
-                logger.info("price_updated", message="Цена обновлена", id=row[id_col], product_id=row[product_id_col], old_price=old_price, new_price=new_price)
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                     new_price, None, None, f"Изменена цена с {old_price} на {new_price}", 1))
-
-            # Обновляем примечание, если изменились и цена, и скидка
-            if price_changed and discount_changed:
-                prim = f"Изменена цена с {old_price} на {new_price} и скидка с {old_disc_in_base} на {old_disc_manual}"
-                updated_df.at[_, prim_col] = prim
-                change_info[prim_col] = prim
-                logger.info("price_and_discount_updated", message="Обновлены цена и скидка", id=row[id_col], product_id=row[product_id_col], old_price=old_price, new_price=new_price, old_discount=old_disc_in_base, new_discount=old_disc_manual)
-                c.execute(
-                    f"INSERT INTO '{price_change_log_table}' (timestamp, id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[id_col], row[product_id_col], old_price,
-                     new_price, old_disc_in_base, old_disc_manual, prim, 1))
-
-            if change_info and (price_changed or discount_changed):
-                change_info['change_applied'] = True
-                changes.append(change_info)
-
-        conn.commit()
+        # Весь журнал за вызов пишется одним заданием потока записи (одной транзакцией)
+        await get_database(sqlite_db_name).write(lambda conn: write_change_log(conn, price_change_log_table, log_rows))
     except sqlite3.Error as e:
         logger.error("database_error", message="Ошибка базы данных", importance="high", error=str(e))
         return None, None
 
-    conn.close()
-
     # Создаем новый DataFrame, содержащий только строки с измененными ценами или скидками
     price_changed_df = pd.DataFrame(changes)
 
     return updated_df, price_changed_df
-
-
-
-
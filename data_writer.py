@@ -1,9 +1,13 @@
 
 import asyncio
+import json
+import re
+import numpy as np
 import pandas as pd
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from auth import get_credentials
+from auth import get_sheets_service
+from sheets_api import execute
+from config import SHEETS_BATCH_MAX_BYTES, SHEETS_WRITE_MODE, SHEETS_DIFF_MAX_CHANGED_SHARE
 from logger import logger  # Импорт логгера
 
 
@@ -12,10 +16,8 @@ async def write_sheet_data(df, spreadsheet_id, range_name):
                 spreadsheet_id=spreadsheet_id,
                 range_name=range_name)
 
-    creds = await get_credentials()
-
     try:
-        service = build("sheets", "v4", credentials=creds)
+        service = await get_sheets_service()
 
         # Заполняем пустые значения в DataFrame
         df = df.fillna('')
@@ -38,7 +40,7 @@ async def write_sheet_data(df, spreadsheet_id, range_name):
 
         logger.info("Выполнение запроса к API Google Sheets")
         # Запускаем запрос и получаем ответ
-        response = await asyncio.to_thread(request.execute)
+        response = await execute(request)
 
         # Теперь response содержит фактический ответ
         logger.info("Данные успешно обновлены в Google Sheets",
@@ -65,3 +67,236 @@ async def write_sheet_data(df, spreadsheet_id, range_name):
                          error=str(e))
 
 
+
+
+def _estimate_payload_size(value_range):
+    """Оценивает размер диапазона в теле запроса batchUpdate (в байтах)"""
+    return len(json.dumps(value_range, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def _split_by_size(entries, max_payload_bytes):
+    """Разбивает список пар (исходный диапазон, данные диапазона) на пакеты, размер каждого
+    из которых не превышает max_payload_bytes. Диапазон больше лимита отправляется отдельным пакетом"""
+    batches = []
+    batch = []
+    batch_size = 0
+    for entry in entries:
+        size = _estimate_payload_size(entry[1])
+        if batch and batch_size + size > max_payload_bytes:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(entry)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _update_range(service, spreadsheet_id, value_range):
+    """Записывает один диапазон через values().update, возвращает True при успехе"""
+    try:
+        request = service.spreadsheets().values().update(
+            spreadsheetId=spreadsheet_id,
+            range=value_range["range"],
+            valueInputOption="USER_ENTERED",
+            body={"values": value_range["values"]}
+        )
+        response = await execute(request)
+        logger.info("Диапазон записан в Google Sheets",
+                    range_name=value_range["range"],
+                    updated_cells=response.get('updatedCells', 'Неизвестно'))
+        return True
+    except Exception as e:
+        logger.error("Произошла ошибка при записи данных в Google Sheets",
+                     spreadsheet_id=spreadsheet_id,
+                     range_name=value_range["range"],
+                     error=str(e))
+        return False
+
+
+_A1_START_RE = re.compile(r"^(?P<sheet>.+)!\$?(?P<col>[A-Za-z]+)\$?(?P<row>\d+)")
+
+
+def _column_index(letters):
+    """Преобразует буквенное обозначение столбца (A, K, AB) в индекс с нуля"""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index - 1
+
+
+def _column_letter(index):
+    """Преобразует индекс столбца с нуля в буквенное обозначение (0 -> A, 27 -> AB)"""
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def _cells_as_text(df):
+    """Приводит значения DataFrame к строкам для сравнения; пустые значения становятся ''"""
+    return df.astype(object).where(df.notna(), '').astype(str).to_numpy()
+
+
+def build_cell_diff(original_df, updated_df, range_name):
+    """Сравнивает обновленный DataFrame с полученным из таблицы и возвращает
+    (список диапазонов с измененными ячейками, число измененных ячеек, общее число ячеек).
+
+    Строки сопоставляются по индексу, столбцы - по именам. Измененные ячейки одной строки
+    объединяются в непрерывные отрезки, а одинаковые отрезки соседних строк - в прямоугольные блоки.
+    Возвращает None, если диапазон или фреймы нельзя сопоставить."""
+    match = _A1_START_RE.match(range_name)
+    if match is None or not updated_df.index.is_unique or not updated_df.columns.is_unique:
+        return None
+    if not original_df.index.is_unique or not original_df.columns.is_unique:
+        return None
+
+    sheet = match.group('sheet')
+    start_col = _column_index(match.group('col'))
+    start_row = int(match.group('row'))
+
+    original = original_df.reindex(index=updated_df.index, columns=updated_df.columns)
+    changed = _cells_as_text(original) != _cells_as_text(updated_df)
+    total_cells = changed.size
+    changed_cells = int(changed.sum())
+    if changed_cells == 0:
+        return [], 0, total_cells
+
+    # Начала и концы отрезков измененных ячеек в каждой строке
+    padded = np.zeros((changed.shape[0], changed.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = changed
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+
+    # Склеиваем одинаковые отрезки в соседних строках в блоки [первая строка, последняя строка]
+    blocks = []
+    open_blocks = {}
+    for row, first, last in zip(run_rows.tolist(), run_starts.tolist(), run_ends.tolist()):
+        block = open_blocks.get((first, last))
+        if block is not None and block[1] == row - 1:
+            block[1] = row
+        else:
+            block = [row, row, first, last]
+            open_blocks[(first, last)] = block
+            blocks.append(block)
+
+    values = updated_df.fillna('').to_numpy(dtype=object)
+    value_ranges = []
+    for first_row, last_row, first_col, end_col in blocks:
+        a1 = (f"{sheet}!{_column_letter(start_col + first_col)}{start_row + first_row}:"
+              f"{_column_letter(start_col + end_col - 1)}{start_row + last_row}")
+        value_ranges.append({
+            "range": a1,
+            "values": values[first_row:last_row + 1, first_col:end_col].tolist()
+        })
+    return value_ranges, changed_cells, total_cells
+
+
+class SheetWriteBuffer:
+    """Накапливает обновленные DataFrame и записывает их одним запросом batchUpdate
+    (с разбиением на части по размеру).
+
+    В режиме 'diff' отправляются только изменившиеся ячейки относительно полученного из таблицы
+    DataFrame; если доля изменений превышает max_changed_share, диапазон записывается целиком."""
+
+    def __init__(self, spreadsheet_id, max_payload_bytes=SHEETS_BATCH_MAX_BYTES,
+                 write_mode=SHEETS_WRITE_MODE, max_changed_share=SHEETS_DIFF_MAX_CHANGED_SHARE):
+        self.spreadsheet_id = spreadsheet_id
+        self.max_payload_bytes = max_payload_bytes
+        self.write_mode = write_mode
+        self.max_changed_share = max_changed_share
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, df, range_name, original_df=None):
+        """Добавляет DataFrame в буфер; повторная запись того же диапазона заменяет предыдущую.
+        original_df - DataFrame, полученный из таблицы (нужен для режима 'diff')"""
+        if self.write_mode == 'diff' and original_df is not None:
+            try:
+                diff = build_cell_diff(original_df, df, range_name)
+            except Exception as e:
+                logger.warning("Не удалось сравнить данные, диапазон будет записан целиком",
+                               range_name=range_name, error=str(e))
+                diff = None
+            if diff is not None:
+                value_ranges, changed_cells, total_cells = diff
+                if changed_cells <= total_cells * self.max_changed_share:
+                    self._pending[range_name] = value_ranges
+                    logger.debug("Изменения диапазона добавлены в буфер записи", range_name=range_name,
+                                 changed_cells=changed_cells, total_cells=total_cells,
+                                 blocks=len(value_ranges))
+                    return
+                logger.debug("Доля изменений превышает порог, диапазон будет записан целиком",
+                             range_name=range_name, changed_cells=changed_cells, total_cells=total_cells)
+
+        df = df.fillna('')
+        self._pending[range_name] = [{"range": range_name, "values": df.values.tolist()}]
+        logger.debug("Диапазон добавлен в буфер записи", range_name=range_name, rows=len(df))
+
+    async def flush(self):
+        """Записывает все накопленные диапазоны и очищает буфер.
+        Возвращает словарь с количеством успешно записанных, неуспешных и пропущенных (без изменений) диапазонов
+        и множеством неуспешных диапазонов failed_ranges"""
+        pending = self._pending
+        self._pending = {}
+        skipped = sum(1 for value_ranges in pending.values() if not value_ranges)
+        entries = [(range_name, value_range)
+                   for range_name, value_ranges in pending.items()
+                   for value_range in value_ranges]
+        if not entries:
+            if pending:
+                logger.info("Изменений для записи в Google Sheets нет", ranges_skipped=skipped)
+            return {"succeeded": 0, "failed": 0, "skipped": skipped, "failed_ranges": set()}
+
+        service = await get_sheets_service()
+
+        batches = _split_by_size(entries, self.max_payload_bytes)
+        logger.info("Запуск пакетной записи в Google Sheets",
+                    spreadsheet_id=self.spreadsheet_id,
+                    ranges=len(pending) - skipped,
+                    value_ranges=len(entries),
+                    requests=len(batches))
+
+        failed_ranges = set()
+        for batch in batches:
+            data = [value_range for _, value_range in batch]
+            try:
+                request = service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "USER_ENTERED", "data": data}
+                )
+                response = await execute(request)
+                for (range_name, value_range), result in zip(batch, response.get('responses', [])):
+                    logger.debug("Диапазон записан в Google Sheets",
+                                 range_name=value_range["range"],
+                                 updated_cells=result.get('updatedCells', 'Неизвестно'))
+                logger.info("Пакет записан в Google Sheets",
+                            value_ranges=len(batch),
+                            updated_cells=response.get('totalUpdatedCells', 'Неизвестно'))
+            except Exception as e:
+                # batchUpdate атомарен: при ошибке не записан ни один диапазон пакета,
+                # поэтому повторяем запись по одному диапазону, чтобы изолировать проблемный
+                logger.warning("Ошибка пакетной записи, запись диапазонов по отдельности",
+                               spreadsheet_id=self.spreadsheet_id,
+                               value_ranges=len(batch),
+                               error=str(e))
+                for range_name, value_range in batch:
+                    if not await _update_range(service, self.spreadsheet_id, value_range):
+                        failed_ranges.add(range_name)
+
+        failed = len(failed_ranges)
+        succeeded = len(pending) - skipped - failed
+        log = logger.warning if failed else logger.info
+        log("Пакетная запись в Google Sheets завершена",
+            spreadsheet_id=self.spreadsheet_id,
+            ranges_succeeded=succeeded,
+            ranges_failed=failed,
+            ranges_skipped=skipped,
+            failed_ranges=sorted(failed_ranges) or None)
+        return {"succeeded": succeeded, "failed": failed, "skipped": skipped, "failed_ranges": failed_ranges}
@@ -0,0 +1,157 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS,
+                    SQLITE_WRITER_MAX_BATCH, SQLITE_READ_POOL_SIZE)
+from logger import logger
+
+
+def connect(db_name):
+    """Открывает соединение с SQLite с настройками журнала и синхронизации из config.py.
+    WAL позволяет читать базу во время записи, а synchronous=NORMAL в режиме WAL
+    не вызывает fsync на каждую транзакцию"""
+    conn = sqlite3.connect(db_name)
+    conn.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    return conn
+
+
+def _resolve_future(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Database:
+    """Доступ к базе SQLite без блокировки цикла событий.
+
+    Все записи выполняет одно долгоживущее соединение на выделенном потоке: корутины ставят задания
+    в очередь, поток забирает накопившиеся задания (до max_batch) и выполняет их одной транзакцией,
+    каждое - в своей точке сохранения, чтобы ошибка одного задания не отменяла остальные.
+    Чтение выполняется в небольшом пуле потоков с соединениями только для чтения."""
+
+    def __init__(self, db_name, max_batch=SQLITE_WRITER_MAX_BATCH, read_pool_size=SQLITE_READ_POOL_SIZE):
+        self.db_name = db_name
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._run_writer, name=f"sqlite-writer-{db_name}", daemon=True)
+        self._writer.start()
+        self._readers = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix="sqlite-reader")
+        self._reader_local = threading.local()
+
+    def queue_size(self):
+        return self._queue.qsize()
+
+    async def write(self, job):
+        """Выполняет job(conn) на пишущем соединении внутри транзакции и возвращает результат.
+        Задание не должно вызывать commit/rollback - транзакцией управляет поток записи"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((job, loop, future))
+        return await future
+
+    async def read(self, job):
+        """Выполняет job(conn) на соединении только для чтения из пула и возвращает результат"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_reader, job)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._readers.shutdown(wait=True)
+
+    def _run_reader(self, job):
+        conn = getattr(self._reader_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True)
+            conn.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+            self._reader_local.conn = conn
+        return job(conn)
+
+    def _next_batch(self):
+        """Ждет первое задание и добирает уже накопившиеся в очереди. None означает остановку"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run_writer(self):
+        conn = connect(self.db_name)
+        conn.isolation_level = None  # транзакциями управляем явно
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for job, loop, future in batch:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        result = job(conn)
+                        conn.execute("RELEASE job")
+                        results.append((loop, future, result, None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((loop, future, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                logger.error("sqlite_writer_transaction_error", db_name=self.db_name, jobs=len(batch), error=str(e))
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(loop, future, None, e) for job, loop, future in batch]
+            for loop, future, result, error in results:
+                self._deliver(loop, future, result, error)
+        conn.close()
+
+    def _deliver(self, loop, future, result, error):
+        """Передает результат задания в цикл событий, из которого оно поставлено.
+        Если этот цикл уже закрыт, результат некому получить: он отбрасывается, а поток записи продолжает работу"""
+        if loop.is_closed():
+            logger.warning("sqlite_writer_loop_closed", db_name=self.db_name)
+            return
+        try:
+            loop.call_soon_threadsafe(_resolve_future, future, result, error)
+        except RuntimeError:
+            # Цикл закрылся между проверкой и вызовом
+            logger.warning("sqlite_writer_loop_closed", db_name=self.db_name)
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(db_name):
+    """Возвращает общий для процесса объект Database для файла db_name"""
+    with _databases_lock:
+        database = _databases.get(db_name)
+        if database is None:
+            database = Database(db_name)
+            _databases[db_name] = database
+        return database
+
+
+def close_databases():
+    """Дожидается завершения всех заданий записи и закрывает соединения"""
+    with _databases_lock:
+        databases = list(_databases.values())
+        _databases.clear()
+    for database in databases:
+        database.close()
@@ -0,0 +1,98 @@
+import hashlib
+import time
+import pandas as pd
+from config import SQLITE_DB_NAME, FINGERPRINT_FULL_RUN_MINUTES
+from db import get_database
+from logger import logger
+
+FINGERPRINT_TABLE = 'range_fingerprints'
+
+
+def frame_fingerprint(df):
+    """Возвращает хеш содержимого DataFrame (заголовки и значения всех ячеек)"""
+    digest = hashlib.sha256('\x1f'.join(str(col) for col in df.columns).encode())
+    digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class FingerprintStore:
+    """Отпечатки последних обработанных диапазонов по (маркетплейс, магазин) в памяти и в SQLite.
+
+    Диапазон считается неизменным, если его отпечаток совпадает с последним обработанным и с момента
+    обработки прошло меньше full_run_minutes; иначе выполняется полная обработка.
+    Отпечаток сначала ставится в ожидание (stage) и сохраняется (commit) только после успешной
+    записи диапазона в Google Sheets, чтобы неудачная запись повторилась в следующем цикле."""
+
+    def __init__(self, db_name=SQLITE_DB_NAME, full_run_minutes=FINGERPRINT_FULL_RUN_MINUTES):
+        self.db_name = db_name
+        self.full_run_seconds = full_run_minutes * 60
+        self._known = {}
+        self._pending = {}
+        self._loaded = False
+
+    async def load(self):
+        """Загружает сохраненные отпечатки из SQLite (один раз за время работы процесса)"""
+        if self._loaded:
+            return
+
+        def job(conn):
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {FINGERPRINT_TABLE} (
+                    marketplace TEXT NOT NULL,
+                    shop TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    processed_at REAL NOT NULL,
+                    PRIMARY KEY (marketplace, shop)
+                )
+            """)
+            return conn.execute(f"SELECT marketplace, shop, fingerprint, processed_at FROM {FINGERPRINT_TABLE}").fetchall()
+
+        rows = await get_database(self.db_name).write(job)
+        self._known = {(marketplace, shop): (fingerprint, processed_at)
+                       for marketplace, shop, fingerprint, processed_at in rows}
+        self._loaded = True
+        logger.info("Загружены отпечатки диапазонов", count=len(self._known))
+
+    def is_unchanged(self, marketplace, shop, fingerprint):
+        known = self._known.get((marketplace, shop))
+        if known is None or known[0] != fingerprint:
+            return False
+        return time.time() - known[1] < self.full_run_seconds
+
+    def stage(self, marketplace, shop, fingerprint, sheet_range):
+        """Запоминает отпечаток успешно обработанного диапазона до записи в Google Sheets"""
+        self._pending[(marketplace, shop)] = (fingerprint, sheet_range)
+
+    def _take_pending(self, ranges):
+        """Забирает ожидающие отпечатки диапазонов записи ranges (None - все)"""
+        taken = {key: value for key, value in self._pending.items() if ranges is None or value[1] in ranges}
+        for key in taken:
+            del self._pending[key]
+        return taken
+
+    def discard(self, ranges=None):
+        """Отбрасывает ожидающие отпечатки (цикл завершился ошибкой до записи в Google Sheets)"""
+        self._take_pending(ranges)
+
+    async def commit(self, failed_ranges=(), ranges=None):
+        """Сохраняет ожидающие отпечатки диапазонов ranges (None - все), кроме диапазонов, запись которых не удалась"""
+        pending = self._take_pending(ranges)
+        now = time.time()
+        rows = [(marketplace, shop, fingerprint, now)
+                for (marketplace, shop), (fingerprint, sheet_range) in pending.items()
+                if sheet_range not in failed_ranges]
+        if not rows:
+            return 0
+
+        def job(conn):
+            conn.executemany(f"""
+                INSERT INTO {FINGERPRINT_TABLE} (marketplace, shop, fingerprint, processed_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (marketplace, shop) DO UPDATE SET
+                    fingerprint = excluded.fingerprint, processed_at = excluded.processed_at
+            """, rows)
+
+        await get_database(self.db_name).write(job)
+        for marketplace, shop, fingerprint, processed_at in rows:
+            self._known[(marketplace, shop)] = (fingerprint, processed_at)
+        return len(rows)
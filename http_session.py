@@ -0,0 +1,79 @@
+from contextlib import asynccontextmanager
+import aiohttp
+from config import (HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL,
+                    HTTP_TOTAL_TIMEOUT, HTTP_CONNECT_TIMEOUT)
+
+
+class HttpSessionManager:
+    """Общая для всех клиентов маркетплейсов aiohttp-сессия с пулом соединений.
+
+    Соединения переиспользуются между магазинами и циклами (keep-alive), DNS кешируется,
+    число соединений ограничено общим лимитом и лимитом на хост. Счетчики использования
+    пула собираются через TraceConfig и доступны через stats()"""
+
+    def __init__(self, limit=HTTP_POOL_LIMIT, limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, dns_cache_ttl=HTTP_DNS_CACHE_TTL,
+                 total_timeout=HTTP_TOTAL_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.session = None
+        self._stats = {
+            "requests": 0,
+            "in_flight": 0,
+            "failed": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "queued_for_connection": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    def _trace_config(self):
+        stats = self._stats
+
+        def counter(name, delta=1):
+            async def handler(session, context, params):
+                stats[name] += delta
+            return handler
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(counter("requests"))
+        trace_config.on_request_start.append(counter("in_flight"))
+        trace_config.on_request_end.append(counter("in_flight", -1))
+        trace_config.on_request_exception.append(counter("in_flight", -1))
+        trace_config.on_request_exception.append(counter("failed"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_connection_queued_start.append(counter("queued_for_connection"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(counter("dns_cache_misses"))
+        return trace_config
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout,
+                                         use_dns_cache=True, ttl_dns_cache=self.dns_cache_ttl)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                             trace_configs=[self._trace_config()])
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    def stats(self):
+        """Накопленные счетчики использования пула соединений"""
+        return dict(self._stats, limit=self.limit, limit_per_host=self.limit_per_host)
+
+
+@asynccontextmanager
+async def use_session(session=None):
+    """Возвращает переданную общую сессию или, если ее нет, создает временную на время вызова"""
+    if session is not None:
+        yield session
+    else:
+        async with aiohttp.ClientSession() as own_session:
+            yield own_session
@@ -1,11 +1,15 @@
 
+import atexit
+import queue
+import threading
 import structlog
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 import json
 import os
 from datetime import datetime, timedelta
 import time
+from config import LOG_ROW_EVENTS, LOG_ROW_EVENTS_PER_SECOND
 
 class NonEscapingJsonEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -85,11 +89,69 @@ class ErrorWarningFilter(logging.Filter):
     def filter(self, record):
         return record.levelno in (logging.ERROR, logging.WARNING)
 
+_timestamp_cache = (None, None)
+
 def add_timestamp(logger, method_name, event_dict):
-    event_dict['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S %z", time.localtime())
+    # Время берется из записи logging (момент вызова логгера), а не из момента форматирования в фоновом потоке;
+    # строка времени форматируется один раз на секунду
+    global _timestamp_cache
+    record = event_dict.get('_record')
+    second = int(record.created if record is not None else time.time())
+    if _timestamp_cache[0] != second:
+        _timestamp_cache = (second, time.strftime("%Y-%m-%d %H:%M:%S %z", time.localtime(second)))
+    event_dict['timestamp'] = _timestamp_cache[1]
     return event_dict
 
-def configure_logging(log_directory='logs', log_level=logging.INFO):
+class RowEventSampler:
+    """Ограничивает построчные события: каждое событие из events попадает в лог не чаще per_second раз в секунду.
+    События различаются по имени события structlog (первый аргумент вызова логгера, например "price_updated"),
+    а не по тексту message. Число отброшенных событий записывается в поле suppressed следующего записанного
+    события с тем же именем"""
+
+    def __init__(self, events=LOG_ROW_EVENTS, per_second=LOG_ROW_EVENTS_PER_SECOND):
+        self.events = frozenset(events)
+        self.per_second = per_second
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, logger, method_name, event_dict):
+        event = event_dict.get('event')
+        if not self.per_second or not isinstance(event, str) or event not in self.events:
+            return event_dict
+        now = int(time.monotonic())
+        with self._lock:
+            window, count, suppressed = self._windows.get(event, (now, 0, 0))
+            if window != now:
+                window, count = now, 0
+            if count >= self.per_second:
+                self._windows[event] = (window, count, suppressed + 1)
+                raise structlog.DropEvent
+            self._windows[event] = (window, count + 1, 0)
+        if suppressed:
+            event_dict['suppressed'] = suppressed
+        return event_dict
+
+class _EventQueueHandler(QueueHandler):
+    """Передает запись в очередь без форматирования: словарь события structlog
+    форматируется обработчиками QueueListener в фоновом потоке"""
+
+    def prepare(self, record):
+        return record
+
+_listener = None
+
+def stop_logging():
+    """Дописывает события из очереди и останавливает фоновый поток логирования"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def configure_logging(log_directory='logs', log_level=logging.INFO, row_events=LOG_ROW_EVENTS,
+                      row_events_per_second=LOG_ROW_EVENTS_PER_SECOND):
+    """Настраивает structlog: в вызывающем потоке выполняются только фильтрация уровня, ограничение
+    построчных событий и сбор полей, а время, цвета, JSON и запись на диск - в потоке QueueListener"""
+    global _listener
     os.makedirs(log_directory, exist_ok=True)
     log_file_path = os.path.join(log_directory, 'app.log')
 
@@ -112,16 +174,13 @@ def configure_logging(log_directory='logs', log_level=logging.INFO):
     structlog.configure(
         processors=[
             structlog.stdlib.filter_by_level,
+            RowEventSampler(row_events, row_events_per_second),
             structlog.stdlib.add_logger_name,
             structlog.stdlib.add_log_level,
             structlog.stdlib.PositionalArgumentsFormatter(),
-            add_timestamp,
+            # Исключение и стек нужно получить в потоке, где оно возникло
             structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            reorder_event_dict,
-            add_color_and_importance,
-            remove_empty_values,
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
         context_class=dict,
@@ -130,16 +189,33 @@ def configure_logging(log_directory='logs', log_level=logging.INFO):
         cache_logger_on_first_use=True,
     )
 
+    # Обработка в фоновом потоке
+    render_chain = [
+        add_timestamp,
+        structlog.processors.UnicodeDecoder(),
+        reorder_event_dict,
+        add_color_and_importance,
+        remove_empty_values,
+        structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+    ]
+    foreign_pre_chain = [structlog.stdlib.add_logger_name, structlog.stdlib.add_log_level]
+
     file_processor = structlog.processors.JSONRenderer(serializer=json_serializer)
-    file_formatter = structlog.stdlib.ProcessorFormatter(processor=file_processor)
+    file_formatter = structlog.stdlib.ProcessorFormatter(processors=render_chain + [file_processor],
+                                                         foreign_pre_chain=foreign_pre_chain)
     file_handler.setFormatter(file_formatter)
 
     console_processor = structlog.dev.ConsoleRenderer(colors=True)
-    console_formatter = structlog.stdlib.ProcessorFormatter(processor=console_processor)
+    console_formatter = structlog.stdlib.ProcessorFormatter(processors=render_chain + [console_processor],
+                                                            foreign_pre_chain=foreign_pre_chain)
     console_handler.setFormatter(console_formatter)
 
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(_EventQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
 
     cleanup_old_logs(log_directory)
 
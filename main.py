@@ -1,182 +1,281 @@
 import asyncio
 import logging
+import time
+from datetime import datetime
+from collections import namedtuple
+from functools import partial
 import sqlite3
 import pandas as pd
-from data_fetcher import get_sheet_data, save_to_database
+from data_fetcher import get_sheet_data, get_sheets_data_batch, save_to_database
 from data_updater import update_price
-from data_writer import write_sheet_data
+from data_writer import write_sheet_data, SheetWriteBuffer
 from config import (
-    SAMPLE_SPREADSHEET_ID, UPDATE_INTERVAL_MINUTES,
+    SAMPLE_SPREADSHEET_ID,
     SQLITE_DB_NAME
 )
-from Ozon.update_ozon import update_prices_ozon
-from WB.update_wb import update_prices_wb
-from YM.update_ym import update_price_ym
-from MM.update_mm import update_prices_mm
+from registry import load_registry, push_prices
 from logger import logger
-from config import (Tech_PC_Components_OZON, Client_Id_Tech_PC_Components_OZON, Smart_Shop_OZON,
-                    Client_Id_Smart_Shop_OZON, ByMarket_OZON, Client_Id_ByMarket_OZON, Tech_PC_Components_YM,
-                    B_id_Tech_PC_Components_YM, SSmart_shop_YM, B_id_SSmart_shop_YM, ByMarket_YM, B_id_ByMarket_YM,
-                    Tech_PC_Components_WB, ByMarket_WB, Smart_shop_WB)
+from auth import start_token_refresher
+from db import get_database, close_databases
+from http_session import HttpSessionManager
+from fingerprints import FingerprintStore, frame_fingerprint
+from snapshot_cache import SnapshotCache, merge_updated_rows
+from scheduler import Scheduler, ScheduledJob
+from metrics import metrics, summarize, save_cycle_summary, start_metrics_server
+from change_digest import ChangeDigest
+from change_log import start_change_log_retention
+from snapshot_store import open_snapshot_store
+import sheets_api
 
 DEBUG = True
 
+# Конвейер магазина реестра для планировщика: run(sheet_data=, write_buffer=, cycle_timestamp=) -> True при успехе
+ShopPipeline = namedtuple("ShopPipeline", ["shop", "run"])
+# Общие данные волны заданий: пакетная выборка диапазонов, метка времени цикла, начало волны и счетчики метрик до нее
+ShopWave = namedtuple("ShopWave", ["sheet_data", "cycle_timestamp", "started", "totals_before"])
+_marketplace_semaphores = {}
+
 
 async def delete_table(db_name, table_name):
     try:
-        conn = sqlite3.connect(db_name)
-        c = conn.cursor()
-        c.execute(f"DROP TABLE IF EXISTS '{table_name}'")
-        conn.commit()
+        await get_database(db_name).write(lambda conn: conn.execute(f"DROP TABLE IF EXISTS '{table_name}'"))
         logger.info(f"Таблица {table_name} успешно удалена из базы данных {db_name}", db_name=db_name, table_name=table_name)
     except sqlite3.Error as e:
         logger.error(f"Ошибка при удалении таблицы {table_name} из базы данных {db_name}", db_name=db_name, table_name=table_name, error=str(e))
-    finally:
-        conn.close()
 
-async def update_loop():
-    while True:
-        try:
-            logger.info("Начало цикла обновления данных для всех маркетплейсов")
-            await asyncio.gather(
-                update_data_ozon(),
-                update_data_wb(),
-                update_data_ym(),
-                # update_data_mm() # Раскомментируйте для обновления данных Megamarket
-            )
-            logger.info("Цикл обновления данных для всех маркетплейсов успешно завершен")
-        except Exception as e:
-            logger.warning("Критическая ошибка в цикле обновления данных", error=str(e))
-        logger.warning(f"Ожидание {UPDATE_INTERVAL_MINUTES} минут до следующего обновления")
-        await asyncio.sleep(UPDATE_INTERVAL_MINUTES * 60)
-
-async def update_data_ozon():
-    ozon_logger = logger.bind(marketplace="Ozon")
+async def get_range_data(sheet_data, sheet_range):
+    """Возвращает DataFrame диапазона из пакетной выборки, при её отсутствии запрашивает диапазон отдельно"""
+    if sheet_data is not None and sheet_range in sheet_data:
+        return sheet_data[sheet_range]
+    return await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
+
+async def write_range_data(write_buffer, df, sheet_range, original_df=None):
+    """Ставит DataFrame в буфер пакетной записи, без буфера записывает диапазон сразу"""
+    if write_buffer is not None:
+        write_buffer.add(df, sheet_range, original_df=original_df)
+    else:
+        await write_sheet_data(df, SAMPLE_SPREADSHEET_ID, sheet_range)
+
+def _marketplace_semaphore(marketplace):
+    """Общий для всех волн семафор, ограничивающий число одновременно обрабатываемых магазинов маркетплейса"""
+    semaphore = _marketplace_semaphores.get(marketplace.key)
+    if semaphore is None:
+        semaphore = _marketplace_semaphores[marketplace.key] = asyncio.Semaphore(marketplace.shop_concurrency)
+    return semaphore
+
+async def read_shop_wave(jobs, fingerprints):
+    """Общее чтение волны: диапазоны магазинов, срок которых наступил одновременно, забираются одним batchGet"""
+    wave_started = time.perf_counter()
+    totals_before = metrics.totals()
+    cycle_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    await fingerprints.load()
+    with metrics.timer("stage_seconds", stage="sheets_fetch"):
+        sheet_data = await get_sheets_data_batch(SAMPLE_SPREADSHEET_ID, [job.payload.shop.sheet_range for job in jobs])
+    logger.info("Получены данные диапазонов из Google Sheets", ranges=len(sheet_data),
+                fetch_seconds=round(time.perf_counter() - wave_started, 3))
+    return ShopWave(sheet_data, cycle_timestamp, wave_started, totals_before)
+
+async def run_shop_job(job, wave, fingerprints, snapshots):
+    """Конвейер одного магазина волны со своей записью в Google Sheets: запись результатов магазина
+    не ждет остальные магазины волны. Возвращает True при успехе"""
+    pipeline = job.payload
+    write_ranges = {pipeline.shop.write_range}
+    write_buffer = SheetWriteBuffer(SAMPLE_SPREADSHEET_ID)
     try:
-        ozon_logger.warning("Начало обновления данных Ozon")
-        # Определяем итерируемый объект с дополнительными данными
-        ozon_ranges = [
-            ('ByMarket', 'OzonByMarket!A1:K', Client_Id_ByMarket_OZON,ByMarket_OZON),
-            ('Smart Shop', 'OzonSmartShop!A1:K', Client_Id_Smart_Shop_OZON, Smart_Shop_OZON),
-            ('Tech PC Components', 'OzonTechPCComponents!A1:K', Client_Id_Tech_PC_Components_OZON, Tech_PC_Components_OZON)
-        ]
-        for range_name, sheet_range, client_id, api_key in ozon_ranges:
-            ozon_logger.info(f"Обработка диапазона {range_name}")
-            df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
-            ozon_logger.info(f"Получены данные из Google Sheets для диапазона {range_name}")
-            await save_to_database(df, SQLITE_DB_NAME, f'product_data_ozon_{range_name}', primary_key_cols=['product_id'])
-            ozon_logger.info(f"Данные сохранены в базу данных для диапазона {range_name}")
-            updated_df, price_changed_df = await update_price(df, product_id_col='product_id',
-                                                              old_disc_in_base_col='price_old',
-                                                              old_disc_manual_col='old_price')
-            ozon_logger.info(f"Обновление цен выполнено для диапазона {range_name}")
-            await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
-            ozon_logger.info(f"Обновленные данные записаны в Google Sheets для диапазона {range_name}")
-            await save_to_database(updated_df, SQLITE_DB_NAME, f'product_data_ozon_{range_name}',
-                                   primary_key_cols=['product_id'])
-
-            if not price_changed_df.empty:
-                print(price_changed_df.head())
-                ozon_logger.warning(f"Начало обновления цен через API Ozon для диапазона {range_name}", importance="high")
-                await update_prices_ozon(price_changed_df,"t_price", 'price_old',
-                                         "old_price", "product_id", 'offer_id',
-                                         "min_price" , client_id,api_key,debug=DEBUG)
-                ozon_logger.warning(f"Завершено обновление цен через API Ozon для диапазона {range_name}")
-            ozon_logger.info(f"Обработка диапазона {range_name} завершена", rows_updated=len(price_changed_df))
-        ozon_logger.info("Обновление данных Ozon успешно завершено")
-    except Exception as e:
-        ozon_logger.error("Критическая ошибка при обновлении данных Ozon", error=str(e))
+        async with _marketplace_semaphore(pipeline.shop.marketplace):
+            with metrics.timer("shop_seconds", marketplace=pipeline.shop.marketplace.name, shop=pipeline.shop.name):
+                ok = await pipeline.run(sheet_data=wave.sheet_data, write_buffer=write_buffer,
+                                        cycle_timestamp=wave.cycle_timestamp)
+        with metrics.timer("stage_seconds", stage="sheets_write"):
+            write_result = await write_buffer.flush()
+        metrics.inc("sheets_write_failures_total", len(write_result["failed_ranges"]))
+        await fingerprints.commit(write_result["failed_ranges"], write_ranges)
+        snapshots.commit(write_result["failed_ranges"], write_ranges)
+    except Exception:
+        fingerprints.discard(write_ranges)
+        snapshots.discard(write_ranges)
+        raise
+    metrics.set_gauge("sqlite_write_queue", get_database(SQLITE_DB_NAME).queue_size())
+    metrics.set_gauge("sheets_request_queue", sheets_api.queue_size())
+    if job.last_lag is not None:
+        metrics.observe("scheduler_start_lag_seconds", max(job.last_lag, 0), job=job.name)
+    return ok
 
-async def update_data_wb():
-    wb_logger = logger.bind(marketplace="Wildberries")
+async def finish_shop_wave(wave, jobs, results, http):
+    """Итоги волны после завершения всех ее магазинов: лог, метрики и строка сводки в cycle_metrics"""
+    failed = [job.name for job, ok in zip(jobs, results) if not ok]
+    wave_seconds = time.perf_counter() - wave.started
+    metrics.observe("wave_seconds", wave_seconds)
+    for job in jobs:
+        metrics.set_gauge("scheduler_missed_deadlines", job.missed, job=job.name)
+    log = logger.error if failed else logger.info
+    log("Волна обновления магазинов завершена", shops=len(jobs), failed_shops=failed or None,
+        wave_seconds=round(wave_seconds, 3),
+        start_lag={job.name: job.last_lag for job in jobs},
+        missed_deadlines={job.name: job.missed for job in jobs if job.missed} or None)
+    logger.info("Использование пула HTTP-соединений", **http.stats())
     try:
-        wb_logger.warning("Начало обновления данных Wildberries")
-        wb_ranges = [
-            ('Tech PC Components', 'WB_TechPCComponents!A1:I', Tech_PC_Components_WB),
-            ('ByMarket', 'WB_ByMarket!A1:I',ByMarket_WB ),
-            ('Smart Shop', 'WB_SmartShop!A1:I', Smart_shop_WB )
-        ]
-        for range_name, sheet_range, api_key in wb_ranges:
-            wb_logger.info(f"Обработка диапазона {range_name}")
-            df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
-            wb_logger.info(f"Получены данные из Google Sheets для диапазона {range_name}")
-            await save_to_database(df, SQLITE_DB_NAME, f'product_data_wb_{range_name}', primary_key_cols=['nmID'])
-            wb_logger.info(f"Данные сохранены в базу данных для диапазона {range_name}")
-            updated_df, price_changed_df = await update_price(df, product_id_col='nmID',
-                                                              old_disc_in_base_col='disc_old',
-                                                              old_disc_manual_col='discount')
-            wb_logger.info(f"Обновление цен выполнено для диапазона {range_name}")
-            await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
-            wb_logger.info(f"Обновленные данные записаны в Google Sheets для диапазона {range_name}")
-            if not price_changed_df.empty:
-                print(price_changed_df.head())
-                wb_logger.warning(f"Начало обновления цен через API Wildberries для диапазона {range_name}", importance="high")
-                await update_prices_wb(price_changed_df, "nmID", "t_price",
-                                       "discount", 'disc_old', api_key, debug=DEBUG)
-                wb_logger.warning(f"Завершено обновление цен через API Wildberries для диапазона {range_name}")
-            wb_logger.info(f"Обработка диапазона {range_name} завершена", rows_updated=len(price_changed_df))
-        wb_logger.info("Обновление данных Wildberries успешно завершено")
-    except Exception as e:
-        wb_logger.error("Критическая ошибка при обновлении данных Wildberries", error=str(e))
+        await save_cycle_summary(SQLITE_DB_NAME, wave.cycle_timestamp, summarize(wave.totals_before, metrics.totals()),
+                                 len(jobs), len(failed), wave_seconds)
+    except sqlite3.Error as e:
+        logger.error("Не удалось сохранить сводку метрик цикла", error=str(e))
 
-async def update_data_ym():
-    ym_logger = logger.bind(marketplace="YandexMarket")
+async def run_shop_wave(jobs, fingerprints, snapshots, http):
+    """Волна без планировщика (например, в бенчмарке): общее чтение, параллельные конвейеры магазинов
+    со своей записью в Google Sheets и итоги волны"""
+    wave = await read_shop_wave(jobs, fingerprints)
+    results = await asyncio.gather(*(run_shop_job(job, wave, fingerprints, snapshots) for job in jobs))
+    await finish_shop_wave(wave, jobs, results, http)
+
+def shop_jobs(session=None, fingerprints=None, snapshots=None, shops=None, snapshot_store=None):
+    """Задания планировщика для магазинов реестра (по умолчанию - всех включенных из config.SHOPS)"""
+    jobs = []
+    for shop in load_registry() if shops is None else shops:
+        marketplace = shop.marketplace
+        run = partial(process_shop, logger.bind(marketplace=marketplace.name), marketplace.name, shop.name,
+                      shop.sheet_range, shop.write_range, shop.table_name, marketplace.key_col,
+                      partial(push_prices, shop, session=session, debug=DEBUG),
+                      save_updated=marketplace.save_updated, fingerprints=fingerprints, snapshots=snapshots,
+                      snapshot_store=snapshot_store, **marketplace.price_columns)
+        jobs.append(ScheduledJob(shop.job_name, shop.interval_minutes * 60, ShopPipeline(shop, run),
+                                 priority=shop.priority, offset_seconds=shop.offset_seconds))
+    return jobs
+
+async def update_loop():
+    """Запускает конвейеры магазинов по расписанию: у каждого магазина свой выровненный интервал"""
+    fingerprints = FingerprintStore()
+    snapshot_store = open_snapshot_store()
+    snapshots = SnapshotCache(store=snapshot_store)
+    metrics_server = await start_metrics_server()
+    retention = start_change_log_retention()
     try:
-        ym_logger.warning("Начало обновления данных Yandex Market")
-        ym_ranges = [
-            ('Tech PC Components', 'YM_TechPCComponents!A1:I', Tech_PC_Components_YM, B_id_Tech_PC_Components_YM),
-            ('ByMarket', 'YM_ByMarket!A1:I',  ByMarket_YM, B_id_ByMarket_YM),
-            ('Smart Shop', 'YM_SmartShop!A1:I',SSmart_shop_YM, B_id_SSmart_shop_YM )
-        ]
-        for range_name, sheet_range, api_key, business_id in ym_ranges:
-            ym_logger.info(f"Обработка диапазона {range_name}")
-            df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
-            ym_logger.info(f"Получены данные из Google Sheets для диапазона {range_name}")
-            await save_to_database(df, SQLITE_DB_NAME, f'product_data_ym_{range_name}', primary_key_cols=['offer_id'])
-            ym_logger.info(f"Данные сохранены в базу данных для диапазона {range_name}")
-            updated_df, price_changed_df = await update_price(df, product_id_col='offer_id',
-                                                              old_disc_in_base_col='price_old',
-                                                              old_disc_manual_col='discount_base')
-            ym_logger.info(f"Обновление цен выполнено для диапазона {range_name}")
-            await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
-            ym_logger.info(f"Обновленные данные записаны в Google Sheets для диапазона {range_name}")
-            if not price_changed_df.empty:
-                print(price_changed_df.head())
-                ym_logger.warning(f"Начало обновления цен через API Yandex Market для диапазона {range_name}", importance="high")
-                await update_price_ym(price_changed_df, api_key, business_id,"offer_id", "price_old",
-                                      "t_price", "discount_base", debug=DEBUG)
-                ym_logger.warning(f"Завершено обновление цен через API Yandex Market для диапазона {range_name}")
-            ym_logger.info(f"Обработка диапазона {range_name} завершена", rows_updated=len(price_changed_df))
-        ym_logger.info("Обновление данных Yandex Market успешно завершено")
-    except Exception as e:
-        ym_logger.error("Критическая ошибка при обновлении данных Yandex Market", error=str(e))
+        async with HttpSessionManager() as http:
+            scheduler = Scheduler(partial(run_shop_job, fingerprints=fingerprints, snapshots=snapshots),
+                                  read_wave=partial(read_shop_wave, fingerprints=fingerprints),
+                                  finish_wave=partial(finish_shop_wave, http=http))
+            for job in shop_jobs(http.session, fingerprints, snapshots, snapshot_store=snapshot_store):
+                scheduler.add_job(job)
+            await scheduler.run_forever()
+    finally:
+        retention.cancel()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
 
-async def update_data_mm():
-    mm_logger = logger.bind(marketplace="Megamarket")
+async def save_snapshot(snapshot_store, table_name, df, key_col, cycle_timestamp, delta, shop_logger):
+    """Сохраняет состояние листа в хранилище снимков. Ошибка записи логируется и не прерывает конвейер магазина"""
+    hashes = delta.snapshot.hashes if delta is not None and delta.snapshot is not None else None
     try:
-        mm_logger.info("Начало обновления данных Megamarket")
-        for range_name, sheet_range in [('MM1', 'MM!A1:H'), ('MM2', 'MM!K1:R'), ('MM3', 'MM!U1:AB')]:
-            mm_logger.info(f"Обработка диапазона {range_name}")
-            df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
-            mm_logger.info(f"Получены данные из Google Sheets для диапазона {range_name}")
-            await save_to_database(df, SQLITE_DB_NAME, f'product_data_mm_{range_name}', primary_key_cols=['offerId'])
-            mm_logger.info(f"Данные сохранены в базу данных для диапазона {range_name}")
-            updated_df, price_changed_df = await update_price(df, product_id_col='offerId')
-            mm_logger.info(f"Обновление цен выполнено для диапазона {range_name}")
-            await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
-            mm_logger.info(f"Обновленные данные записаны в Google Sheets для диапазона {range_name}")
-            if not price_changed_df.empty:
-                mm_logger.info(f"Начало обновления цен через API Megamarket для диапазона {range_name}", importance="high")
-                await update_prices_mm(price_changed_df, 'token', "offerId", "t_price", "isDeleted", debug=DEBUG)
-                mm_logger.info(f"Завершено обновление цен через API Megamarket для диапазона {range_name}")
-            mm_logger.info(f"Обработка диапазона {range_name} завершена", rows_updated=len(price_changed_df))
-        mm_logger.info("Обновление данных Megamarket успешно завершено")
+        entry = await snapshot_store.save(table_name, df, key_col, cycle_timestamp, hashes=hashes)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        shop_logger.error("Не удалось сохранить снимок листа", table=table_name, error=str(e))
+        return
+    if entry is not None:
+        shop_logger.info("Снимок листа сохранен", kind=entry.kind, rows=entry.rows, changed=entry.changed,
+                         bytes=entry.bytes)
+
+async def process_shop(mp_logger, api_name, range_name, sheet_range, write_range, table_name, primary_key_col,
+                       push_prices, sheet_data=None, write_buffer=None, cycle_timestamp=None, save_updated=False,
+                       fingerprints=None, snapshots=None, snapshot_store=None, **price_columns):
+    """Конвейер одного магазина: чтение диапазона -> сохранение в БД -> расчет цен -> запись в таблицу -> отправка цен.
+    Результаты пишутся в диапазон write_range (Shop.write_range из реестра).
+    push_prices(price_changed_df) отправляет измененные цены в API маркетплейса.
+    Если передано хранилище fingerprints и содержимое диапазона не изменилось с прошлой обработки, конвейер пропускается.
+    С кешем снимков snapshots в БД и в расчет цен передаются только новые и измененные с прошлого цикла строки.
+    С хранилищем snapshot_store состояние листа пишется в него (один раз за цикл), а не в таблицу table_name.
+    Итоги цикла (решения по ценам, крупнейшие изменения, неотправленные товары) пишутся одной сводкой ChangeDigest.
+    Ошибка магазина логируется и не прерывает обработку остальных магазинов. Возвращает True при успехе"""
+    shop_logger = mp_logger.bind(shop=range_name)
+    labels = {"marketplace": api_name, "shop": range_name}
+    digest = ChangeDigest(api_name, range_name, cycle_timestamp)
+    try:
+        shop_logger.info(f"Обработка диапазона {range_name}")
+        df = await get_range_data(sheet_data, sheet_range)
+        shop_logger.info(f"Получены данные из Google Sheets для диапазона {range_name}")
+        fingerprint = frame_fingerprint(df) if fingerprints is not None else None
+        if fingerprint is not None and fingerprints.is_unchanged(api_name, range_name, fingerprint):
+            shop_logger.info(f"Данные диапазона {range_name} не изменились, обработка пропущена")
+            metrics.inc("ranges_skipped_total", **labels)
+            return True
+        delta = await snapshots.diff(table_name, df, primary_key_col) if snapshots is not None else None
+        if delta is None or delta.full:
+            with metrics.timer("stage_seconds", stage="db_sync", **labels):
+                if snapshot_store is not None:
+                    await save_snapshot(snapshot_store, table_name, df, primary_key_col, cycle_timestamp, delta,
+                                        shop_logger)
+                else:
+                    await save_to_database(df, SQLITE_DB_NAME, table_name, primary_key_cols=[primary_key_col])
+            shop_logger.info(f"Данные сохранены в базу данных для диапазона {range_name}")
+            metrics.inc("rows_processed_total", max(len(df) - 1, 0), **labels)
+            with metrics.timer("stage_seconds", stage="update_price", **labels):
+                updated_df, price_changed_df = await update_price(df, product_id_col=primary_key_col,
+                                                                  cycle_timestamp=cycle_timestamp, digest=digest,
+                                                                  **price_columns)
+            updated_rows = updated_df
+        else:
+            shop_logger.info(f"Изменения диапазона {range_name} с прошлого цикла", inserted=delta.inserted,
+                             changed=delta.changed, removed=len(delta.removed_keys))
+            changed_df = df.loc[delta.changed_labels]
+            if len(changed_df) or delta.removed_keys:
+                with metrics.timer("stage_seconds", stage="db_sync", **labels):
+                    if snapshot_store is not None:
+                        await save_snapshot(snapshot_store, table_name, df, primary_key_col, cycle_timestamp, delta,
+                                            shop_logger)
+                    else:
+                        await save_to_database(changed_df, SQLITE_DB_NAME, table_name,
+                                               primary_key_cols=[primary_key_col], removed_keys=delta.removed_keys)
+                shop_logger.info(f"Изменения сохранены в базу данных для диапазона {range_name}")
+            # Первая строка диапазона - заголовки, update_price ее пропускает
+            changed_df = changed_df.drop(df.index[:1], errors='ignore')
+            updated_rows, price_changed_df = None, pd.DataFrame()
+            metrics.inc("rows_processed_total", len(changed_df), **labels)
+            if len(changed_df):
+                with metrics.timer("stage_seconds", stage="update_price", **labels):
+                    updated_rows, price_changed_df = await update_price(pd.concat([df.iloc[:1], changed_df]),
+                                                                        product_id_col=primary_key_col,
+                                                                        cycle_timestamp=cycle_timestamp,
+                                                                        digest=digest, **price_columns)
+            updated_df = merge_updated_rows(df, updated_rows) if price_changed_df is not None else None
+        if updated_df is None:
+            shop_logger.error(f"Не удалось выполнить обновление цен для диапазона {range_name}")
+            metrics.inc("shop_failures_total", **labels)
+            return False
+        shop_logger.info(f"Обновление цен выполнено для диапазона {range_name}")
+        await write_range_data(write_buffer, updated_df, write_range, original_df=df)
+        shop_logger.info(f"Обновленные данные переданы на запись в Google Sheets для диапазона {range_name}")
+        if save_updated and updated_rows is not None and snapshot_store is None:
+            with metrics.timer("stage_seconds", stage="db_sync", **labels):
+                await save_to_database(updated_rows, SQLITE_DB_NAME, table_name, primary_key_cols=[primary_key_col],
+                                       removed_keys=None if delta is None or delta.full else [])
+
+        if not price_changed_df.empty:
+            shop_logger.warning(f"Начало обновления цен через API {api_name} для диапазона {range_name}", importance="high")
+            with metrics.timer("stage_seconds", stage="marketplace_push", **labels):
+                digest.add_push_results(await push_prices(price_changed_df))
+            metrics.inc("prices_pushed_total", len(price_changed_df), **labels)
+            shop_logger.warning(f"Завершено обновление цен через API {api_name} для диапазона {range_name}")
+        if fingerprint is not None:
+            fingerprints.stage(api_name, range_name, fingerprint, write_range)
+        if delta is not None:
+            snapshots.stage(table_name, delta.snapshot, write_range)
+        digest.log(shop_logger)
+        try:
+            await digest.save(SQLITE_DB_NAME)
+        except sqlite3.Error as e:
+            shop_logger.error("Не удалось сохранить сводку изменений магазина", error=str(e))
+        shop_logger.info(f"Обработка диапазона {range_name} завершена", rows_updated=len(price_changed_df))
+        return True
     except Exception as e:
-        mm_logger.error("Критическая ошибка при обновлении данных Megamarket", error=str(e))
+        shop_logger.error(f"Ошибка при обработке диапазона {range_name}", error=str(e))
+        metrics.inc("shop_failures_total", **labels)
+        return False
 
 async def main():
     logger.info("Запуск основного цикла обновления данных для всех маркетплейсов")
-    await update_loop()
+    start_token_refresher()
+    try:
+        await update_loop()
+    finally:
+        close_databases()
 
 if __name__ == "__main__":
     asyncio.run(main())
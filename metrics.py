@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from aiohttp import web
+from config import METRICS_PREFIX, METRICS_HISTOGRAM_BUCKETS, METRICS_HOST, METRICS_PORT
+from db import get_database
+from logger import logger
+
+CYCLE_METRICS_TABLE = 'cycle_metrics'
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """Счетчики, гистограммы и текущие значения с метками в памяти процесса.
+    Потокобезопасен: метрики пишутся и из цикла событий, и из потоков SQLite/Sheets"""
+
+    def __init__(self, prefix=METRICS_PREFIX, buckets=METRICS_HISTOGRAM_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Измеряет длительность блока в секундах и добавляет ее в гистограмму name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def totals(self):
+        """Плоский снимок: {(имя, метки): значение} для счетчиков и {(имя_sum|имя_count, метки): значение} для гистограмм"""
+        with self._lock:
+            result = dict(self._counters)
+            for (name, labels), histogram in self._histograms.items():
+                result[(name + "_sum", labels)] = histogram["sum"]
+                result[(name + "_count", labels)] = histogram["count"]
+            return result
+
+    def render(self):
+        """Текст в формате экспозиции Prometheus"""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {self.prefix}{name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{self.prefix}{name}{_format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {self.prefix}{name} histogram")
+                for (series_name, labels), histogram in sorted(self._histograms.items()):
+                    if series_name != name:
+                        continue
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels, [('le', str(bound))])} {count}")
+                    lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def summarize(before, after):
+    """Разница двух снимков totals(): значения за цикл, сгруппированные по имени метрики и меткам"""
+    summary = {}
+    for (name, labels), value in after.items():
+        delta = value - before.get((name, labels), 0)
+        if delta:
+            label_text = ",".join(f"{label}={label_value}" for label, label_value in labels)
+            summary.setdefault(name, {})[label_text] = round(delta, 6)
+    return summary
+
+
+def _total(summary, name):
+    return sum(summary.get(name, {}).values())
+
+
+async def save_cycle_summary(db_name, cycle_timestamp, summary, jobs, failed_jobs, wave_seconds):
+    """Записывает строку сводки цикла в таблицу cycle_metrics"""
+    row = (cycle_timestamp, jobs, failed_jobs, round(wave_seconds, 3),
+           round(_total(summary, "stage_seconds_sum"), 3),
+           int(_total(summary, "rows_processed_total")),
+           int(_total(summary, "prices_pushed_total")),
+           int(_total(summary, "http_responses_total")),
+           int(_total(summary, "http_retries_total")),
+           json.dumps(summary, ensure_ascii=False))
+
+    def job(conn):
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {CYCLE_METRICS_TABLE} (
+            timestamp TEXT, jobs INTEGER, failed_jobs INTEGER, wave_seconds REAL, stage_seconds REAL,
+            rows_processed INTEGER, prices_pushed INTEGER, http_responses INTEGER, http_retries INTEGER, details TEXT)""")
+        conn.execute(f"INSERT INTO {CYCLE_METRICS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    await get_database(db_name).write(job)
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускает HTTP-сервер с метриками на /metrics. Возвращает AppRunner или None, если порт не задан"""
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Запущен сервер метрик", url=f"http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import json
+import random
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import aiohttp
+from config import (RATE_LIMITS, RATE_LIMIT_DECREASE_FACTOR, RATE_LIMIT_RECOVERY_STEP, RATE_LIMIT_MIN_SHARE,
+                    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX)
+from logger import logger
+from metrics import metrics
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Ошибки установки соединения: запрос еще не отправлен, поэтому его можно повторить в любом случае
+NOT_SENT_ERRORS = (aiohttp.ClientConnectorError,
+                   getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ClientConnectorError))  # aiohttp 3.10+
+
+
+class HttpResult(namedtuple("HttpResult", ["status", "headers", "text"])):
+    """Прочитанный ответ HTTP-запроса"""
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AdaptiveRateLimiter:
+    """Ограничитель частоты запросов по алгоритму token bucket.
+
+    Скорость rate (запросов в секунду) и запас burst задаются по опубликованным лимитам API.
+    При ответах 429 скорость уменьшается в RATE_LIMIT_DECREASE_FACTOR раз (но не ниже
+    RATE_LIMIT_MIN_SHARE от исходной), а при успешных ответах постепенно восстанавливается.
+    Retry-After приостанавливает выдачу токенов до указанного момента."""
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.marketplace = name.partition(":")[0]
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = rate * RATE_LIMIT_MIN_SHARE
+        self.burst = burst
+        self._tokens = burst
+        self._updated = None
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ждет, пока можно будет отправить очередной запрос.
+        Время ожидания вычисляется под блокировкой, а само ожидание идет без нее"""
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._lock:
+                now = loop.time()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_LIMIT_RECOVERY_STEP)
+            metrics.set_gauge("rate_limit_rps", self.rate, limiter=self.name)
+
+    def on_throttle(self, retry_after=None):
+        """Уменьшает скорость после ответа 429 и при наличии Retry-After приостанавливает запросы"""
+        now = asyncio.get_running_loop().time()
+        self._refill(now)
+        self._tokens = 0
+        self.rate = max(self.min_rate, self.rate * RATE_LIMIT_DECREASE_FACTOR)
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        metrics.set_gauge("rate_limit_rps", self.rate, limiter=self.name)
+        metrics.inc("rate_limit_throttled_total", marketplace=self.marketplace)
+        logger.warning("Превышен лимит запросов, скорость снижена", limiter=self.name,
+                       rate=round(self.rate, 3), retry_after=retry_after)
+
+
+_limiters = {}
+
+
+def get_rate_limiter(marketplace, api_key, limits=None):
+    """Возвращает общий ограничитель для пары (маркетплейс, API-ключ).
+    limits - {"rate", "burst"} из реестра магазинов, по умолчанию RATE_LIMITS[marketplace].
+    Лимиты API действуют на ключ, поэтому ограничитель один на ключ: если для того же ключа
+    переданы другие limits, остается созданный ранее ограничитель, а расхождение попадает в лог"""
+    key_hash = hashlib.sha256(str(api_key).encode()).hexdigest()[:12]
+    limits = limits or RATE_LIMITS[marketplace]
+    limiter = _limiters.get((marketplace, key_hash))
+    if limiter is None:
+        limiter = AdaptiveRateLimiter(f"{marketplace}:{key_hash}", limits["rate"], limits["burst"])
+        _limiters[(marketplace, key_hash)] = limiter
+    elif (limiter.max_rate, limiter.burst) != (limits["rate"], limits["burst"]):
+        logger.warning("Для API-ключа уже создан ограничитель с другими лимитами, используются прежние лимиты",
+                       limiter=limiter.name, rate=limiter.max_rate, burst=limiter.burst,
+                       requested_rate=limits["rate"], requested_burst=limits["burst"])
+    return limiter
+
+
+def parse_retry_after(headers):
+    """Возвращает задержку в секундах из Retry-After (число секунд или HTTP-дата) или X-Ratelimit-Retry"""
+    value = headers.get("Retry-After") or headers.get("X-Ratelimit-Retry")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt):
+    return min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+async def request_with_retry(session, method, url, limiter, max_retries=HTTP_MAX_RETRIES, idempotent=True, **kwargs):
+    """Выполняет HTTP-запрос с учетом ограничителя частоты и возвращает HttpResult.
+
+    Ответы 429 и 5xx, а также ошибки соединения и таймауты повторяются до max_retries раз
+    с экспоненциальной задержкой со случайным разбросом; Retry-After соблюдается.
+    Для неидемпотентных запросов (idempotent=False) повторяются только ответы 429 и ошибки установки
+    соединения (NOT_SENT_ERRORS): после таймаута чтения или 5xx сервер мог уже выполнить запрос.
+    Если повторы исчерпаны, возвращается последний ответ или выбрасывается последнее исключение"""
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        try:
+            with metrics.timer("http_request_seconds", marketplace=limiter.marketplace):
+                async with session.request(method, url, **kwargs) as response:
+                    result = HttpResult(response.status, response.headers, await response.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.inc("http_errors_total", marketplace=limiter.marketplace, error=type(e).__name__)
+            if attempt >= max_retries or not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                raise
+            metrics.inc("http_retries_total", marketplace=limiter.marketplace, reason="connection")
+            delay = _backoff(attempt)
+            logger.warning("Ошибка соединения, повтор запроса", limiter=limiter.name, url=url,
+                           attempt=attempt + 1, delay=round(delay, 2), error=str(e) or type(e).__name__)
+        else:
+            metrics.inc("http_responses_total", marketplace=limiter.marketplace, status=result.status)
+            if result.status not in RETRY_STATUSES:
+                limiter.on_success()
+                return result
+            retry_after = parse_retry_after(result.headers)
+            if result.status == 429:
+                limiter.on_throttle(retry_after)
+            if attempt >= max_retries or not (idempotent or result.status == 429):
+                return result
+            metrics.inc("http_retries_total", marketplace=limiter.marketplace, reason=str(result.status))
+            delay = max(retry_after or 0, _backoff(attempt))
+            logger.warning("Повтор запроса после ответа сервера", limiter=limiter.name, url=url,
+                           status=result.status, attempt=attempt + 1, delay=round(delay, 2))
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,103 @@
+import re
+from collections import namedtuple
+from config import MARKETPLACES, SHOPS, SHEET_HEADER_ROWS
+from Ozon.update_ozon import update_prices_ozon
+from WB.update_wb import update_prices_wb
+from YM.update_ym import update_price_ym
+from MM.update_mm import update_prices_mm
+
+# Клиенты API маркетплейсов, на которые ссылается поле adapter в MARKETPLACES
+ADAPTERS = {
+    'ozon': update_prices_ozon,
+    'wb': update_prices_wb,
+    'ym': update_price_ym,
+    'mm': update_prices_mm,
+}
+
+# Параметры магазина, которые можно переопределить в SHOPS
+SHOP_OVERRIDES = ('client_options', 'rate_limit', 'interval_minutes', 'priority', 'offset_seconds')
+
+# Диапазон в нотации A1 с листом и начальной ячейкой: Лист!A1:K, 'Лист 1'!$B$2:Z100
+_A1_RANGE_RE = re.compile(r"^(?P<sheet>.+)!(?P<start_col>\$?[A-Za-z]+\$?)(?P<start_row>\d+)(?P<end>:\$?[A-Za-z]*\$?\d*)?$")
+
+Marketplace = namedtuple("Marketplace", ["key", "name", "adapter", "table_prefix", "key_col", "price_columns",
+                                         "push_columns", "save_updated", "shop_concurrency", "enabled"])
+
+
+class Shop(namedtuple("Shop", ["marketplace", "name", "sheet_range", "write_range", "credentials", "client_options",
+                               "rate_limit", "interval_minutes", "priority", "offset_seconds"])):
+    """Магазин из реестра со всеми параметрами, включая унаследованные от маркетплейса"""
+
+    @property
+    def table_name(self):
+        return f"{self.marketplace.table_prefix}_{self.name}"
+
+    @property
+    def job_name(self):
+        return f"{self.marketplace.name}/{self.name}"
+
+
+def _parse_range(sheet_range):
+    match = _A1_RANGE_RE.match(sheet_range) if isinstance(sheet_range, str) else None
+    if match is None or match.group('end') == ':':
+        raise ValueError(f"Диапазон {sheet_range!r} не в нотации A1 с листом и начальной ячейкой (Лист!A1:K)")
+    return match
+
+
+def shift_start_row(sheet_range, rows):
+    """Сдвигает начальную строку диапазона A1 на rows строк: 'Sheet1!A1:K' -> 'Sheet1!A3:K' при rows=2.
+    Имя листа и конец диапазона не меняются. Некорректный диапазон вызывает ValueError"""
+    match = _parse_range(sheet_range)
+    return (f"{match.group('sheet')}!{match.group('start_col')}{int(match.group('start_row')) + rows}"
+            f"{match.group('end') or ''}")
+
+
+def _marketplace(key, spec):
+    missing = {'name', 'adapter', 'table_prefix', 'key_col'} - set(spec)
+    if missing:
+        raise ValueError(f"В описании маркетплейса {key} нет полей: {', '.join(sorted(missing))}")
+    if spec['adapter'] not in ADAPTERS:
+        raise ValueError(f"Неизвестный клиент API {spec['adapter']} у маркетплейса {key}")
+    return Marketplace(key, spec['name'], spec['adapter'], spec['table_prefix'], spec['key_col'],
+                       spec.get('price_columns', {}), spec.get('push_columns', {}), spec.get('save_updated', False),
+                       spec.get('shop_concurrency', 1), spec.get('enabled', True))
+
+
+def load_registry(marketplaces=MARKETPLACES, shops=SHOPS, include_disabled=False):
+    """Собирает список магазинов из описаний маркетплейсов и магазинов.
+    Параметры магазина берутся из SHOPS, а если не заданы - из его маркетплейса.
+    Диапазон записи результатов - write_range магазина или его диапазон, сдвинутый на SHEET_HEADER_ROWS строк.
+    Магазины выключенных маркетплейсов пропускаются. Ошибки описания вызывают ValueError"""
+    known = {key: _marketplace(key, spec) for key, spec in marketplaces.items()}
+    result = []
+    seen = set()
+    for spec in shops:
+        marketplace = known.get(spec.get('marketplace'))
+        if marketplace is None:
+            raise ValueError(f"Неизвестный маркетплейс {spec.get('marketplace')} у магазина {spec.get('shop')}")
+        if 'shop' not in spec or 'range' not in spec:
+            raise ValueError(f"У магазина маркетплейса {marketplace.key} не задано название или диапазон")
+        if (marketplace.key, spec['shop']) in seen:
+            raise ValueError(f"Магазин {spec['shop']} маркетплейса {marketplace.key} описан дважды")
+        seen.add((marketplace.key, spec['shop']))
+        try:
+            write_range = shift_start_row(spec['range'], SHEET_HEADER_ROWS)
+            if spec.get('write_range') is not None:
+                write_range = _parse_range(spec['write_range']).group(0)
+        except ValueError as e:
+            raise ValueError(f"Магазин {spec['shop']} маркетплейса {marketplace.key}: {e}") from None
+        if not (marketplace.enabled or include_disabled):
+            continue
+        defaults = marketplaces[marketplace.key]
+        options = {name: spec.get(name, defaults.get(name)) for name in SHOP_OVERRIDES}
+        result.append(Shop(marketplace, spec['shop'], spec['range'], write_range, spec.get('credentials', {}),
+                           options['client_options'] or {}, options['rate_limit'],
+                           options['interval_minutes'], options['priority'] or 0, options['offset_seconds'] or 0))
+    return result
+
+
+async def push_prices(shop, price_changed_df, session=None, debug=False):
+    """Отправляет измененные цены магазина через клиент API его маркетплейса"""
+    adapter = ADAPTERS[shop.marketplace.adapter]
+    return await adapter(price_changed_df, **shop.marketplace.push_columns, **shop.credentials, **shop.client_options,
+                         rate_limit=shop.rate_limit, debug=debug, session=session)
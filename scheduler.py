@@ -0,0 +1,142 @@
+import asyncio
+import math
+import random
+import time
+from config import SCHEDULER_JITTER_SECONDS
+from logger import logger
+
+
+class ScheduledJob:
+    """Задание планировщика: payload запускается каждые interval_seconds секунд.
+
+    Моменты запуска выровнены по границам интервала (с учетом offset_seconds) по настенным часам
+    и не зависят от длительности предыдущих запусков. Задания с большим priority запускаются первыми"""
+
+    def __init__(self, name, interval_seconds, payload, priority=0, offset_seconds=0):
+        self.name = name
+        self.interval = interval_seconds
+        self.payload = payload
+        self.priority = priority
+        self.offset = offset_seconds
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.missed = 0
+        self.last_duration = None
+        self.last_lag = None
+
+    def next_slot_after(self, now):
+        """Ближайший выровненный момент запуска после now"""
+        return (math.floor((now - self.offset) / self.interval) + 1) * self.interval + self.offset
+
+    def stats(self):
+        return {"runs": self.runs, "missed": self.missed, "last_duration": self.last_duration,
+                "last_lag": self.last_lag}
+
+
+class Scheduler:
+    """Планировщик заданий с собственными интервалами без накопления дрейфа.
+
+    Для заданий, у которых наступил срок, один раз вызывается read_wave(jobs) - общее чтение данных волны
+    (например, одно пакетное чтение Google Sheets), затем каждое задание выполняется отдельно через
+    run_job(job, wave) и освобождается сразу по завершении, не дожидаясь остальных заданий волны.
+    После завершения всех заданий вызывается finish_wave(wave, jobs, results). Каждое задание стартует
+    со своей случайной задержкой до jitter_seconds; задержки распределяются по убыванию priority, поэтому
+    задания с большим приоритетом стартуют раньше. Задание не запускается повторно, пока не завершился
+    предыдущий запуск: такой запуск, как и пропущенные из-за опоздания сроки, считается пропущенным и попадает в лог"""
+
+    def __init__(self, run_job, read_wave=None, finish_wave=None, jitter_seconds=SCHEDULER_JITTER_SECONDS,
+                 run_on_start=True):
+        self.run_job = run_job
+        self.read_wave = read_wave
+        self.finish_wave = finish_wave
+        self.jitter_seconds = jitter_seconds
+        self.run_on_start = run_on_start
+        self.jobs = []
+        self._tasks = set()
+
+    def add_job(self, job):
+        self.jobs.append(job)
+        return job
+
+    def _collect_due(self, now):
+        """Возвращает задания волны (по убыванию приоритета) и переносит их сроки на следующий интервал"""
+        wave = []
+        for job in self.jobs:
+            if job.next_run > now:
+                continue
+            scheduled = job.next_run
+            skipped = math.floor((now - scheduled) / job.interval)
+            job.next_run = job.next_slot_after(now)
+            if skipped:
+                job.missed += skipped
+                logger.warning("Пропущены сроки запуска задания: планировщик не успевает", job=job.name,
+                               missed=skipped, total_missed=job.missed)
+            if job.running:
+                job.missed += 1
+                logger.warning("Пропущен запуск задания: предыдущий запуск еще выполняется", job=job.name,
+                               total_missed=job.missed)
+                continue
+            job.running = True
+            wave.append((job, scheduled))
+        wave.sort(key=lambda item: -item[0].priority)
+        return wave
+
+    async def _run_job(self, job, scheduled, delay, wave_data):
+        if delay:
+            await asyncio.sleep(delay)
+        started = time.time()
+        job.last_lag = round(started - scheduled, 3)
+        try:
+            return await self.run_job(job, wave_data)
+        except Exception as e:
+            logger.error("Ошибка выполнения задания", job=job.name, error=str(e))
+            return False
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_duration = round(time.time() - started, 3)
+
+    async def _run(self, wave):
+        jobs = [job for job, _ in wave]
+        try:
+            wave_data = await self.read_wave(jobs) if self.read_wave is not None else None
+        except Exception as e:
+            logger.error("Ошибка общего чтения волны заданий", jobs=[job.name for job in jobs], error=str(e))
+            for job in jobs:
+                job.running = False
+            return
+        # Случайные задержки по возрастанию: порядок старта совпадает с порядком приоритетов
+        delays = sorted(random.uniform(0, self.jitter_seconds) if self.jitter_seconds else 0 for _ in wave)
+        results = await asyncio.gather(*(self._run_job(job, scheduled, delay, wave_data)
+                                         for (job, scheduled), delay in zip(wave, delays)))
+        if self.finish_wave is not None:
+            try:
+                await self.finish_wave(wave_data, jobs, results)
+            except Exception as e:
+                logger.error("Ошибка завершения волны заданий", jobs=[job.name for job in jobs], error=str(e))
+
+    async def run_forever(self):
+        if not self.jobs:
+            logger.warning("Нет заданий для планировщика")
+            return
+        now = time.time()
+        for job in self.jobs:
+            job.next_run = now if self.run_on_start else job.next_slot_after(now)
+        logger.info("Планировщик запущен", jobs=len(self.jobs))
+        try:
+            while True:
+                now = time.time()
+                wave = self._collect_due(now)
+                if wave:
+                    logger.info("Запуск волны заданий", jobs=[job.name for job, _ in wave])
+                    task = asyncio.create_task(self._run(wave))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                await asyncio.sleep(max(0.0, min(job.next_run for job in self.jobs) - time.time()))
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+
+    def stats(self):
+        return {job.name: job.stats() for job in self.jobs}
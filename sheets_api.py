@@ -0,0 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from auth import execute_request
+from config import SHEETS_MAX_WORKERS
+
+# Отдельный ограниченный пул потоков для запросов к Sheets API, чтобы блокирующий
+# .execute() не останавливал цикл событий и не занимал общий пул asyncio.to_thread
+_executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix="sheets")
+
+
+def queue_size():
+    """Число запросов Sheets API, ожидающих свободного потока пула"""
+    return _executor._work_queue.qsize()
+
+
+async def execute(request):
+    """Асинхронно выполняет подготовленный запрос Sheets API в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, execute_request, request)
@@ -0,0 +1,121 @@
+import sqlite3
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from config import SQLITE_DB_NAME, DELTA_FULL_RUN_MINUTES
+from data_updater import fill_missing_values
+from db import get_database
+from logger import logger
+
+# full - нужна полная обработка диапазона; changed_labels - метки новых и измененных строк DataFrame;
+# removed_keys - кортежи ключей исчезнувших строк; snapshot - снимок текущего DataFrame для stage()
+RowDelta = namedtuple("RowDelta", ["full", "changed_labels", "inserted", "changed", "removed_keys", "snapshot"])
+Snapshot = namedtuple("Snapshot", ["columns", "hashes", "built_at"])
+
+
+def row_hashes(df, key_col):
+    """Хеши строк DataFrame (по строковым значениям всех ячеек), индексированные ключом"""
+    hashes = pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+    return pd.Series(hashes, index=df[key_col].astype(str).to_numpy())
+
+
+class SnapshotCache:
+    """Снимки диапазонов за прошлый цикл в памяти процесса для построчной обработки изменений.
+
+    Для каждой таблицы хранятся хеши строк по первичному ключу; diff() сравнивает с ними новый DataFrame
+    и возвращает новые, измененные и удаленные строки. Снимок фиксируется (commit) только после успешной
+    записи диапазона в Google Sheets. После перезапуска снимок восстанавливается из таблицы SQLite
+    или, если передано хранилище store (SnapshotStore), из последнего снимка листа в нем.
+    Раз в full_run_minutes, а также при смене столбцов или повторяющихся ключах диапазон обрабатывается полностью.
+    Строки, записанные обратно в таблицу, в следующем цикле отличаются от снимка и обрабатываются еще раз."""
+
+    def __init__(self, db_name=SQLITE_DB_NAME, full_run_minutes=DELTA_FULL_RUN_MINUTES, store=None):
+        self.db_name = db_name
+        self.store = store
+        self.full_run_seconds = full_run_minutes * 60
+        self._snapshots = {}
+        self._pending = {}
+
+    async def _load(self, table_name, columns, key_col):
+        """Строит снимок по сохраненной таблице SQLite или хранилищу снимков, None - если данных нет или столбцы не совпадают"""
+        if self.store is not None:
+            saved = await self.store.load(table_name)
+            if saved is None or tuple(saved.columns) != tuple(str(col) for col in columns):
+                return None
+            return self._restored(table_name, saved, columns, key_col)
+        column_list = ", ".join('"' + str(col).replace('"', '""') + '"' for col in columns)
+
+        def job(conn):
+            return conn.execute(f"SELECT {column_list} FROM \"{table_name}\"").fetchall()
+
+        try:
+            rows = await get_database(self.db_name).read(job)
+        except sqlite3.Error:
+            return None
+        return self._restored(table_name, pd.DataFrame(rows, columns=columns, dtype=object), columns, key_col)
+
+    @staticmethod
+    def _restored(table_name, saved, columns, key_col):
+        if saved[key_col].astype(str).duplicated().any():
+            return None
+        logger.info("Снимок диапазона восстановлен из базы данных", table=table_name, rows=len(saved))
+        return Snapshot(tuple(columns), row_hashes(saved, key_col), time.time())
+
+    async def diff(self, table_name, df, key_col):
+        """Сравнивает DataFrame со снимком прошлого цикла и возвращает RowDelta"""
+        columns = tuple(str(col) for col in df.columns)
+        keys = df[key_col].astype(str)
+        if keys.duplicated().any():
+            logger.warning("Повторяющиеся ключи в диапазоне, выполняется полная обработка",
+                           table=table_name, key=key_col)
+            return RowDelta(True, df.index, len(df), 0, None, None)
+        hashes = row_hashes(df, key_col)
+
+        previous = self._snapshots.get(table_name)
+        if previous is None:
+            previous = await self._load(table_name, list(df.columns), key_col)
+        if (previous is None or previous.columns != columns
+                or time.time() - previous.built_at >= self.full_run_seconds):
+            return RowDelta(True, df.index, len(df), 0, None, Snapshot(columns, hashes, time.time()))
+
+        inserted = ~hashes.index.isin(previous.hashes.index)
+        changed = np.zeros(len(hashes), dtype=bool)
+        changed[~inserted] = previous.hashes.reindex(hashes.index[~inserted]).to_numpy() != hashes.to_numpy()[~inserted]
+        removed = previous.hashes.index.difference(hashes.index)
+        return RowDelta(False, df.index[inserted | changed], int(inserted.sum()), int(changed.sum()),
+                        [(key,) for key in removed], Snapshot(columns, hashes, previous.built_at))
+
+    def stage(self, table_name, snapshot, write_range):
+        """Запоминает снимок обработанного диапазона до записи в Google Sheets"""
+        if snapshot is not None:
+            self._pending[table_name] = (snapshot, write_range)
+
+    def _take_pending(self, ranges):
+        """Забирает ожидающие снимки диапазонов записи ranges (None - все)"""
+        taken = {key: value for key, value in self._pending.items() if ranges is None or value[1] in ranges}
+        for key in taken:
+            del self._pending[key]
+        return taken
+
+    def discard(self, ranges=None):
+        """Отбрасывает ожидающие снимки (цикл завершился ошибкой до записи в Google Sheets)"""
+        self._take_pending(ranges)
+
+    def commit(self, failed_ranges=(), ranges=None):
+        """Фиксирует ожидающие снимки диапазонов ranges (None - все), кроме диапазонов, запись которых не удалась.
+        Диапазон с неудачной записью следующий цикл обработает полностью"""
+        pending = self._take_pending(ranges)
+        for table_name, (snapshot, write_range) in pending.items():
+            if write_range in failed_ranges:
+                snapshot = snapshot._replace(built_at=0)
+            self._snapshots[table_name] = snapshot
+
+
+def merge_updated_rows(df, updated_rows):
+    """Собирает полный результат update_price из исходного DataFrame и результата для измененных строк.
+    Необработанные строки остаются такими, какими их вернул бы update_price без принятых решений"""
+    updated_df = fill_missing_values(df).iloc[1:]
+    if updated_rows is not None and len(updated_rows):
+        updated_df.loc[updated_rows.index, updated_rows.columns] = updated_rows
+    return updated_df
@@ -0,0 +1,398 @@
+import json
+import os
+import re
+import sqlite3
+import time
+import uuid
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+import asyncio
+import numpy as np
+import pandas as pd
+from config import (SQLITE_DB_NAME, SNAPSHOT_STORE_FORMAT, SNAPSHOT_STORE_DIR, SNAPSHOT_STORE_COMPRESSION,
+                    SNAPSHOT_STORE_FULL_RUN_MINUTES, SNAPSHOT_STORE_RETENTION_DAYS)
+from db import get_database
+from logger import logger
+from metrics import metrics
+from snapshot_cache import row_hashes
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+SNAPSHOT_MANIFEST_TABLE = 'snapshot_manifest'
+SNAPSHOT_BLOB_DB = 'snapshots.db'
+SNAPSHOT_FORMATS = ('parquet', 'arrow', 'sqlite')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+_INT_PATTERN = re.compile(r"0|-?[1-9]\d{0,17}")
+_MMAP_SIZE = 256 * 2 ** 20
+
+# Столбец снимка: kind - 'int' (целые без потери записи) или 'text', values - int64 или object, nulls - маска пустых
+Column = namedtuple("Column", ["kind", "values", "nulls"])
+# Запись манифеста: снимок полный (full) или только изменившиеся строки (delta) в файле/ключе location
+ManifestEntry = namedtuple("ManifestEntry", ["id", "table_name", "timestamp", "kind", "format", "location", "key_col",
+                                             "columns", "rows", "changed", "bytes"])
+_StoredState = namedtuple("_StoredState", ["columns", "key_col", "hashes", "full_at"])
+
+
+def _encode_column(values):
+    """Столбец DataFrame (строки и None) в Column. Столбец хранится как int64, только если все непустые значения -
+    целые в канонической записи, иначе - как текст; в обоих случаях значения восстанавливаются без изменений"""
+    codes, uniques = pd.factorize(values)
+    nulls = codes < 0
+    if len(uniques) and all(isinstance(value, str) and _INT_PATTERN.fullmatch(value) for value in uniques):
+        numbers = np.array([int(value) for value in uniques], dtype=np.int64)
+        return Column('int', np.where(nulls, 0, numbers[np.maximum(codes, 0)]), nulls)
+    text = np.array([value if isinstance(value, str) else str(value) for value in uniques] + [None], dtype=object)
+    return Column('text', text[codes], nulls)
+
+
+def _decode_column(column):
+    """Column в массив object со строками и None"""
+    if column.kind == 'int':
+        values = column.values.astype(str).astype(object)
+    else:
+        values = np.asarray(column.values, dtype=object).copy()
+    values[column.nulls] = None
+    return values
+
+
+def _frame_columns(df, positions, changed=None):
+    """Столбцы снимка: столбцы df с позициями positions (первым - ключ). Для дельты в строках без изменений
+    остается только ключ (остальное - пусто), последний столбец - признак измененной строки"""
+    columns = []
+    for stored, position in enumerate(positions):
+        values = df.iloc[:, position].to_numpy(dtype=object)
+        if changed is not None and stored != 0:
+            values = np.where(changed, values, None)
+        columns.append(_encode_column(values))
+    if changed is not None:
+        columns.append(Column('int', changed.astype(np.int64), np.zeros(len(changed), dtype=bool)))
+    return columns
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class _ArrowFiles:
+    """Снимки в файлах Parquet или Arrow IPC (нужен pyarrow). Столбцы называются c0, c1, ... по позиции"""
+
+    def __init__(self, directory, fmt, compression):
+        self.directory = directory
+        self.format = fmt
+        self.compression = compression
+
+    async def write(self, location, columns):
+        return await asyncio.to_thread(self._write, location, columns)
+
+    async def read(self, location, positions):
+        return await asyncio.to_thread(self._read, location, positions)
+
+    async def delete(self, locations):
+        await asyncio.to_thread(self._delete, locations)
+
+    def _write(self, location, columns):
+        arrays = [pa.array(column.values, type=pa.int64(), mask=column.nulls) if column.kind == 'int'
+                  else pa.array(column.values, type=pa.string()) for column in columns]
+        table = pa.Table.from_arrays(arrays, names=[f"c{i}" for i in range(len(arrays))])
+        path = os.path.join(self.directory, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.format == 'parquet':
+            return _write_atomic(path, lambda tmp: pa.parquet.write_table(table, tmp, compression=self.compression))
+
+        def write_ipc(tmp):
+            options = pa.ipc.IpcWriteOptions(compression=self.compression)
+            with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+
+        return _write_atomic(path, write_ipc)
+
+    def _read(self, location, positions):
+        """Читает столбцы с позициями positions через mmap (Arrow IPC без сжатия читается без копирования)"""
+        path = os.path.join(self.directory, location)
+        names = [f"c{i}" for i in positions]
+        if self.format == 'parquet':
+            return self._columns(pa.parquet.read_table(path, columns=names, memory_map=True), names)
+        with pa.memory_map(path) as source:
+            return self._columns(pa.ipc.open_file(source).read_all(), names)
+
+    @staticmethod
+    def _columns(table, names):
+        columns = []
+        for name in names:
+            array = table.column(name)
+            nulls = array.is_null().to_numpy()
+            if pa.types.is_integer(array.type):
+                columns.append(Column('int', array.fill_null(0).to_numpy().copy(), nulls))
+            else:
+                columns.append(Column('text', array.to_numpy(), nulls))
+        return columns
+
+    def _delete(self, locations):
+        for location in locations:
+            try:
+                os.remove(os.path.join(self.directory, location))
+            except FileNotFoundError:
+                pass
+
+
+class _SQLiteColumns:
+    """Снимки в отдельной базе SQLite: по строке на столбец, значения сжаты zlib
+    (int - массив int64 с маской пустых, text - JSON-список строк). Чтение - через mmap SQLite"""
+
+    format = 'sqlite'
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.db_name = os.path.join(directory, SNAPSHOT_BLOB_DB)
+
+    @staticmethod
+    def _prepare(conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS snapshot_columns (
+            snapshot TEXT NOT NULL, position INTEGER NOT NULL, kind TEXT NOT NULL, nulls BLOB, data BLOB NOT NULL,
+            PRIMARY KEY (snapshot, position))""")
+
+    async def write(self, location, columns):
+        def job(conn):
+            self._prepare(conn)
+            size = 0
+            for position, column in enumerate(columns):
+                if column.kind == 'int':
+                    data = zlib.compress(column.values.astype(np.int64).tobytes())
+                    nulls = zlib.compress(np.packbits(column.nulls).tobytes()) if column.nulls.any() else None
+                else:
+                    data = zlib.compress(json.dumps(_decode_column(column).tolist(), ensure_ascii=False).encode())
+                    nulls = None
+                conn.execute("INSERT INTO snapshot_columns VALUES (?, ?, ?, ?, ?)",
+                             (location, position, column.kind, nulls, data))
+                size += len(data) + len(nulls or b'')
+            return size
+
+        return await get_database(self.db_name).write(job)
+
+    async def read(self, location, positions):
+        def job(conn):
+            conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+            placeholders = ", ".join("?" * len(positions))
+            return {position: (kind, nulls, data) for position, kind, nulls, data in conn.execute(
+                f"SELECT position, kind, nulls, data FROM snapshot_columns WHERE snapshot = ? "
+                f"AND position IN ({placeholders})", [location] + list(positions))}
+
+        rows = await get_database(self.db_name).read(job)
+        return await asyncio.to_thread(self._decode, rows, positions)
+
+    @staticmethod
+    def _decode(rows, positions):
+        columns = []
+        for position in positions:
+            kind, nulls, data = rows[position]
+            if kind == 'int':
+                values = np.frombuffer(zlib.decompress(data), dtype=np.int64)
+                mask = np.zeros(len(values), dtype=bool)
+                if nulls is not None:
+                    mask = np.unpackbits(np.frombuffer(zlib.decompress(nulls), dtype=np.uint8))[:len(values)].astype(bool)
+                columns.append(Column('int', values, mask))
+            else:
+                values = np.array(json.loads(zlib.decompress(data)), dtype=object)
+                columns.append(Column('text', values, pd.isna(values)))
+        return columns
+
+    async def delete(self, locations):
+        def job(conn):
+            self._prepare(conn)
+            conn.executemany("DELETE FROM snapshot_columns WHERE snapshot = ?", [(location,) for location in locations])
+
+        await get_database(self.db_name).write(job)
+
+
+def _restore(layout, stored, parts):
+    """Собирает DataFrame из полного снимка и дельт (parts - прочитанные столбцы stored каждого снимка)"""
+    values = [_decode_column(column) for column in parts[0]]
+    for delta in parts[1:]:
+        changed = delta[-1].values.astype(bool)
+        keys = _decode_column(delta[0])
+        taken = np.maximum(pd.Index(values[0].astype(str)).get_indexer(keys.astype(str)), 0)
+        values = [np.where(changed, _decode_column(column), previous[taken]) if len(previous) else
+                  _decode_column(column) for column, previous in zip(delta[:-1], values)]
+    # Столбцы в исходном порядке листа
+    positions = [layout["positions"][i] for i in stored]
+    order = sorted(range(len(positions)), key=positions.__getitem__)
+    frame = pd.DataFrame({i: values[j] for i, j in enumerate(order)})
+    frame.columns = [layout["columns"][positions[j]] for j in order]
+    return frame
+
+
+def _safe_name(table_name):
+    return re.sub(r"[^\w.-]+", "_", table_name)
+
+
+class SnapshotStore:
+    """Поколоночные сжатые снимки листов магазинов по циклам с манифестом в таблице snapshot_manifest.
+
+    Заменяет построчные таблицы product_data_*: за цикл состояние листа пишется один раз. Раз в full_run_minutes
+    (и после перезапуска, смены столбцов или при повторяющихся ключах) сохраняется полный снимок, в остальных
+    циклах - дельта: ключи всех строк в порядке листа и значения только изменившихся строк. Если лист не изменился,
+    ничего не пишется. load() восстанавливает лист на любой момент хранения (полный снимок + дельты после него).
+    Форматы: parquet и arrow (Arrow IPC, нужен pyarrow, чтение через mmap) и sqlite (без зависимостей)"""
+
+    def __init__(self, fmt=SNAPSHOT_STORE_FORMAT, directory=SNAPSHOT_STORE_DIR, db_name=SQLITE_DB_NAME,
+                 compression=SNAPSHOT_STORE_COMPRESSION, full_run_minutes=SNAPSHOT_STORE_FULL_RUN_MINUTES,
+                 retention_days=SNAPSHOT_STORE_RETENTION_DAYS):
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Неизвестный формат хранилища снимков {fmt}, допустимые: {', '.join(SNAPSHOT_FORMATS)}")
+        if fmt != 'sqlite' and pa is None:
+            raise ValueError(f"Для формата снимков {fmt} нужен пакет pyarrow, установите его или выберите формат sqlite")
+        self.format = fmt
+        self.directory = directory
+        self.db_name = db_name
+        self.full_run_seconds = full_run_minutes * 60
+        self.retention_days = retention_days
+        self._backend = _SQLiteColumns(directory) if fmt == 'sqlite' else _ArrowFiles(directory, fmt, compression)
+        self._state = {}
+
+    async def _manifest(self, job):
+        def run(conn):
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {SNAPSHOT_MANIFEST_TABLE} (
+                id INTEGER PRIMARY KEY, table_name TEXT NOT NULL, timestamp TEXT NOT NULL, kind TEXT NOT NULL,
+                format TEXT NOT NULL, location TEXT NOT NULL, key_col TEXT, columns TEXT NOT NULL,
+                rows INTEGER, changed INTEGER, bytes INTEGER)""")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {SNAPSHOT_MANIFEST_TABLE}_table_ts "
+                         f"ON {SNAPSHOT_MANIFEST_TABLE} (table_name, timestamp)")
+            return job(conn)
+
+        return await get_database(self.db_name).write(run)
+
+    def _location(self, table_name, timestamp, kind):
+        stamp = timestamp.replace('-', '').replace(':', '').replace(' ', 'T')
+        name = f"{stamp}_{kind}_{uuid.uuid4().hex[:8]}"
+        if self.format == 'sqlite':
+            return f"{_safe_name(table_name)}/{name}"
+        return os.path.join(_safe_name(table_name), f"{name}.{self.format}")
+
+    def _delta_mask(self, table_name, columns, key_col, hashes):
+        """Маска измененных строк относительно последнего сохраненного снимка или None, если нужен полный снимок"""
+        state = self._state.get(table_name)
+        if (state is None or hashes is None or state.columns != columns or state.key_col != key_col
+                or time.time() - state.full_at >= self.full_run_seconds):
+            return None
+        inserted = ~hashes.index.isin(state.hashes.index)
+        changed = inserted.copy()
+        changed[~inserted] = (state.hashes.reindex(hashes.index[~inserted]).to_numpy()
+                              != hashes.to_numpy()[~inserted])
+        return changed
+
+    async def save(self, table_name, df, key_col, cycle_timestamp=None, hashes=None):
+        """Сохраняет состояние листа за цикл. hashes - хеши строк по ключу (RowDelta.snapshot.hashes), если уже
+        посчитаны. Возвращает запись манифеста или None, если лист не изменился с прошлого снимка"""
+        timestamp = cycle_timestamp or datetime.now().strftime(TIMESTAMP_FORMAT)
+        columns = tuple(str(col) for col in df.columns)
+        if hashes is None and not df[key_col].astype(str).duplicated().any():
+            hashes = row_hashes(df, key_col)
+        state = self._state.get(table_name)
+        changed = self._delta_mask(table_name, columns, key_col, hashes)
+        if changed is not None and not changed.any() and hashes.index.equals(state.hashes.index):
+            return None
+        kind = 'full' if changed is None else 'delta'
+        # Ключ хранится первым столбцом: по нему дельта сопоставляется с предыдущим состоянием
+        key_position = columns.index(str(key_col))
+        positions = [key_position] + [i for i in range(len(columns)) if i != key_position]
+        location = self._location(table_name, timestamp, kind)
+        payload = await asyncio.to_thread(_frame_columns, df, positions, changed)
+        try:
+            size = await self._backend.write(location, payload)
+        except Exception:
+            self._state.pop(table_name, None)
+            raise
+        row = (table_name, timestamp, kind, self.format, location, key_col,
+               json.dumps({"columns": list(columns), "positions": positions}, ensure_ascii=False), len(df),
+               len(df) if changed is None else int(changed.sum()), size)
+
+        def job(conn):
+            return conn.execute(f"""INSERT INTO {SNAPSHOT_MANIFEST_TABLE}
+                (table_name, timestamp, kind, format, location, key_col, columns, rows, changed, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", row).lastrowid
+
+        entry_id = await self._manifest(job)
+        if hashes is not None:
+            full_at = time.time() if changed is None else state.full_at
+            self._state[table_name] = _StoredState(columns, key_col, hashes, full_at)
+        else:
+            self._state.pop(table_name, None)
+        metrics.inc("snapshot_store_bytes_total", size, kind=kind)
+        if changed is None:
+            await self.prune(table_name)
+        return ManifestEntry(entry_id, *row)
+
+    async def entries(self, table_name, at=None):
+        """Записи манифеста, нужные для восстановления листа на момент at (последний полный снимок и дельты после него)"""
+        at = at.strftime(TIMESTAMP_FORMAT) if isinstance(at, datetime) else at
+
+        def job(conn):
+            base = conn.execute(f"""SELECT MAX(id) FROM {SNAPSHOT_MANIFEST_TABLE}
+                WHERE table_name = ? AND format = ? AND kind = 'full' AND (? IS NULL OR timestamp <= ?)""",
+                                (table_name, self.format, at, at)).fetchone()[0]
+            if base is None:
+                return []
+            return conn.execute(f"""SELECT id, table_name, timestamp, kind, format, location, key_col, columns, rows,
+                changed, bytes FROM {SNAPSHOT_MANIFEST_TABLE}
+                WHERE table_name = ? AND format = ? AND id >= ? AND (? IS NULL OR timestamp <= ?) ORDER BY id""",
+                                (table_name, self.format, base, at, at)).fetchall()
+
+        try:
+            rows = await get_database(self.db_name).read(job)
+        except sqlite3.Error:
+            return []
+        return [ManifestEntry(*row) for row in rows]
+
+    async def load(self, table_name, at=None, columns=None):
+        """Восстанавливает DataFrame листа на момент at (datetime или 'YYYY-MM-DD HH:MM:SS', None - последний снимок).
+        columns - читать только эти столбцы (ключ читается всегда). None, если снимков нет"""
+        entries = await self.entries(table_name, at)
+        if not entries:
+            return None
+        layout = json.loads(entries[0].columns)
+        names = [layout["columns"][position] for position in layout["positions"]]
+        stored = [i for i, name in enumerate(names) if i == 0 or columns is None or name in columns]
+        parts = [await self._backend.read(entries[0].location, stored)]
+        for entry in entries[1:]:
+            parts.append(await self._backend.read(entry.location, stored + [len(names)]))
+        return await asyncio.to_thread(_restore, layout, stored, parts)
+
+    async def prune(self, table_name, now=None):
+        """Удаляет снимки старше retention_days, кроме полного снимка, нужного для восстановления на начало срока"""
+        if self.retention_days is None:
+            return 0
+        cutoff = ((now or datetime.now()) - timedelta(days=self.retention_days)).strftime(TIMESTAMP_FORMAT)
+
+        def job(conn):
+            base = conn.execute(f"""SELECT MAX(id) FROM {SNAPSHOT_MANIFEST_TABLE}
+                WHERE table_name = ? AND kind = 'full' AND timestamp <= ?""", (table_name, cutoff)).fetchone()[0]
+            if base is None:
+                return []
+            locations = [location for (location,) in conn.execute(
+                f"SELECT location FROM {SNAPSHOT_MANIFEST_TABLE} WHERE table_name = ? AND id < ?", (table_name, base))]
+            conn.execute(f"DELETE FROM {SNAPSHOT_MANIFEST_TABLE} WHERE table_name = ? AND id < ?", (table_name, base))
+            return locations
+
+        locations = await self._manifest(job)
+        if locations:
+            await self._backend.delete(locations)
+            logger.info("Удалены устаревшие снимки листа", table=table_name, snapshots=len(locations))
+        return len(locations)
+
+
+def open_snapshot_store(fmt=SNAPSHOT_STORE_FORMAT, **options):
+    """Хранилище снимков по настройкам config или None, если SNAPSHOT_STORE_FORMAT не задан"""
+    if fmt is None:
+        return None
+    store = SnapshotStore(fmt, **options)
+    logger.info("Состояние листов сохраняется в хранилище снимков", format=fmt, directory=store.directory)
+    return store
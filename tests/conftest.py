@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Модули проекта лежат в корне репозитория, тесты импортируют их напрямую
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
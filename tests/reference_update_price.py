@@ -0,0 +1,100 @@
+"""Эталон для тестов: построчная реализация update_price до векторизации (обход iterrows).
+
+Логика решений перенесена без изменений; вместо записи в SQLite строки журнала price_change_log
+собираются в список (без метки времени), логирование убрано.
+"""
+import numpy as np
+import pandas as pd
+
+ID_COL = 'id'
+PRODUCT_ID_COL = 'product_id'
+PRICE_COL = 't_price'
+OLD_PRICE_COL = 'price'
+PRIM_COL = 'prim'
+
+
+def reference_update_price(df, id_col=ID_COL, product_id_col=PRODUCT_ID_COL, price_col=PRICE_COL,
+                           old_price_col=OLD_PRICE_COL, prim_col=PRIM_COL, old_disc_in_base_col=None,
+                           old_disc_manual_col=None):
+    """Возвращает (updated_df, price_changed_df, строки журнала без timestamp)"""
+    df = df.replace('', np.nan).fillna(value='Нет Значения')
+    df = df.iloc[1:]  # Пропускаем первую строку (заголовки)
+    changes = []
+    log_rows = []
+    updated_df = df.copy()
+
+    for _, row in df.iterrows():
+        change_info = None
+        price_changed = False
+        discount_changed = False
+
+        try:
+            old_price = float(row[old_price_col]) if row[old_price_col] != 'Нет Значения' else None
+            new_price = float(row[price_col]) if row[price_col] != 'Нет Значения' else None
+
+            if old_disc_in_base_col and old_disc_manual_col:
+                old_disc_in_base = float(row[old_disc_in_base_col]) if row[old_disc_in_base_col] != 'Нет Значения' else 0
+                old_disc_manual = float(row[old_disc_manual_col]) if row[old_disc_manual_col] != 'Нет Значения' else 0
+
+                if old_disc_in_base != old_disc_manual:
+                    updated_df.at[_, old_disc_in_base_col] = old_disc_manual
+                    discount_changed = True
+                    change_info = row.to_dict()
+                    change_info[old_disc_in_base_col] = old_disc_manual
+                    change_info['old_discount'] = old_disc_in_base
+                    change_info['new_discount'] = old_disc_manual
+                    discount_prim = f"Обновлена скидка с {old_disc_in_base} на {old_disc_manual}"
+                    updated_df.at[_, prim_col] = discount_prim
+                    change_info['prim'] = discount_prim
+                    log_rows.append((row[id_col], row[product_id_col], row[old_price_col], row[old_price_col],
+                                     old_disc_in_base, old_disc_manual, discount_prim, 1))
+
+        except ValueError:
+            log_rows.append((row[id_col], row[product_id_col], None, None, None, None, "Ошибка формата данных", 0))
+            continue
+
+        if old_price is None or new_price is None:
+            updated_df.at[_, prim_col] = "Отсутствует старая или новая цена"
+            log_rows.append((row[id_col], row[product_id_col], old_price, new_price, None, None,
+                             "Отсутствует старая или новая цена", 0))
+        elif old_price == 0:
+            if new_price != 0:
+                updated_df.at[_, old_price_col] = new_price
+                updated_df.at[_, prim_col] = f"Старая цена была 0, обновлено на {new_price}"
+                price_changed = True
+                change_info = row.to_dict()
+                change_info[old_price_col] = new_price
+                change_info[prim_col] = f"Старая цена была 0, обновлено на {new_price}"
+                log_rows.append((row[id_col], row[product_id_col], old_price, new_price, None, None,
+                                 f"Старая цена была 0, обновлено на {new_price}", 1))
+        elif new_price == 0:
+            updated_df.at[_, prim_col] = "Новая цена стала 0, требуется проверка"
+            log_rows.append((row[id_col], row[product_id_col], old_price, new_price, None, None,
+                             "Новая цена стала 0, требуется проверка", 0))
+        elif abs(new_price - old_price) / old_price > 0.5:
+            updated_df.at[_, prim_col] = f"Изменение цены с {old_price} на {new_price} превышает 50%, цена не изменена"
+            log_rows.append((row[id_col], row[product_id_col], old_price, new_price, None, None,
+                             f"Изменение цены с {old_price} на {new_price} превышает 50%, цена не изменена", 0))
+        elif new_price != old_price:
+            updated_df.at[_, old_price_col] = new_price
+            updated_df.at[_, prim_col] = f"Изменена цена с {old_price} на {new_price}"
+            price_changed = True
+            change_info = row.to_dict()
+            change_info[price_col] = new_price
+            change_info[prim_col] = f"Изменена цена с {old_price} на {new_price}"
+            log_rows.append((row[id_col], row[product_id_col], old_price, new_price, None, None,
+                             f"Изменена цена с {old_price} на {new_price}", 1))
+
+        # Обновляем примечание, если изменились и цена, и скидка
+        if price_changed and discount_changed:
+            prim = f"Изменена цена с {old_price} на {new_price} и скидка с {old_disc_in_base} на {old_disc_manual}"
+            updated_df.at[_, prim_col] = prim
+            change_info[prim_col] = prim
+            log_rows.append((row[id_col], row[product_id_col], old_price, new_price, old_disc_in_base,
+                             old_disc_manual, prim, 1))
+
+        if change_info and (price_changed or discount_changed):
+            change_info['change_applied'] = True
+            changes.append(change_info)
+
+    return updated_df, pd.DataFrame(changes), log_rows
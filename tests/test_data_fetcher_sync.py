@@ -0,0 +1,83 @@
+"""data_fetcher._sync_table на SQLite в памяти: upsert множествами, миграция повторяющихся ключей и счетчики."""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from data_fetcher import _ensure_key_index, _sync_table
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    yield conn
+    conn.close()
+
+
+def goods(rows):
+    return pd.DataFrame(rows, columns=["id", "price", "stock"])
+
+
+def table_rows(conn, table="goods"):
+    return conn.execute(f'SELECT id, price, stock FROM "{table}" ORDER BY id').fetchall()
+
+
+def test_first_sync_inserts_all_rows(conn):
+    counters = _sync_table(conn, goods([[1, 100, 5], [2, 200, 6]]), "goods", ["id"])
+    assert counters == (2, 0, 0, 0)
+    assert table_rows(conn) == [("1", "100", "5"), ("2", "200", "6")]
+
+
+def test_upsert_counts_inserted_updated_unchanged_deleted(conn):
+    _sync_table(conn, goods([[1, 100, 5], [2, 200, 6], [3, 300, 7]]), "goods", ["id"])
+    counters = _sync_table(conn, goods([[1, 100, 5], [2, 250, 6], [4, 400, 8]]), "goods", ["id"])
+    assert counters == (1, 1, 1, 1)
+    assert table_rows(conn) == [("1", "100", "5"), ("2", "250", "6"), ("4", "400", "8")]
+
+
+def test_repeated_key_in_dataframe_keeps_last_row(conn):
+    counters = _sync_table(conn, goods([[1, 100, 5], [1, 150, 9]]), "goods", ["id"])
+    assert counters == (1, 0, 0, 0)
+    assert table_rows(conn) == [("1", "150", "9")]
+
+
+def test_delta_deletes_only_removed_keys(conn):
+    _sync_table(conn, goods([[1, 100, 5], [2, 200, 6], [3, 300, 7]]), "goods", ["id"])
+    # В дельте только измененная строка 2; строка 1 не передана, но и не удалена
+    counters = _sync_table(conn, goods([[2, 210, 6]]), "goods", ["id"], removed_keys=[("3",)])
+    assert counters == (0, 1, 0, 1)
+    assert table_rows(conn) == [("1", "100", "5"), ("2", "210", "6")]
+
+
+def test_new_columns_are_added(conn):
+    _sync_table(conn, goods([[1, 100, 5]]), "goods", ["id"])
+    df = pd.DataFrame([[1, 100, 5, "x"]], columns=["id", "price", "stock", "note"])
+    assert _sync_table(conn, df, "goods", ["id"]) == (0, 1, 0, 0)
+    assert conn.execute('SELECT note FROM "goods"').fetchall() == [("x",)]
+
+
+def test_migration_keeps_last_duplicate_and_creates_unique_index(conn):
+    # Таблица старого формата без ключа с повторяющимися записями
+    conn.execute('CREATE TABLE "goods" ("id", "price", "stock")')
+    conn.executemany('INSERT INTO "goods" VALUES (?, ?, ?)',
+                     [("1", "100", "5"), ("2", "200", "6"), ("1", "110", "5"), ("1", "120", "5")])
+    _ensure_key_index(conn.cursor(), "goods", ["id"])
+    assert table_rows(conn) == [("1", "120", "5"), ("2", "200", "6")]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute('INSERT INTO "goods" VALUES ("2", "0", "0")')
+
+
+def test_migration_is_skipped_when_index_exists(conn):
+    _sync_table(conn, goods([[1, 100, 5]]), "goods", ["id"])
+    indexes = conn.execute('PRAGMA index_list("goods")').fetchall()
+    _ensure_key_index(conn.cursor(), "goods", ["id"])
+    assert conn.execute('PRAGMA index_list("goods")').fetchall() == indexes
+
+
+def test_sync_after_migration_counts_against_deduplicated_table(conn):
+    conn.execute('CREATE TABLE "goods" ("id", "price", "stock")')
+    conn.executemany('INSERT INTO "goods" VALUES (?, ?, ?)',
+                     [("1", "100", "5"), ("1", "120", "5"), ("2", "200", "6")])
+    counters = _sync_table(conn, goods([[1, 120, 5], [2, 210, 6]]), "goods", ["id"])
+    assert counters == (0, 1, 1, 0)
+    assert table_rows(conn) == [("1", "120", "5"), ("2", "210", "6")]
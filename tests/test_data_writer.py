@@ -0,0 +1,147 @@
+"""data_writer: построение разностной записи ячеек и пакетная запись SheetWriteBuffer с откатом на поштучную."""
+import asyncio
+
+import pandas as pd
+
+import data_writer
+from data_writer import SheetWriteBuffer, build_cell_diff
+
+
+def frame(rows, index=None):
+    return pd.DataFrame(rows, columns=["a", "b", "c", "d"], index=index)
+
+
+def test_runs_in_one_row_are_merged():
+    original = frame([[1, 2, 3, 4]])
+    updated = frame([[9, 9, 3, 9]])
+    value_ranges, changed, total = build_cell_diff(original, updated, "Лист!A1:D")
+    assert (changed, total) == (3, 4)
+    assert value_ranges == [{"range": "Лист!A1:B1", "values": [[9, 9]]},
+                            {"range": "Лист!D1:D1", "values": [[9]]}]
+
+
+def test_equal_runs_in_adjacent_rows_form_block():
+    original = frame([[1, 2, 3, 4], [1, 2, 3, 4], [1, 2, 3, 4], [1, 2, 3, 4]])
+    updated = frame([[1, 7, 7, 4], [1, 8, 8, 4], [1, 2, 3, 4], [1, 9, 9, 4]])
+    value_ranges, changed, _ = build_cell_diff(original, updated, "Лист!A1:D")
+    assert changed == 6
+    # Строка без изменений разрывает блок
+    assert value_ranges == [{"range": "Лист!B1:C2", "values": [[7, 7], [8, 8]]},
+                            {"range": "Лист!B4:C4", "values": [[9, 9]]}]
+
+
+def test_no_changes_gives_empty_diff():
+    original = frame([[1, 2, 3, 4]])
+    assert build_cell_diff(original, original.copy(), "Лист!A1:D") == ([], 0, 4)
+
+
+def test_row_offset_for_write_start_on_row_3():
+    # Как в process_shop: первая строка данных (заголовок) отброшена, запись начинается с A3
+    original = frame([["h", "h", "h", "h"], [1, 2, 3, 4], [1, 2, 3, 4]])
+    updated = original.iloc[1:].copy()
+    updated.loc[2, "b"] = 5
+    value_ranges, _, total = build_cell_diff(original, updated, "'Мой лист'!A3:D")
+    assert total == 8
+    assert value_ranges == [{"range": "'Мой лист'!B4:B4", "values": [[5]]}]
+
+
+def test_range_without_start_row_is_not_diffed():
+    original = frame([[1, 2, 3, 4]])
+    assert build_cell_diff(original, original.copy(), "Лист!A:D") is None
+
+
+def test_buffer_falls_back_to_full_range_above_share():
+    original = frame([[1, 2, 3, 4], [1, 2, 3, 4]])
+    few = frame([[1, 2, 3, 5], [1, 2, 3, 4]])
+    many = frame([[5, 5, 5, 5], [5, 2, 3, 4]])
+    buffer = SheetWriteBuffer("sheet", write_mode="diff", max_changed_share=0.5)
+    buffer.add(few, "Лист!A3:D", original_df=original)
+    buffer.add(many, "Другой!A3:D", original_df=original)
+    assert buffer._pending["Лист!A3:D"] == [{"range": "Лист!D3:D3", "values": [[5]]}]
+    assert buffer._pending["Другой!A3:D"] == [{"range": "Другой!A3:D",
+                                                "values": [[5, 5, 5, 5], [5, 2, 3, 4]]}]
+
+
+class FakeRequest:
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        self.kwargs = kwargs
+
+
+class FakeValues:
+    def batchUpdate(self, **kwargs):
+        return FakeRequest("batch", **kwargs)
+
+    def update(self, **kwargs):
+        return FakeRequest("update", **kwargs)
+
+
+class FakeService:
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeValues()
+
+
+def test_partial_batch_failure_reports_failed_ranges(monkeypatch):
+    calls = []
+
+    async def fake_service():
+        return FakeService()
+
+    async def fake_execute(request):
+        if request.kind == "batch":
+            ranges = [value_range["range"] for value_range in request.kwargs["body"]["data"]]
+            calls.append(("batch", ranges))
+            if "Плохой!A3:A3" in ranges:
+                raise RuntimeError("invalid range")
+            return {"responses": [{"updatedCells": 1} for _ in ranges], "totalUpdatedCells": len(ranges)}
+        calls.append(("update", request.kwargs["range"]))
+        if request.kwargs["range"] == "Плохой!A3:A3":
+            raise RuntimeError("invalid range")
+        return {"updatedCells": 1}
+
+    monkeypatch.setattr(data_writer, "get_sheets_service", fake_service)
+    monkeypatch.setattr(data_writer, "execute", fake_execute)
+
+    original = frame([[1, 2, 3, 4]])
+    changed = frame([[5, 2, 3, 4]])
+    # Лимит размера пакета такой, что каждый диапазон уходит отдельным запросом batchUpdate
+    buffer = SheetWriteBuffer("sheet", max_payload_bytes=1, write_mode="diff")
+    buffer.add(changed, "Хороший!A3:D", original_df=original)
+    buffer.add(changed, "Плохой!A3:D", original_df=original)
+    buffer.add(original.copy(), "Без изменений!A3:D", original_df=original)
+    result = asyncio.run(buffer.flush())
+
+    assert result == {"succeeded": 1, "failed": 1, "skipped": 1, "failed_ranges": {"Плохой!A3:D"}}
+    assert calls == [("batch", ["Хороший!A3:A3"]), ("batch", ["Плохой!A3:A3"]), ("update", "Плохой!A3:A3")]
+    assert len(buffer) == 0
+
+
+def test_failed_batch_isolates_bad_range(monkeypatch):
+    updates = []
+
+    async def fake_service():
+        return FakeService()
+
+    async def fake_execute(request):
+        if request.kind == "batch":
+            raise RuntimeError("invalid range")
+        updates.append(request.kwargs["range"])
+        if request.kwargs["range"].startswith("Плохой"):
+            raise RuntimeError("invalid range")
+        return {"updatedCells": 4}
+
+    monkeypatch.setattr(data_writer, "get_sheets_service", fake_service)
+    monkeypatch.setattr(data_writer, "execute", fake_execute)
+
+    buffer = SheetWriteBuffer("sheet", write_mode="full")
+    buffer.add(frame([[1, 2, 3, 4]]), "Хороший!A3:D")
+    buffer.add(frame([[1, 2, 3, 4]]), "Плохой!A3:D")
+    result = asyncio.run(buffer.flush())
+
+    # Один пакет из двух диапазонов отклонен целиком; поштучная запись отделяет проблемный диапазон
+    assert updates == ["Хороший!A3:D", "Плохой!A3:D"]
+    assert result["failed_ranges"] == {"Плохой!A3:D"}
+    assert (result["succeeded"], result["failed"]) == (1, 1)
@@ -0,0 +1,34 @@
+"""Database: поток записи переживает закрытие цикла событий, из которого поставлено задание."""
+import asyncio
+import threading
+
+from db import Database
+
+
+def test_writer_survives_closed_loop(tmp_path):
+    database = Database(str(tmp_path / "test.db"))
+    release = threading.Event()
+    done = threading.Event()
+
+    def blocked_job(conn):
+        release.wait(5)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        done.set()
+
+    async def submit_and_leave():
+        asyncio.create_task(database.write(blocked_job))
+        await asyncio.sleep(0)
+
+    # Цикл событий закрывается, пока задание еще выполняется на потоке записи
+    asyncio.run(submit_and_leave())
+    release.set()
+    assert done.wait(5)
+
+    async def write_from_new_loop():
+        return await asyncio.wait_for(
+            database.write(lambda conn: conn.execute("INSERT INTO t VALUES (1)").rowcount), timeout=5)
+
+    try:
+        assert asyncio.run(write_from_new_loop()) == 1
+    finally:
+        database.close()
@@ -0,0 +1,50 @@
+"""logger.RowEventSampler: ограничение построчных событий по имени события structlog."""
+import re
+
+import structlog
+
+import logger as logger_module
+from config import LOG_ROW_EVENTS
+from logger import RowEventSampler
+
+
+def sample(sampler, event, **fields):
+    try:
+        return sampler(None, "debug", {"event": event, **fields})
+    except structlog.DropEvent:
+        return None
+
+
+def test_events_are_limited_per_name(monkeypatch):
+    monkeypatch.setattr(logger_module.time, "monotonic", lambda: 100.0)
+    sampler = RowEventSampler(events=("price_updated", "discount_updated"), per_second=2)
+    kept = [sample(sampler, "price_updated", message="Цена обновлена", id=i) for i in range(5)]
+    assert [event is not None for event in kept] == [True, True, False, False, False]
+    # Другое имя события считается отдельно, даже с тем же текстом сообщения
+    assert sample(sampler, "discount_updated", message="Цена обновлена") is not None
+    # Событие не из списка не ограничивается, хотя его message совпадает с построчным
+    assert all(sample(sampler, "cycle_summary", message="Цена обновлена") is not None for _ in range(5))
+
+
+def test_suppressed_count_is_reported_in_next_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(logger_module.time, "monotonic", lambda: now[0])
+    sampler = RowEventSampler(events=("price_updated",), per_second=1)
+    for _ in range(4):
+        sample(sampler, "price_updated")
+    now[0] = 101.0
+    assert sample(sampler, "price_updated")["suppressed"] == 3
+    assert sample(sampler, "price_updated") is None
+    now[0] = 102.0
+    assert sample(sampler, "price_updated")["suppressed"] == 1
+    now[0] = 103.0
+    assert "suppressed" not in sample(sampler, "price_updated")
+
+
+def test_zero_rate_disables_sampling():
+    sampler = RowEventSampler(events=("price_updated",), per_second=0)
+    assert all(sample(sampler, "price_updated") is not None for _ in range(100))
+
+
+def test_row_events_are_event_names():
+    assert all(re.fullmatch(r"[a-z][a-z_]*", event) for event in LOG_ROW_EVENTS)
@@ -0,0 +1,99 @@
+"""rate_limiter: пополнение токенов, ожидание без удержания блокировки, разбор Retry-After и общий ограничитель ключа."""
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import rate_limiter
+from rate_limiter import AdaptiveRateLimiter, get_rate_limiter, parse_retry_after
+
+_api_keys = itertools.count()
+
+
+def test_refill_is_capped_by_burst():
+    limiter = AdaptiveRateLimiter("wb:test", rate=10, burst=3)
+    limiter._refill(100.0)
+    limiter._tokens = 0
+    limiter._refill(100.15)
+    assert limiter._tokens == pytest.approx(1.5)
+    limiter._refill(200.0)
+    assert limiter._tokens == 3
+
+
+def test_acquire_waits_for_refill():
+    async def scenario():
+        limiter = AdaptiveRateLimiter("wb:test", rate=20, burst=2)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(4):
+            await limiter.acquire()
+        return loop.time() - started
+
+    # Два токена из запаса сразу, еще два - по одному за 1/20 с
+    assert 0.08 <= asyncio.run(scenario()) < 0.5
+
+
+def test_waiting_does_not_hold_lock():
+    async def scenario():
+        limiter = AdaptiveRateLimiter("wb:test", rate=5, burst=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.02)
+        assert not waiter.done()
+        assert not limiter._lock.locked()
+        await waiter
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_acquire():
+    async def scenario():
+        limiter = AdaptiveRateLimiter("wb:test", rate=1000, burst=10)
+        loop = asyncio.get_running_loop()
+        limiter.on_throttle(retry_after=0.1)
+        started = loop.time()
+        await limiter.acquire()
+        return loop.time() - started, limiter.rate
+
+    waited, rate = asyncio.run(scenario())
+    assert waited >= 0.09
+    assert rate < 1000
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after({"Retry-After": "5"}) == 5.0
+    assert parse_retry_after({"Retry-After": "1.5"}) == 1.5
+    assert parse_retry_after({"Retry-After": "-3"}) == 0.0
+    assert parse_retry_after({"X-Ratelimit-Retry": "2"}) == 2.0
+
+
+def test_parse_retry_after_http_date():
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= parse_retry_after({"Retry-After": date}) <= 30
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert parse_retry_after({"Retry-After": past}) == 0.0
+
+
+def test_parse_retry_after_missing_or_invalid():
+    assert parse_retry_after({}) is None
+    assert parse_retry_after({"Retry-After": ""}) is None
+    assert parse_retry_after({"Retry-After": "скоро"}) is None
+
+
+def test_limiter_is_shared_per_key_and_warns_on_other_limits(monkeypatch):
+    warnings = []
+
+    class RecordingLogger:
+        def warning(self, message, **kwargs):
+            warnings.append(kwargs)
+
+    monkeypatch.setattr(rate_limiter, "logger", RecordingLogger())
+    api_key = f"key-{next(_api_keys)}"
+    first = get_rate_limiter("wb", api_key, {"rate": 5, "burst": 5})
+    assert get_rate_limiter("wb", api_key, {"rate": 5, "burst": 5}) is first
+    assert warnings == []
+    assert get_rate_limiter("wb", api_key, {"rate": 50, "burst": 5}) is first
+    assert (first.max_rate, first.burst) == (5, 5)
+    assert len(warnings) == 1 and warnings[0]["requested_rate"] == 50
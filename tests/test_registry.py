@@ -0,0 +1,39 @@
+"""registry: сдвиг начальной строки диапазона A1 и диапазон записи магазинов."""
+import pytest
+
+from registry import load_registry, shift_start_row
+
+MARKETPLACE = {'wb': {'name': 'Wildberries', 'adapter': 'wb', 'table_prefix': 'product_data_wb', 'key_col': 'nmID'}}
+
+
+@pytest.mark.parametrize("sheet_range, expected", [
+    ("Sheet!A1:Z", "Sheet!A3:Z"),
+    ("Sheet!A1:Z100", "Sheet!A3:Z100"),
+    ("Sheet!B10", "Sheet!B12"),
+    ("Sheet!$A$1:$K", "Sheet!$A$3:$K"),
+    # Цифра 1 в имени листа и в столбце не затрагивается
+    ("WB1!AA1:AB", "WB1!AA3:AB"),
+    ("'Цены 2024'!A1:K", "'Цены 2024'!A3:K"),
+    ("'It''s sheet'!C1:K", "'It''s sheet'!C3:K"),
+    ("'Лист!1'!A1:K", "'Лист!1'!A3:K"),
+])
+def test_shift_start_row(sheet_range, expected):
+    assert shift_start_row(sheet_range, 2) == expected
+
+
+@pytest.mark.parametrize("sheet_range", ["Sheet!A:Z", "Sheet!A", "A1:Z", "Sheet!A1:", "Sheet!1:5", "", None])
+def test_shift_start_row_rejects_range_without_start_cell(sheet_range):
+    with pytest.raises(ValueError):
+        shift_start_row(sheet_range, 2)
+
+
+def test_write_range_defaults_to_shifted_range():
+    shops = [{'marketplace': 'wb', 'shop': 'A', 'range': "'WB A'!A1:I"},
+             {'marketplace': 'wb', 'shop': 'B', 'range': 'WB_B!A1:I', 'write_range': 'WB_B!A5:I'}]
+    assert [shop.write_range for shop in load_registry(MARKETPLACE, shops)] == ["'WB A'!A3:I", "WB_B!A5:I"]
+
+
+def test_invalid_range_names_the_shop():
+    shops = [{'marketplace': 'wb', 'shop': 'A', 'range': 'WB_A!A:I'}]
+    with pytest.raises(ValueError, match="Магазин A маркетплейса wb"):
+        load_registry(MARKETPLACE, shops)
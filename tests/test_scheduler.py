@@ -0,0 +1,92 @@
+"""Scheduler: общее чтение волны, независимое завершение заданий и порядок старта по приоритету."""
+import asyncio
+
+from scheduler import Scheduler, ScheduledJob
+
+
+def make_wave(*jobs, scheduled=0.0):
+    for job in jobs:
+        job.running = True
+    return [(job, scheduled) for job in jobs]
+
+
+def test_slow_job_does_not_hold_other_jobs():
+    slow, fast = ScheduledJob("slow", 60, "slow"), ScheduledJob("fast", 60, "fast")
+    release = asyncio.Event()
+    reads, finished = [], []
+
+    async def read_wave(jobs):
+        reads.append([job.name for job in jobs])
+        return "wave"
+
+    async def run_job(job, wave):
+        assert wave == "wave"
+        if job.name == "slow":
+            await release.wait()
+        return True
+
+    async def finish_wave(wave, jobs, results):
+        finished.append(results)
+
+    async def scenario():
+        scheduler = Scheduler(run_job, read_wave=read_wave, finish_wave=finish_wave, jitter_seconds=0)
+        task = asyncio.create_task(scheduler._run(make_wave(slow, fast)))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        # Быстрое задание освобождено, пока медленное еще выполняется; итоги волны ждут оба задания
+        assert not fast.running and fast.runs == 1
+        assert slow.running and slow.runs == 0
+        assert finished == []
+        release.set()
+        await task
+        assert not slow.running and slow.runs == 1
+
+    asyncio.run(scenario())
+    assert reads == [["slow", "fast"]]
+    assert finished == [[True, True]]
+
+
+def test_failed_job_is_released_and_reported():
+    broken, healthy = ScheduledJob("broken", 60, None), ScheduledJob("healthy", 60, None)
+    finished = []
+
+    async def run_job(job, wave):
+        if job.name == "broken":
+            raise RuntimeError("boom")
+        return True
+
+    async def finish_wave(wave, jobs, results):
+        finished.append(results)
+
+    scheduler = Scheduler(run_job, finish_wave=finish_wave, jitter_seconds=0)
+    asyncio.run(scheduler._run(make_wave(broken, healthy)))
+    assert finished == [[False, True]]
+    assert not broken.running and not healthy.running
+
+
+def test_failed_read_releases_jobs():
+    job = ScheduledJob("job", 60, None)
+
+    async def read_wave(jobs):
+        raise RuntimeError("sheets unavailable")
+
+    async def run_job(job, wave):
+        raise AssertionError("задание не должно запускаться без данных волны")
+
+    asyncio.run(Scheduler(run_job, read_wave=read_wave, jitter_seconds=0)._run(make_wave(job)))
+    assert not job.running
+
+
+def test_jitter_keeps_priority_order():
+    jobs = [ScheduledJob(f"p{priority}", 60, None, priority=priority) for priority in (0, 5, 1, 3)]
+    started = []
+
+    async def run_job(job, wave):
+        started.append(job.name)
+
+    scheduler = Scheduler(run_job, jitter_seconds=0.05)
+    for job in jobs:
+        job.next_run = 0.0
+        scheduler.add_job(job)
+    asyncio.run(scheduler._run(scheduler._collect_due(0.0)))
+    assert started == ["p5", "p3", "p1", "p0"]
@@ -0,0 +1,101 @@
+"""SnapshotCache.diff и merge_updated_rows: новые, удаленные, переставленные строки, повторяющиеся ключи и сборка результата."""
+import asyncio
+
+import pandas as pd
+import pytest
+
+import db
+from data_updater import NO_VALUE
+from snapshot_cache import SnapshotCache, merge_updated_rows
+
+
+@pytest.fixture
+def cache(tmp_path):
+    # Базы нет: первый снимок строится по самому DataFrame
+    yield SnapshotCache(db_name=str(tmp_path / "missing.db"), full_run_minutes=60)
+    db.close_databases()
+
+
+def sheet(rows):
+    return pd.DataFrame(rows, columns=["id", "price", "stock"])
+
+
+def committed(cache, df):
+    """Фиксирует снимок df, как после успешной записи цикла"""
+    delta = asyncio.run(cache.diff("goods", df, "id"))
+    cache.stage("goods", delta.snapshot, "Лист!A3:C")
+    cache.commit()
+    return delta
+
+
+BASE = [["id", "price", "stock"], ["1", "100", "5"], ["2", "200", "6"], ["3", "300", "7"]]
+
+
+def test_first_diff_is_full(cache):
+    df = sheet(BASE)
+    delta = committed(cache, df)
+    assert delta.full
+    assert list(delta.changed_labels) == list(df.index)
+
+
+def test_inserted_changed_and_removed_rows(cache):
+    committed(cache, sheet(BASE))
+    df = sheet([BASE[0], ["1", "100", "5"], ["2", "250", "6"], ["4", "400", "8"]])
+    delta = asyncio.run(cache.diff("goods", df, "id"))
+    assert not delta.full
+    assert (delta.inserted, delta.changed) == (1, 1)
+    assert list(delta.changed_labels) == [2, 3]
+    assert delta.removed_keys == [("3",)]
+
+
+def test_reordered_rows_are_unchanged(cache):
+    committed(cache, sheet(BASE))
+    df = sheet([BASE[0], BASE[3], BASE[1], BASE[2]])
+    delta = asyncio.run(cache.diff("goods", df, "id"))
+    assert not delta.full
+    assert (delta.inserted, delta.changed, delta.removed_keys) == (0, 0, [])
+    assert len(delta.changed_labels) == 0
+
+
+def test_duplicate_keys_force_full_run_without_snapshot(cache):
+    committed(cache, sheet(BASE))
+    df = sheet(BASE + [["2", "999", "1"]])
+    delta = asyncio.run(cache.diff("goods", df, "id"))
+    assert delta.full and delta.snapshot is None
+    assert list(delta.changed_labels) == list(df.index)
+
+
+def test_snapshot_is_kept_until_commit(cache):
+    committed(cache, sheet(BASE))
+    changed = sheet([BASE[0], ["1", "111", "5"], BASE[2], BASE[3]])
+    delta = asyncio.run(cache.diff("goods", changed, "id"))
+    cache.stage("goods", delta.snapshot, "Лист!A3:C")
+    cache.discard()
+    # Запись не состоялась: следующий цикл снова видит изменение
+    assert asyncio.run(cache.diff("goods", changed, "id")).changed == 1
+
+
+def test_failed_range_is_processed_fully_next_cycle(cache):
+    committed(cache, sheet(BASE))
+    delta = asyncio.run(cache.diff("goods", sheet(BASE), "id"))
+    cache.stage("goods", delta.snapshot, "Лист!A3:C")
+    cache.commit(failed_ranges={"Лист!A3:C"})
+    assert asyncio.run(cache.diff("goods", sheet(BASE), "id")).full
+
+
+def test_merge_updated_rows_into_full_frame():
+    df = sheet([BASE[0], ["1", "100", ""], ["2", "200", "6"], ["3", "300", "7"]])
+    updated_rows = pd.DataFrame({"price": ["210"]}, index=[2])
+    merged = merge_updated_rows(df, updated_rows)
+    # Заголовок отброшен, необработанные строки как после update_price, обработанные - из результата
+    assert list(merged.index) == [1, 2, 3]
+    assert merged.loc[1].tolist() == ["1", "100", NO_VALUE]
+    assert merged.loc[2].tolist() == ["2", "210", "6"]
+    assert merged.loc[3].tolist() == ["3", "300", "7"]
+
+
+def test_merge_without_updated_rows():
+    df = sheet(BASE)
+    merged = merge_updated_rows(df, None)
+    assert merged.equals(df.iloc[1:])
+    assert merge_updated_rows(df, pd.DataFrame()).equals(df.iloc[1:])
@@ -0,0 +1,89 @@
+"""SnapshotStore (формат sqlite): сохранение полного снимка и дельт, восстановление на момент и очистка по сроку."""
+import asyncio
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import db
+from snapshot_store import SnapshotStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    yield SnapshotStore('sqlite', directory=str(tmp_path / "snapshots"), db_name=str(tmp_path / "manifest.db"),
+                        full_run_minutes=60, retention_days=None)
+    db.close_databases()
+
+
+def sheet(rows):
+    # Ключ не первым столбцом: хранилище переставляет его вперед и восстанавливает исходный порядок
+    return pd.DataFrame(rows, columns=["name", "id", "price"], dtype=object)
+
+
+DAY1 = [["Чай", "1", "100"], ["Кофе", "2", "200"], ["Сахар", "3", None]]
+DAY2 = [["Чай", "1", "100"], ["Кофе", "2", "250"], ["Соль", "4", "007"]]
+
+
+def save(store, df, timestamp):
+    return asyncio.run(store.save("goods", df, "id", cycle_timestamp=timestamp))
+
+
+def load(store, at=None, columns=None):
+    return asyncio.run(store.load("goods", at=at, columns=columns))
+
+
+def test_full_and_delta_round_trip(store):
+    first = save(store, sheet(DAY1), "2026-01-01 10:00:00")
+    second = save(store, sheet(DAY2), "2026-01-02 10:00:00")
+    assert (first.kind, first.changed) == ("full", 3)
+    # Изменена строка 2 и добавлена строка 4; строка 3 удалена
+    assert (second.kind, second.rows, second.changed) == ("delta", 3, 2)
+
+    pd.testing.assert_frame_equal(load(store), sheet(DAY2))
+    pd.testing.assert_frame_equal(load(store, at="2026-01-01 12:00:00"), sheet(DAY1))
+    pd.testing.assert_frame_equal(load(store, at=datetime(2026, 1, 2, 10)), sheet(DAY2))
+    assert load(store, at="2025-12-31 00:00:00") is None
+
+
+def test_unchanged_sheet_is_not_saved(store):
+    save(store, sheet(DAY1), "2026-01-01 10:00:00")
+    assert save(store, sheet(DAY1), "2026-01-01 10:05:00") is None
+    assert [entry.kind for entry in asyncio.run(store.entries("goods"))] == ["full"]
+
+
+def test_load_selected_columns(store):
+    save(store, sheet(DAY1), "2026-01-01 10:00:00")
+    save(store, sheet(DAY2), "2026-01-02 10:00:00")
+    loaded = load(store, columns=["price"])
+    pd.testing.assert_frame_equal(loaded, sheet(DAY2)[["id", "price"]])
+
+
+def test_duplicate_keys_are_saved_as_full(store):
+    save(store, sheet(DAY1), "2026-01-01 10:00:00")
+    duplicated = sheet(DAY1 + [["Чай", "1", "999"]])
+    assert save(store, duplicated, "2026-01-02 10:00:00").kind == "full"
+    pd.testing.assert_frame_equal(load(store), duplicated)
+
+
+def test_prune_keeps_full_snapshot_needed_for_retention(store):
+    save(store, sheet(DAY1), "2026-01-01 10:00:00")
+    save(store, sheet(DAY2), "2026-01-02 10:00:00")
+    store.full_run_seconds = 0
+    save(store, sheet(DAY1), "2026-01-03 10:00:00")
+    store.full_run_seconds = 3600
+    save(store, sheet(DAY2), "2026-01-04 10:00:00")
+    assert [entry.kind for entry in asyncio.run(store.entries("goods"))] == ["full", "delta"]
+
+    store.retention_days = 1
+    # Срок хранения начинается 3 января в 11:00: для него нужен полный снимок 3 января, более ранние удаляются
+    assert asyncio.run(store.prune("goods", now=datetime(2026, 1, 4, 11))) == 2
+    assert asyncio.run(store.prune("goods", now=datetime(2026, 1, 4, 11))) == 0
+    assert load(store, at="2026-01-02 12:00:00") is None
+    pd.testing.assert_frame_equal(load(store, at="2026-01-03 12:00:00"), sheet(DAY1))
+    pd.testing.assert_frame_equal(load(store), sheet(DAY2))
+
+    def blobs(conn):
+        return conn.execute("SELECT COUNT(DISTINCT snapshot) FROM snapshot_columns").fetchone()[0]
+
+    assert asyncio.run(db.get_database(store._backend.db_name).read(blobs)) == 2
@@ -0,0 +1,131 @@
+"""Векторизованный update_price дает те же updated_df, price_changed_df и строки price_change_log,
+что и построчная реализация из reference_update_price.py (включая типы значений)."""
+import asyncio
+import math
+import random
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_updater import update_price
+from reference_update_price import reference_update_price
+
+LOG_TABLE = 'price_change_log'
+LOG_SCHEMA = ('(timestamp TEXT, id TEXT, product_id TEXT, old_price REAL, new_price REAL, old_discount REAL, '
+              'new_discount REAL, prim TEXT, change_applied INTEGER)')
+LOG_QUERY = (f"SELECT id, product_id, old_price, new_price, old_discount, new_discount, prim, change_applied "
+             f"FROM {LOG_TABLE} ORDER BY rowid")
+COLUMNS = ['id', 'product_id', 'price', 't_price', 'price_old', 'old_price', 'prim', 'extra']
+DISCOUNT = dict(old_disc_in_base_col='price_old', old_disc_manual_col='old_price')
+VALUES = ['', '0', '100', '100.0', '149', '151', '200', '50', '0.0', 'abc', '1,5', 'nan', 'inf', '-inf', '-100',
+          ' 120 ', '1e2', None, np.nan, '99.5', '100']
+DISCOUNT_VALUES = VALUES + ['5', '10'] * 4
+
+
+def make_frame(rows, columns=COLUMNS):
+    """Таблица как из Google Sheets: первая строка - заголовки, update_price ее пропускает"""
+    return pd.DataFrame([['hdr'] * len(columns)] + rows, columns=columns)
+
+
+def random_frame(seed, n=300):
+    rng = random.Random(seed)
+    rows = [[str(i), str(1000 + i), rng.choice(VALUES), rng.choice(VALUES), rng.choice(DISCOUNT_VALUES),
+             rng.choice(DISCOUNT_VALUES), rng.choice(['', 'note', None]), 'x'] for i in range(n)]
+    return make_frame(rows)
+
+
+def run_current(df, db_path, **kwargs):
+    updated_df, price_changed_df = asyncio.run(
+        update_price(df.copy(), sqlite_db_name=str(db_path), price_change_log_table=LOG_TABLE, **kwargs))
+    conn = sqlite3.connect(db_path)
+    log_rows = conn.execute(LOG_QUERY).fetchall()
+    conn.close()
+    return updated_df, price_changed_df, log_rows
+
+
+def run_reference(df, **kwargs):
+    """Эталонные строки журнала проходят через ту же таблицу SQLite, чтобы сравнивать значения после приведения типов"""
+    updated_df, price_changed_df, rows = reference_update_price(df.copy(), **kwargs)
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"CREATE TABLE {LOG_TABLE} {LOG_SCHEMA}")
+    conn.executemany(f"INSERT INTO {LOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [('2024-01-01 00:00:00',) + row for row in rows])
+    log_rows = conn.execute(LOG_QUERY).fetchall()
+    conn.close()
+    return updated_df, price_changed_df, log_rows
+
+
+def same_value(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (math.isnan(a) and math.isnan(b))
+    return type(a) is type(b) and a == b
+
+
+def assert_same_frame(actual, expected):
+    assert list(actual.columns) == list(expected.columns)
+    assert list(actual.index) == list(expected.index)
+    for column in expected.columns:
+        for label, a, b in zip(expected.index, actual[column].tolist(), expected[column].tolist()):
+            assert same_value(a, b), f"{column}[{label}]: {a!r} != {b!r}"
+
+
+def assert_same_log(actual, expected):
+    assert len(actual) == len(expected)
+    for a, b in zip(actual, expected):
+        assert len(a) == len(b) and all(same_value(x, y) for x, y in zip(a, b)), f"{a!r} != {b!r}"
+
+
+def assert_equivalent(df, db_path, **kwargs):
+    updated_df, price_changed_df, log_rows = run_current(df, db_path, **kwargs)
+    ref_updated_df, ref_price_changed_df, ref_log_rows = run_reference(df, **kwargs)
+    assert_same_frame(updated_df, ref_updated_df)
+    assert_same_frame(price_changed_df, ref_price_changed_df)
+    assert_same_log(log_rows, ref_log_rows)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("discount", [False, True], ids=["no_discount", "discount"])
+def test_random_frames(tmp_path, seed, discount):
+    assert_equivalent(random_frame(seed), tmp_path / "log.db", **(DISCOUNT if discount else {}))
+
+
+@pytest.mark.parametrize("discount", [False, True], ids=["no_discount", "discount"])
+def test_without_prim_column(tmp_path, discount):
+    df = random_frame(7).drop(columns=['prim'])
+    assert_equivalent(df, tmp_path / "log.db", **(DISCOUNT if discount else {}))
+
+
+@pytest.mark.parametrize("discount", [False, True], ids=["no_discount", "discount"])
+def test_without_discount_columns_in_frame(tmp_path, discount):
+    df = random_frame(11).drop(columns=['price_old', 'old_price'])
+    if discount:
+        with pytest.raises(KeyError):
+            reference_update_price(df.copy(), **DISCOUNT)
+        with pytest.raises(KeyError):
+            run_current(df, tmp_path / "log.db", **DISCOUNT)
+    else:
+        assert_equivalent(df, tmp_path / "log.db")
+
+
+@pytest.mark.parametrize("discount", [False, True], ids=["no_discount", "discount"])
+@pytest.mark.parametrize("old, new", [
+    ('0', '100'), ('0', '0'), ('0.0', '0'), ('100', '0'), ('100', '0.0'),  # нулевые цены
+    ('100', '151'), ('100', '150'), ('100', '49'), ('100', '50'), ('100', '-100'),  # изменение больше 50%
+    ('100', '149'), ('100', '100.0'), ('100', '1e2'), (' 120 ', '100'),  # обычное изменение и без изменений
+    ('100', 'nan'), ('nan', '100'), ('100', 'inf'), ('inf', '100'), ('-inf', '100'),  # nan / inf
+    ('abc', '100'), ('100', '1,5'), ('', '100'), ('100', None), (np.nan, np.nan),  # неразборчивые и пустые
+])
+def test_single_row_cases(tmp_path, discount, old, new):
+    df = make_frame([['1', '1001', old, new, '5', '10', 'note', 'x'],
+                     ['2', '1002', old, new, '', '', '', 'x'],
+                     ['3', '1003', old, new, 'abc', '10', None, 'x']])
+    assert_equivalent(df, tmp_path / "log.db", **(DISCOUNT if discount else {}))
+
+
+def test_all_rows_unchanged(tmp_path):
+    df = make_frame([[str(i), str(1000 + i), '100', '100', '5', '5', '', 'x'] for i in range(10)])
+    updated_df, price_changed_df, log_rows = run_current(df, tmp_path / "log.db", **DISCOUNT)
+    assert price_changed_df.empty and log_rows == []
+    assert_equivalent(df, tmp_path / "log2.db", **DISCOUNT)